@@ -0,0 +1,216 @@
+"""
+Async variants of the read-heavy endpoints, for running under an ASGI
+server (``uvicorn pharmacy.asgi:application``).
+
+DRF's views are sync-only, so these are plain Django async views. They
+return the same JSON as their sync counterparts in ``api.views``, rendered
+with DRF's JSONRenderer. Only page-number pagination is supported.
+"""
+import asyncio
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connections
+from django.db.models import Prefetch
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+
+from .authentication import users_with_profile
+from .cache import acache_response, profile_key, BRANCHES, CATALOG
+from .instrumentation import query_budget
+from .models import Branches, OrderItems, Orders
+from .serializer import (
+    BranchesSerializer, CatalogProductSerializer, OrderHistorySerializer, OrdersSerializer, UsersSerializer,
+)
+from .views import StandardResultsSetPagination, _parse_bool, _parse_id, catalog_queryset
+
+_authentication = JWTStatelessUserAuthentication()
+
+
+def _json(data, status_code=status.HTTP_200_OK, headers=None):
+    return HttpResponse(
+        JSONRenderer().render(data), status=status_code, content_type='application/json', headers=headers
+    )
+
+
+def token_required(view):
+    """
+    Reject requests without a valid access token the way DRF would. The
+    token is trusted without loading the user, so this never queries;
+    ``request.user`` is a TokenUser. Unlike DRF's authentication, a
+    deactivated user's token still passes: views must filter on
+    ``is_active`` themselves.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            authenticated = _authentication.authenticate(request)
+            if authenticated is None:
+                raise exceptions.NotAuthenticated()
+        except (exceptions.AuthenticationFailed, exceptions.NotAuthenticated) as exc:
+            data = exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail}
+            return _json(
+                data, status.HTTP_401_UNAUTHORIZED,
+                {'WWW-Authenticate': _authentication.authenticate_header(request)},
+            )
+        request.user, request.auth = authenticated
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _keep_worker_connections():
+    # A request's connection under ASGI lives in a thread context that isn't
+    # reused, hence CONN_MAX_AGE 0 there; executor threads persist, so their
+    # connections are kept for DB_WORKER_CONN_MAX_AGE seconds instead. Pooled
+    # connections go back to the pool as usual.
+    for conn in connections.all(initialized_only=True):
+        if conn.connection is None or conn.settings_dict['CONN_MAX_AGE'] != 0:
+            continue
+        if conn.settings_dict.get('OPTIONS', {}).get('pool'):
+            continue
+        if getattr(conn, 'worker_connection', None) is not conn.connection:
+            conn.worker_connection = conn.connection
+            conn.close_at = time.monotonic() + settings.DB_WORKER_CONN_MAX_AGE
+
+
+def _in_worker(call):
+    def run():
+        # Worker threads keep their own connection between requests; apply
+        # its max age and health checks as the request handler would.
+        close_old_connections()
+        try:
+            return call()
+        finally:
+            _keep_worker_connections()
+            close_old_connections()
+    return run
+
+
+async def concurrently(*calls):
+    """
+    Run independent sync ORM calls at the same time, each on its own worker
+    thread and database connection, and return their results.
+
+    The async ORM (``acount()``, ``aiterator()``...) hands every query of a
+    request to the same thread in turn, so gathering those would not
+    overlap them. Calls don't share a transaction.
+    """
+    return await asyncio.gather(
+        *(sync_to_async(_in_worker(call), thread_sensitive=False)() for call in calls)
+    )
+
+
+def _page_size(request, default):
+    # As StandardResultsSetPagination reads ?page_size=.
+    try:
+        page_size = int(request.GET[StandardResultsSetPagination.page_size_query_param])
+    except (KeyError, ValueError):
+        return default
+    if page_size <= 0:
+        return default
+    return min(page_size, StandardResultsSetPagination.max_page_size)
+
+
+async def _paginated(request, queryset, serializer_class, page_size):
+    """
+    A page of ``queryset`` in StandardResultsSetPagination's format. The
+    total count and the page (serialized on its worker thread, where lazy
+    lookups may query) are fetched concurrently.
+    """
+    try:
+        number = int(request.GET.get('page', 1))
+    except ValueError:
+        number = 0
+    if number < 1:
+        return _json({'detail': 'Invalid page.'}, status.HTTP_404_NOT_FOUND)
+
+    offset = (number - 1) * page_size
+    count, results = await concurrently(
+        queryset.count,
+        lambda: serializer_class(queryset[offset:offset + page_size], many=True).data,
+    )
+    if number > 1 and offset >= count:
+        return _json({'detail': 'Invalid page.'}, status.HTTP_404_NOT_FOUND)
+
+    url = request.build_absolute_uri()
+    if number == 1:
+        previous_url = None
+    elif number == 2:
+        previous_url = remove_query_param(url, 'page')
+    else:
+        previous_url = replace_query_param(url, 'page', number - 1)
+    return _json({
+        'count': count,
+        'next': replace_query_param(url, 'page', number + 1) if offset + page_size < count else None,
+        'previous': previous_url,
+        'results': results,
+    })
+
+
+@query_budget(1)
+@require_GET
+@acache_response(BRANCHES)
+async def async_get_branches(request):
+    branches = [branch async for branch in Branches.objects.aiterator()]
+    return _json(BranchesSerializer(branches, many=True).data)
+
+
+@query_budget(2)
+@require_GET
+@acache_response(CATALOG)
+async def async_get_products(request):
+    branch_id = request.GET.get('branch')
+    if branch_id is not None:
+        try:
+            branch_id = _parse_id(branch_id)
+        except ValueError:
+            return _json({'error': 'Invalid branch'}, status.HTTP_400_BAD_REQUEST)
+    in_stock = _parse_bool(request.GET.get('in_stock', False))
+
+    products = catalog_queryset(branch_id=branch_id, in_stock=in_stock)
+    return await _paginated(
+        request, products, CatalogProductSerializer, _page_size(request, StandardResultsSetPagination.page_size)
+    )
+
+
+@query_budget(4)
+@require_GET
+@token_required
+async def async_get_orders(request):
+    # A deactivated user's token isn't rejected (get_orders answers 401), but
+    # their orders are left out, so they get an empty page.
+    orders = Orders.objects.filter(user_id=request.user.id, user__id__is_active=True).order_by(
+        '-created_at', '-order_id'
+    )
+    if _parse_bool(request.GET.get('expand', False)):
+        orders = orders.select_related('branch').prefetch_related(
+            Prefetch('orderitems_set', queryset=OrderItems.objects.select_related('product'))
+        )
+        serializer_class = OrderHistorySerializer
+    else:
+        orders = orders.prefetch_related('orderitems_set')
+        serializer_class = OrdersSerializer
+    return await _paginated(request, orders, serializer_class, _page_size(request, 3))
+
+
+@query_budget(1)
+@require_GET
+@token_required
+async def async_get_user(request):
+    # Shares get_user's cached payload.
+    key = profile_key(request.user.id)
+    data = await cache.aget(key)
+    if data is None:
+        user = await users_with_profile().filter(pk=request.user.id, is_active=True).afirst()
+        if user is None:
+            return _json({'error': 'User not found'}, status.HTTP_404_NOT_FOUND)
+        data = UsersSerializer(user).data
+        await cache.aset(key, data, settings.PROFILE_CACHE_TIMEOUT)
+    return _json(data)
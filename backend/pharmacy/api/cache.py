@@ -0,0 +1,112 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+BRANCHES = 'branches'
+CATALOG = 'catalog'
+
+
+def _version_key(namespace):
+    return f'version:{namespace}'
+
+
+def get_version(namespace):
+    return cache.get_or_set(_version_key(namespace), 1, None)
+
+
+async def aget_version(namespace):
+    return await cache.aget_or_set(_version_key(namespace), 1, None)
+
+
+def bump_version(namespace):
+    """Invalidate every cached response that depends on ``namespace``."""
+    try:
+        cache.incr(_version_key(namespace))
+    except ValueError:
+        cache.set(_version_key(namespace), 2, None)
+
+
+def profile_key(user_id):
+    return f'profile:{user_id}'
+
+
+def invalidate_profile(user_id):
+    cache.delete(profile_key(user_id))
+
+
+def _response_key(view, versions, request):
+    digest = hashlib.md5(
+        f'{view.__name__}:{".".join(map(str, versions))}:{request.build_absolute_uri()}'.encode()
+    ).hexdigest()
+    return f'response:{digest}'
+
+
+def _etag(content):
+    return f'"{hashlib.md5(content).hexdigest()}"'
+
+
+def _not_modified(request, etag):
+    return etag in parse_etags(request.headers.get('If-None-Match', ''))
+
+
+def cache_response(*namespaces, timeout=None):
+    """
+    Cache a GET view's response data under the current versions of
+    ``namespaces`` and the request URL.
+
+    The ETag is a hash of the rendered response and is cached with it, so
+    it changes only when the content does. If-None-Match is answered with
+    304 from the cached entry, before the view or the serializer runs.
+    Entries expire after RESPONSE_CACHE_TIMEOUT, so a worker whose
+    per-process cache missed an invalidation stops answering 304 to stale
+    ETags when they do. Only 200 responses are cached. Place it below
+    ``@api_view``.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = _response_key(view, [get_version(namespace) for namespace in namespaces], request)
+            entry = cache.get(key)
+            if entry is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                entry = (_etag(JSONRenderer().render(response.data)), response.data)
+                cache.set(key, entry, timeout or settings.RESPONSE_CACHE_TIMEOUT)
+            etag, data = entry
+            if _not_modified(request, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            return Response(data, headers={'ETag': etag})
+        return wrapper
+    return decorator
+
+
+def acache_response(*namespaces, timeout=None):
+    """
+    ``cache_response`` for async views returning rendered JSON: the response
+    body is cached with its ETag, and 304s are answered the same way.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            key = _response_key(view, [await aget_version(namespace) for namespace in namespaces], request)
+            entry = await cache.aget(key)
+            if entry is None:
+                response = await view(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                entry = (_etag(response.content), response.content)
+                await cache.aset(key, entry, timeout or settings.RESPONSE_CACHE_TIMEOUT)
+            etag, content = entry
+            if _not_modified(request, etag):
+                return HttpResponseNotModified(headers={'ETag': etag})
+            return HttpResponse(content, content_type='application/json', headers={'ETag': etag})
+        return wrapper
+    return decorator
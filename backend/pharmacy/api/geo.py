@@ -0,0 +1,129 @@
+import heapq
+import math
+import threading
+
+from .models import Branches
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _to_xyz(latitude, longitude):
+    lat = math.radians(float(latitude))
+    lng = math.radians(float(longitude))
+    return (math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat))
+
+
+def _chord_to_km(chord):
+    return 2 * math.asin(min(chord / 2, 1.0)) * EARTH_RADIUS_KM
+
+
+def _km_to_chord(km):
+    return 2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)
+
+
+class KDTree:
+    """
+    Static 3-d tree over points on the unit sphere.
+
+    Coordinates are stored as unit vectors, so straight-line (chord) distance
+    orders points exactly like great-circle distance and a plain Euclidean
+    k-nearest search gives the geographically nearest items.
+    """
+
+    def __init__(self, points):
+        # points: list of ((x, y, z), item)
+        self._points = list(points)
+        self._root = self._build(list(range(len(self._points))), 0)
+
+    def __len__(self):
+        return len(self._points)
+
+    def _build(self, indexes, depth):
+        if not indexes:
+            return None
+        axis = depth % 3
+        indexes.sort(key=lambda index: self._points[index][0][axis])
+        middle = len(indexes) // 2
+        return (
+            indexes[middle],
+            axis,
+            self._build(indexes[:middle], depth + 1),
+            self._build(indexes[middle + 1:], depth + 1),
+        )
+
+    def nearest(self, target, k, max_chord=None):
+        """Return up to ``k`` (chord distance, item) pairs, closest first."""
+        if k <= 0:
+            return []
+        limit = math.inf if max_chord is None else max_chord * max_chord
+        heap = []  # (-squared distance, index), the worst match on top
+
+        def search(node):
+            if node is None:
+                return
+            index, axis, left, right = node
+            point = self._points[index][0]
+            distance = sum((a - b) * (a - b) for a, b in zip(target, point))
+            if distance <= limit:
+                if len(heap) < k:
+                    heapq.heappush(heap, (-distance, index))
+                elif distance < -heap[0][0]:
+                    heapq.heapreplace(heap, (-distance, index))
+            delta = target[axis] - point[axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            search(near)
+            bound = limit if len(heap) < k else min(limit, -heap[0][0])
+            if delta * delta <= bound:
+                search(far)
+
+        search(self._root)
+        return [
+            (math.sqrt(-distance), self._points[index][1])
+            for distance, index in sorted(heap, reverse=True)
+        ]
+
+
+class BranchIndex:
+    """
+    Nearest-branch lookups over every branch with coordinates.
+
+    The tree is built lazily from one query and dropped whenever a branch is
+    saved or deleted (see ``api.signals``), so the next lookup rebuilds it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tree = None
+        self._generation = 0
+
+    def _get_tree(self):
+        tree = self._tree
+        if tree is None:
+            with self._lock:
+                tree = self._tree
+                if tree is None:
+                    generation = self._generation
+                    branches = Branches.objects.filter(
+                        latitude__isnull=False, longitude__isnull=False
+                    )
+                    tree = KDTree(
+                        (_to_xyz(branch.latitude, branch.longitude), branch)
+                        for branch in branches
+                    )
+                    # Don't keep a tree built from rows changed mid-build.
+                    if generation == self._generation:
+                        self._tree = tree
+        return tree
+
+    def nearest(self, latitude, longitude, limit=10, radius_km=None):
+        """Return up to ``limit`` (branch, distance in km) pairs, closest first."""
+        max_chord = None if radius_km is None else _km_to_chord(radius_km)
+        matches = self._get_tree().nearest(_to_xyz(latitude, longitude), limit, max_chord)
+        return [(branch, _chord_to_km(chord)) for chord, branch in matches]
+
+    def invalidate(self):
+        self._generation += 1
+        self._tree = None
+
+
+branch_index = BranchIndex()
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKeys
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(method, path, data):
+    body = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f'{method} {path}\n{body}'.encode()).hexdigest()
+
+
+def _claim(user_id, key, fingerprint):
+    """
+    Insert ``key`` for ``user_id`` and return ``(record, True)``, or return
+    ``(existing record, False)`` if another request holds it. A key that has
+    expired, or was left in flight longer than IDEMPOTENCY_LOCK_TIMEOUT by a
+    worker that died, is deleted and claimed afresh.
+    """
+    while True:
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKeys.objects.create(
+                    user_id=user_id,
+                    key=key,
+                    request_hash=fingerprint,
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                )
+            return record, True
+        except IntegrityError:
+            pass
+        record = IdempotencyKeys.objects.filter(user_id=user_id, key=key).first()
+        if record is None:
+            continue
+        abandoned = record.status_code is None and record.created_at <= now - timedelta(
+            seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT
+        )
+        if record.expires_at > now and not abandoned:
+            return record, False
+        # Matching created_at too means only one of several racing requests takes it over.
+        IdempotencyKeys.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+
+
+def _await_response(record):
+    """Poll an in-flight key for up to IDEMPOTENCY_WAIT_SECONDS; None if it was dropped."""
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    delay = 0.05
+    while record is not None and record.status_code is None and time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+        record = IdempotencyKeys.objects.filter(pk=record.pk).first()
+    return record
+
+
+def idempotent(view):
+    """
+    Let authenticated clients retry a POST view safely by sending an
+    ``Idempotency-Key`` header. Apply it below ``@api_view`` and the
+    permission decorators.
+
+    The first request with a key runs the view and stores its response
+    under (user, key) for IDEMPOTENCY_KEY_TTL seconds. The view's work and
+    the stored response commit together. Repeats get that response back
+    with ``Idempotent-Replayed: true`` without running the view. A repeat
+    that arrives while the first request is still running waits up to
+    IDEMPOTENCY_WAIT_SECONDS for it, then gets 409. Reusing a key for a
+    different request gets 422. Only successful (2xx) responses are stored:
+    this API's client errors (short stock, a prescription not yet approved
+    or already decided) can change once the client or someone else acts,
+    so a retry with the same key runs the view again, as after a 5xx.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        if not 0 < len(key) <= MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = request_fingerprint(request.method, request.path, request.data)
+        record, claimed = _claim(request.user.id, key, fingerprint)
+        if not claimed:
+            if record.request_hash != fingerprint:
+                return Response(
+                    {'error': f'{HEADER} was already used for a different request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            record = _await_response(record)
+            if record is None or record.status_code is None:
+                return Response(
+                    {'error': f'A request with this {HEADER} is still in progress'},
+                    status=status.HTTP_409_CONFLICT,
+                    headers={'Retry-After': '1'},
+                )
+            return Response(
+                record.response_body, status=record.status_code, headers={'Idempotent-Replayed': 'true'}
+            )
+
+        try:
+            with transaction.atomic():
+                response = view(request, *args, **kwargs)
+                if status.is_success(response.status_code):
+                    IdempotencyKeys.objects.filter(pk=record.pk).update(
+                        status_code=response.status_code, response_body=response.data
+                    )
+                    return response
+        except Exception:
+            record.delete()
+            raise
+        record.delete()
+        return response
+    return wrapper
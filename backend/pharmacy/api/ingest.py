@@ -0,0 +1,326 @@
+import atexit
+import csv
+import io
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import rollups
+from .models import (
+    Products,
+    UserActivityLogs,
+    UserProductViews,
+    UserSearchLogs,
+    UserUiInteractions,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_EVENTS_PER_REQUEST = 1000
+
+# Largest value the integer columns events are written to can hold.
+MAX_INTEGER = 2147483647
+
+# event type -> (model, timestamp field, {field: (type, max_length, required)})
+EVENT_SCHEMAS = {
+    'ui_interaction': (UserUiInteractions, 'occurred_at', {
+        'component': (str, 100, True),
+        'action': (str, 100, True),
+        'value': (str, 255, False),
+    }),
+    'product_view': (UserProductViews, 'viewed_at', {
+        'product': (int, None, True),
+    }),
+    'activity': (UserActivityLogs, 'recorded_at', {
+        'time_spent_seconds': (int, None, True),
+        'points_earned': (int, None, False),
+    }),
+    'search': (UserSearchLogs, 'searched_at', {
+        'keyword': (str, 255, False),
+        'category': (str, 100, False),
+        'search_filters': (str, 255, False),
+        'results_count': (int, None, False),
+    }),
+}
+
+
+def _check_field(name, value, expected, max_length, required):
+    if value is None:
+        return f'{name} is required' if required else None
+    if expected is int:
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            return f'{name} must be a non-negative integer'
+        if value > MAX_INTEGER:
+            return f'{name} must be at most {MAX_INTEGER}'
+    elif not isinstance(value, str):
+        return f'{name} must be a string'
+    elif max_length and len(value) > max_length:
+        return f'{name} must be at most {max_length} characters'
+    elif required and not value:
+        return f'{name} is required'
+    return None
+
+
+def _event_time(value, now):
+    """
+    When an event happened: the client's ISO 8601 ``timestamp`` if it sent
+    one, else ``now``. Returns ``(moment, error)``. A client clock may run
+    up to EVENT_MAX_CLOCK_SKEW seconds ahead, and events held offline may
+    be up to EVENT_MAX_AGE seconds old.
+    """
+    if value is None:
+        return now, None
+    try:
+        moment = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:
+        moment = None
+    if moment is None or timezone.is_naive(moment):
+        return None, 'timestamp must be an ISO 8601 date and time with a UTC offset'
+    if moment > now + timedelta(seconds=settings.EVENT_MAX_CLOCK_SKEW):
+        return None, 'timestamp is in the future'
+    if moment < now - timedelta(seconds=settings.EVENT_MAX_AGE):
+        return None, f'timestamp is more than {settings.EVENT_MAX_AGE} seconds old'
+    return moment, None
+
+
+def validate_events(user_id, events):
+    """
+    Check raw event dicts against EVENT_SCHEMAS without model serializers.
+
+    Returns ``(rows, rejected)`` where ``rows`` is a list of (model, field
+    values) ready to insert and ``rejected`` lists ``{'index', 'error'}`` for
+    every event that failed. Product ids are checked with one query.
+    """
+    rows = []
+    rejected = []
+    now = timezone.now()
+    product_ids = set()
+    for index, event in enumerate(events):
+        if not isinstance(event, dict) or event.get('type') not in EVENT_SCHEMAS:
+            rejected.append({'index': index, 'error': f'type must be one of {sorted(EVENT_SCHEMAS)}'})
+            continue
+        model, timestamp_field, fields = EVENT_SCHEMAS[event['type']]
+        values = {'user_id': user_id}
+        error = None
+        for name, (expected, max_length, required) in fields.items():
+            value = event.get(name)
+            error = _check_field(name, value, expected, max_length, required)
+            if error:
+                break
+            if value is not None:
+                values['product_id' if name == 'product' else name] = value
+        if not error:
+            values[timestamp_field], error = _event_time(event.get('timestamp'), now)
+        if error:
+            rejected.append({'index': index, 'error': error})
+            continue
+        if 'product_id' in values:
+            product_ids.add(values['product_id'])
+        rows.append((index, model, values))
+
+    if product_ids:
+        existing = set(Products.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        valid_rows = []
+        for index, model, values in rows:
+            if 'product_id' in values and values['product_id'] not in existing:
+                rejected.append({'index': index, 'error': f"Product {values['product_id']} not found"})
+            else:
+                valid_rows.append((index, model, values))
+        rows = valid_rows
+        rejected.sort(key=lambda rejection: rejection['index'])
+    return [(model, values) for _, model, values in rows], rejected
+
+
+def _copy_rows(model, rows):
+    """Insert rows with PostgreSQL COPY; returns False if the driver can't."""
+    # COPY leaves out the defaults Django fills in (default=, auto_now_add),
+    # so every column is written, prepared as bulk_create would prepare it.
+    fields = [field for field in model._meta.concrete_fields if field is not model._meta.auto_field]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in rows:
+        instance = model(**values)
+        prepared = (field.get_db_prep_save(field.pre_save(instance, True), connection) for field in fields)
+        writer.writerow([r'\N' if value is None else value for value in prepared])
+    buffer.seek(0)
+    sql = (
+        f'COPY {connection.ops.quote_name(model._meta.db_table)} '
+        f"({', '.join(connection.ops.quote_name(field.column) for field in fields)}) "
+        r"FROM STDIN WITH (FORMAT csv, NULL '\N')"
+    )
+    with connection.cursor() as cursor:
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, 'copy_expert'):  # psycopg2
+            raw_cursor.copy_expert(sql, buffer)
+        elif hasattr(raw_cursor, 'copy'):  # psycopg 3
+            with raw_cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+        else:
+            return False
+    return True
+
+
+def write_rows(model, rows):
+    if not rows:
+        return
+    if model is UserActivityLogs:
+        rollups.record_activity(rows)
+    if connection.vendor == 'postgresql' and _copy_rows(model, rows):
+        return
+    model.objects.bulk_create([model(**values) for values in rows], batch_size=1000)
+
+
+class WriteBehindQueue:
+    """
+    Bounded in-process queue of event rows, written in bulk by a background
+    thread so requests never wait on the insert.
+
+    The worker wakes once ``max_size`` rows are pending or the oldest pending
+    row is ``max_delay`` seconds old, groups rows per model and writes them
+    with ``write_rows``. At most ``capacity`` rows are held: with the
+    ``block`` policy ``put`` waits up to ``put_timeout`` seconds for room and
+    then drops what still doesn't fit, with ``drop`` it drops the overflow
+    at once. ``stop`` drains what is left (see gunicorn.conf.py).
+    """
+
+    def __init__(self, max_size=None, max_delay=None, capacity=None, policy=None, put_timeout=None):
+        self.max_size = max_size or settings.EVENT_BUFFER_MAX_SIZE
+        self.max_delay = max_delay if max_delay is not None else settings.EVENT_BUFFER_MAX_DELAY
+        self.capacity = capacity or settings.EVENT_QUEUE_CAPACITY
+        self.policy = policy or settings.EVENT_QUEUE_POLICY
+        self.put_timeout = put_timeout if put_timeout is not None else settings.EVENT_QUEUE_PUT_TIMEOUT
+        self._condition = threading.Condition()
+        self._rows = {}
+        self._pending = 0
+        self._oldest = None
+        self._thread = None
+        self._stopping = False
+        self._counters = {'queued': 0, 'flushed': 0, 'dropped': 0, 'failed': 0}
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='event-writer', daemon=True)
+            self._thread.start()
+
+    def put(self, rows):
+        """Queue (model, values) rows; returns how many were dropped."""
+        with self._condition:
+            self._ensure_worker()
+            if self.policy == 'block' and self._pending + len(rows) > self.capacity:
+                self._condition.notify_all()
+                self._condition.wait_for(
+                    lambda: self._pending + len(rows) <= self.capacity, timeout=self.put_timeout
+                )
+            room = max(self.capacity - self._pending, 0)
+            dropped = max(len(rows) - room, 0)
+            if dropped:
+                rows = rows[:room]
+                self._counters['dropped'] += dropped
+            for model, values in rows:
+                self._rows.setdefault(model, []).append(values)
+            if rows and self._oldest is None:
+                self._oldest = time.monotonic()
+            self._pending += len(rows)
+            self._counters['queued'] += len(rows)
+            if self._pending >= self.max_size:
+                self._condition.notify_all()
+        return dropped
+
+    def _take(self):
+        pending, self._rows = self._rows, {}
+        count, self._pending = self._pending, 0
+        self._oldest = None
+        self._condition.notify_all()
+        return pending, count
+
+    def _due(self):
+        if self._stopping or self._pending >= self.max_size:
+            return True
+        return self._oldest is not None and time.monotonic() - self._oldest >= self.max_delay
+
+    def _write(self, pending, count):
+        try:
+            with transaction.atomic():
+                for model, rows in pending.items():
+                    write_rows(model, rows)
+        except Exception:
+            logger.warning('Could not write %d queued events together, retrying separately', count, exc_info=True)
+            written = self._write_separately(pending)
+        else:
+            written = count
+        with self._condition:
+            self._counters['flushed'] += written
+            self._counters['failed'] += count - written
+        return written
+
+    def _write_separately(self, pending):
+        """
+        Write a batch that failed as a whole one model, then one row, at a
+        time, so a bad row (e.g. one whose user has since been deleted) only
+        loses itself and not the other users' events. Returns rows written.
+        """
+        written = 0
+        for model, rows in pending.items():
+            try:
+                with transaction.atomic():
+                    write_rows(model, rows)
+                written += len(rows)
+                continue
+            except Exception:
+                pass
+            failed = 0
+            for values in rows:
+                try:
+                    with transaction.atomic():
+                        write_rows(model, [values])
+                    written += 1
+                except Exception:
+                    failed += 1
+            if failed:
+                logger.error('Dropped %d queued %s rows that could not be written', failed, model.__name__)
+        return written
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._due():
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = max(self.max_delay - (time.monotonic() - self._oldest), 0)
+                    self._condition.wait(timeout)
+                if self._stopping and not self._pending:
+                    return
+                pending, count = self._take()
+            self._write(pending, count)
+            close_old_connections()
+
+    def flush(self):
+        """Write every pending row in the calling thread; returns rows written."""
+        with self._condition:
+            pending, count = self._take()
+        return self._write(pending, count) if count else 0
+
+    def stop(self, timeout=10):
+        """Stop the worker after it drains the queue."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._condition:
+            return {**self._counters, 'pending': self._pending, 'capacity': self.capacity}
+
+
+event_queue = WriteBehindQueue()
+atexit.register(event_queue.stop)
@@ -0,0 +1,292 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in ms, of the latency histogram buckets.
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_IN_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+
+
+def sql_shape(sql):
+    """SQL with variable-length IN lists collapsed, so N+1 lookups compare equal."""
+    return _IN_LIST.sub('(%s, ...)', sql)
+
+
+def is_transaction_control(sql):
+    return sql.startswith(('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT'))
+
+
+def query_budget(limit):
+    """
+    Declare the most SQL queries one request to the view may run, however
+    large its input, not counting transaction control statements. Apply it
+    above ``@api_view``. QueryMetricsMiddleware logs requests over budget and
+    the test suite enforces it.
+    """
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(int(len(sorted_values) * pct / 100), len(sorted_values) - 1)]
+
+
+class QueryRecorder:
+    """
+    connection.execute_wrapper that counts and times every query. It also
+    adds up the request's serializer time (see ``install_serializer_timer``).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.transaction_control = 0
+        self.duration = 0.0
+        self.serialization = 0.0
+        self.shapes = Counter()
+        # Async views may run queries on several threads at once.
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.duration += elapsed
+                self.count += 1
+                if is_transaction_control(sql):
+                    self.transaction_control += 1
+                self.shapes[sql_shape(sql)] += 1
+
+    def add_serialization(self, elapsed):
+        with self._lock:
+            self.serialization += elapsed
+
+    def repeated_shapes(self, threshold):
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+class RequestMetrics:
+    """
+    Rolling per-endpoint samples of the last ``window`` requests, summarised
+    as percentiles and a latency histogram for the admin stats endpoint.
+    """
+
+    def __init__(self, window=None):
+        self.window = window or settings.REQUEST_METRICS_WINDOW
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._n_plus_one = {}
+        self._over_budget = Counter()
+
+    def record(self, endpoint, total_ms, view_ms, serialize_ms, render_ms, db_ms, queries, repeated, over_budget=False):
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen=self.window)
+            samples.append((total_ms, view_ms, serialize_ms, render_ms, db_ms, queries))
+            if over_budget:
+                self._over_budget[endpoint] += 1
+            if repeated:
+                flagged = self._n_plus_one.setdefault(endpoint, {'requests': 0, 'last': None})
+                flagged['requests'] += 1
+                flagged['last'] = {'sql': repeated[0][0], 'count': repeated[0][1]}
+
+    def summary(self):
+        with self._lock:
+            samples = {endpoint: list(values) for endpoint, values in self._samples.items()}
+            n_plus_one = {endpoint: dict(flagged) for endpoint, flagged in self._n_plus_one.items()}
+            over_budget = dict(self._over_budget)
+        data = {}
+        for endpoint, values in samples.items():
+            columns = dict(zip(
+                ('total_ms', 'view_ms', 'serialize_ms', 'render_ms', 'db_ms', 'queries'), map(sorted, zip(*values))
+            ))
+            histogram = dict.fromkeys([f'<={bound}' for bound in LATENCY_BUCKETS] + ['>2500'], 0)
+            for total_ms in columns['total_ms']:
+                bound = next((bound for bound in LATENCY_BUCKETS if total_ms <= bound), None)
+                histogram[f'<={bound}' if bound else '>2500'] += 1
+            data[endpoint] = {
+                'requests': len(values),
+                **{
+                    name: {f'p{pct}': round(_percentile(column, pct), 3) for pct in (50, 95, 99)}
+                    for name, column in columns.items()
+                },
+                'latency_histogram': histogram,
+                'n_plus_one': n_plus_one.get(endpoint, {'requests': 0, 'last': None}),
+                'over_query_budget': over_budget.get(endpoint, 0),
+            }
+        return data
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._n_plus_one.clear()
+            self._over_budget.clear()
+
+
+request_metrics = RequestMetrics()
+
+_current_recorder = ContextVar('query_recorder', default=None)
+_serializing = ContextVar('serializing', default=False)
+
+
+def record_query(execute, sql, params, many, context):
+    """Hand the query to the recorder of the request this code runs for."""
+    recorder = _current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection):
+    """
+    Route ``connection``'s queries through ``record_query``. The request's
+    recorder travels in a context variable, so queries an async view runs on
+    worker threads, each with its own connection, are counted too.
+    """
+    if record_query not in connection.execute_wrappers:
+        # Innermost, so execute_wrapper()'s pop() still removes its own wrapper.
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def _timed_data(data):
+    @wraps(data)
+    def timed(serializer):
+        recorder = _current_recorder.get()
+        if recorder is None or _serializing.get():
+            return data(serializer)
+        token = _serializing.set(True)
+        start = time.perf_counter()
+        try:
+            return data(serializer)
+        finally:
+            _serializing.reset(token)
+            recorder.add_serialization(time.perf_counter() - start)
+    timed.times_serialization = True
+    return timed
+
+
+def install_serializer_timer():
+    """
+    Add the time DRF serializers spend in ``.data`` (to_representation, with
+    any queries it makes) to the current request's recorder. A ``.data``
+    reached from inside another only counts once, in the outer one.
+    """
+    from rest_framework.serializers import BaseSerializer
+
+    if not getattr(BaseSerializer.data.fget, 'times_serialization', False):
+        BaseSerializer.data = property(_timed_data(BaseSerializer.data.fget))
+
+
+class QueryMetricsMiddleware:
+    """
+    Time each request's view, serializers, response rendering and SQL,
+    report them in a ``Server-Timing`` header and add them to
+    ``request_metrics``. Views call their serializers, so ``serialize`` is
+    part of ``view``; ``render`` is the encoding of the response body after
+    the view returns.
+
+    A request that runs the same SQL shape N_PLUS_ONE_THRESHOLD times or
+    more is logged as a likely N+1, as is one that runs more queries than
+    its view's ``query_budget``. Runs natively under both WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        recorder, token, start = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_recorder.reset(token)
+        return self.finish(request, response, recorder, start)
+
+    async def __acall__(self, request):
+        recorder, token, start = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_recorder.reset(token)
+        return self.finish(request, response, recorder, start)
+
+    def start(self, request):
+        # Connections opened since startup got the wrapper from the
+        # connection_created signal; this covers ones opened before it.
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+        recorder = QueryRecorder()
+        request._metrics_view_started = request._metrics_view_finished = None
+        request._metrics_query_budget = None
+        return recorder, _current_recorder.set(recorder), time.perf_counter()
+
+    def finish(self, request, response, recorder, start):
+        finished = time.perf_counter()
+
+        view_started = request._metrics_view_started or start
+        view_finished = request._metrics_view_finished or finished
+        total_ms = (finished - start) * 1000
+        view_ms = (view_finished - view_started) * 1000
+        render_ms = (finished - view_finished) * 1000
+        serialize_ms = recorder.serialization * 1000
+        db_ms = recorder.duration * 1000
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={db_ms:.1f};desc="{recorder.count} queries"',
+            f'view;dur={view_ms:.1f}',
+            f'serialize;dur={serialize_ms:.1f}',
+            f'render;dur={render_ms:.1f}',
+            f'total;dur={total_ms:.1f}',
+        ])
+
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            repeated = recorder.repeated_shapes(settings.N_PLUS_ONE_THRESHOLD)
+            if repeated:
+                logger.warning(
+                    'Possible N+1 in %s: %d queries shaped %r', match.view_name, repeated[0][1], repeated[0][0]
+                )
+            budget = request._metrics_query_budget
+            # Whether a view's atomic() shows up as BEGIN, a savepoint or
+            # nothing depends on the backend and the caller, so it doesn't count.
+            queries = recorder.count - recorder.transaction_control
+            over_budget = budget is not None and queries > budget
+            if over_budget:
+                logger.warning('%s ran %d queries, over its budget of %d', match.view_name, queries, budget)
+            request_metrics.record(
+                match.view_name, total_ms, view_ms, serialize_ms, render_ms, db_ms, recorder.count, repeated,
+                over_budget,
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_query_budget = getattr(view_func, 'query_budget', None)
+        request._metrics_view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Called once the view has returned and before DRF renders the body.
+        request._metrics_view_finished = time.perf_counter()
+        return response
@@ -0,0 +1,79 @@
+from django.db import transaction
+from django.db.models import Case, When, F, Value, IntegerField
+from django.utils import timezone
+
+from .cache import bump_version, CATALOG
+from .models import Inventory, Products
+
+
+class InsufficientStockError(ValueError):
+    def __init__(self, branch, shortages):
+        self.shortages = shortages
+        names = ', '.join(shortage['name'] for shortage in shortages)
+        super().__init__(f'Insufficient stock for product {names} at branch {branch.name}')
+
+
+def reserve_inventory(branch, quantities):
+    """
+    Move ``quantities`` ({product_id: qty}) from available to reserved stock at
+    ``branch``. Must be called inside ``transaction.atomic()``.
+
+    The cart's inventory rows (with their products) are locked in one
+    ``SELECT ... FOR UPDATE`` ordered by product id, so concurrent checkouts
+    always acquire locks in the same order, and the reservation is applied
+    with one conditional UPDATE. Returns {product_id: Inventory}.
+    """
+    rows = {}
+    locked = Inventory.objects.select_for_update(of=('self',)).select_related('product').filter(
+        branch=branch,
+        product_id__in=quantities.keys(),
+    ).order_by('product_id', 'inventory_id')
+    for inventory in locked:
+        rows.setdefault(inventory.product_id, inventory)
+
+    missing = [product_id for product_id in quantities if product_id not in rows]
+    products = Products.objects.in_bulk(missing) if missing else {}
+    for product_id in missing:
+        if product_id not in products:
+            raise ValueError(f'Product {product_id} not found')
+
+    shortages = []
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        inventory = rows.get(product_id)
+        available = inventory.available_qty if inventory else 0
+        if available < quantity:
+            product = inventory.product if inventory else products[product_id]
+            shortages.append({
+                'product': product_id,
+                'name': product.name,
+                'requested': quantity,
+                'available': available,
+            })
+    if shortages:
+        raise InsufficientStockError(branch, shortages)
+
+    requested = Case(
+        *[When(inventory_id=inventory.inventory_id, then=Value(quantities[product_id]))
+          for product_id, inventory in rows.items()],
+        output_field=IntegerField(),
+    )
+    updated = Inventory.objects.filter(
+        inventory_id__in=[inventory.inventory_id for inventory in rows.values()],
+        available_qty__gte=requested,
+    ).update(
+        available_qty=F('available_qty') - requested,
+        reserved_qty=F('reserved_qty') + requested,
+        updated_at=timezone.now(),
+    )
+    if updated != len(rows):
+        # Only reachable on backends without row locks (SQLite), where stock
+        # can move between the read and the conditional update.
+        raise ValueError('Stock changed during checkout, please retry')
+    # QuerySet.update() sends no signals, so refresh cached catalog stock here.
+    transaction.on_commit(lambda: bump_version(CATALOG))
+
+    for product_id, inventory in rows.items():
+        inventory.available_qty -= quantities[product_id]
+        inventory.reserved_qty += quantities[product_id]
+    return rows
@@ -0,0 +1,193 @@
+import math
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .models import UserPointBalances
+
+MAX_LEVELS = 32
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+_NIL = _Node((math.inf, math.inf), 0)
+
+
+def _random_levels():
+    levels = 1
+    while levels < MAX_LEVELS and random.random() < 0.5:
+        levels += 1
+    return levels
+
+
+class RankedSkipList:
+    """
+    Sorted skip list whose links also store how many items they skip, so
+    insert, remove and rank-of-key are O(log n) and the first n items are
+    O(log n + n).
+    """
+
+    def __init__(self, sorted_keys=()):
+        self._head = _Node(None, MAX_LEVELS)
+        self._size = 0
+        last = [self._head] * MAX_LEVELS
+        last_position = [0] * MAX_LEVELS
+        for position, key in enumerate(sorted_keys, 1):
+            node = _Node(key, _random_levels())
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+            self._size = position
+        for level in range(MAX_LEVELS):
+            last[level].next[level] = _NIL
+            last[level].width[level] = self._size + 1 - last_position[level]
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, key):
+        chain = [None] * MAX_LEVELS
+        steps = [0] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key <= key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        new = _Node(key, _random_levels())
+        skipped = 0
+        for level in range(len(new.next)):
+            previous = chain[level]
+            new.next[level] = previous.next[level]
+            previous.next[level] = new
+            new.width[level] = previous.width[level] - skipped
+            previous.width[level] = skipped + 1
+            skipped += steps[level]
+        for level in range(len(new.next), MAX_LEVELS):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain = [None] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def count_less(self, key):
+        """Number of items strictly smaller than ``key``."""
+        position = 0
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def first(self, n):
+        keys = []
+        node = self._head.next[0]
+        while node is not _NIL and len(keys) < n:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Leaderboard:
+    """
+    Users ranked by point balance, highest first, ties sharing a rank.
+
+    Seeded from ``user_point_balances`` in one indexed scan and updated with
+    the absolute balance after every committed point transaction (see
+    ``api.signals``). Each worker process keeps its own copy, so it is
+    re-seeded every LEADERBOARD_REFRESH_SECONDS to pick up other workers'
+    transactions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None
+        self._points = {}
+        self._loaded_at = 0
+
+    def _ensure_loaded(self):
+        expired = time.monotonic() - self._loaded_at >= settings.LEADERBOARD_REFRESH_SECONDS
+        if self._entries is not None and not expired:
+            return
+        balances = list(
+            UserPointBalances.objects.order_by('-points', 'user_id').values_list('user_id', 'points')
+        )
+        entries = RankedSkipList((-points, user_id) for user_id, points in balances)
+        with self._lock:
+            self._entries = entries
+            self._points = dict(balances)
+            self._loaded_at = time.monotonic()
+
+    def set_points(self, user_id, points):
+        with self._lock:
+            if self._entries is None:
+                return
+            previous = self._points.get(user_id)
+            if previous == points:
+                return
+            if previous is not None:
+                self._entries.remove((-previous, user_id))
+            self._entries.insert((-points, user_id))
+            self._points[user_id] = points
+
+    def _rank(self, points):
+        # Users with more points all sort before (-points, -inf).
+        return self._entries.count_less((-points, -math.inf)) + 1
+
+    def top(self, n):
+        """Return [(rank, user_id, points)] for the first ``n`` users."""
+        self._ensure_loaded()
+        with self._lock:
+            keys = self._entries.first(n)
+            ranked = []
+            for position, (negative_points, user_id) in enumerate(keys, 1):
+                if ranked and ranked[-1][2] == -negative_points:
+                    rank = ranked[-1][0]
+                else:
+                    rank = position
+                ranked.append((rank, user_id, -negative_points))
+            return ranked
+
+    def rank(self, user_id):
+        """Return (rank, points, total users); rank is None without a balance."""
+        self._ensure_loaded()
+        with self._lock:
+            points = self._points.get(user_id)
+            rank = self._rank(points) if points is not None else None
+            return rank, points or 0, len(self._entries)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
+            self._points = {}
+            self._loaded_at = 0
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,65 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from django.test import Client
+
+from api.cache import bump_version, BRANCHES, CATALOG
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request latency with and without persistent database connections.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--path', default='/api/branches')
+        parser.add_argument('--conn-max-age', type=int, default=60)
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--cached', action='store_true',
+                            help='Let cached endpoints serve from the response cache.')
+
+    def handle(self, *args, **options):
+        client = Client()
+        database = connections[options['database']]
+        original_max_age = database.settings_dict['CONN_MAX_AGE']
+        modes = [
+            ('new connection per request', 0),
+            (f"reused (CONN_MAX_AGE={options['conn_max_age']})", options['conn_max_age']),
+        ]
+        self.stdout.write(f"{database.vendor}: {options['requests']} x GET {options['path']}")
+        try:
+            # What a request without a reused connection pays before its first query.
+            connects = []
+            for _ in range(min(options['requests'], 50)):
+                database.close()
+                start = time.perf_counter()
+                database.ensure_connection()
+                connects.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(f"{'opening a connection':<32} mean {statistics.mean(connects):7.2f} ms")
+            for label, max_age in modes:
+                database.close()
+                database.settings_dict['CONN_MAX_AGE'] = max_age
+                timings = []
+                for _ in range(options['requests']):
+                    if not options['cached']:
+                        # A cache hit never touches the database; make every
+                        # request run the view.
+                        bump_version(BRANCHES)
+                        bump_version(CATALOG)
+                    start = time.perf_counter()
+                    # The test client skips the connection cleanup the WSGI
+                    # handler runs around each request, so do it here.
+                    close_old_connections()
+                    client.get(options['path'])
+                    close_old_connections()
+                    timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                self.stdout.write(
+                    f'{label:<32} mean {statistics.mean(timings):7.2f} ms  '
+                    f'p50 {timings[len(timings) // 2]:7.2f} ms  '
+                    f'p95 {timings[int(len(timings) * 0.95) - 1]:7.2f} ms'
+                )
+        finally:
+            database.settings_dict['CONN_MAX_AGE'] = original_max_age
+            database.close()
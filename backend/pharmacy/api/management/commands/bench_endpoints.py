@@ -0,0 +1,207 @@
+import json
+import math
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.cache import bump_version, BRANCHES, CATALOG
+from api.models import Branches, Inventory, OrderItems, Orders, Products, Users
+
+SEARCH_TERMS = ('vitamin', 'pain', 'antibiotic', 'allergy', 'cold', 'skin', 'digest')
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[max(math.ceil(len(sorted_values) * pct / 100) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the API views through the test client and report p50/p95/p99 latency, '
+        'query count and peak memory per endpoint. Seed data first with seed_dataset.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help='Timed requests per endpoint.')
+        parser.add_argument('--profile-requests', type=int, default=5,
+                            help='Extra requests per endpoint that count queries and trace memory.')
+        parser.add_argument('--endpoints', nargs='*', help='Only run these endpoints.')
+        parser.add_argument('--cached', action='store_true',
+                            help='Let cached endpoints serve from the response cache.')
+        parser.add_argument('--output', help='Write the JSON report here.')
+        parser.add_argument('--baseline', help='JSON report to compare against; fails on regressions.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p95 slowdown against the baseline (0.2 = 20%%).')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the orders created by the benchmark instead of rolling back.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def endpoints(self):
+        """Name -> (method, function(rng) -> (path, body), authenticated)."""
+        order = Orders.objects.order_by('-pk').values('user_id', 'branch_id').first()
+        if order is None:
+            raise CommandError('No orders to benchmark with; run seed_dataset first.')
+        self.user = User.objects.get(pk=order['user_id'])
+        branch_id = order['branch_id']
+        branch_ids = list(Branches.objects.values_list('pk', flat=True)[:50])
+        product_ids = list(Products.objects.values_list('pk', flat=True)[:5000])
+        in_stock = list(
+            Inventory.objects.filter(branch_id=branch_id, available_qty__gte=10).values_list('product_id', flat=True)[:500]
+        )
+        pages = max(math.ceil(Products.objects.count() / 10), 1)
+
+        def order_body(rng):
+            return '/api/users/order/create', {
+                'order': {'branch': branch_id},
+                'order_items': [{'product': product_id, 'quantity': 1}
+                                for product_id in rng.sample(in_stock, min(3, len(in_stock)))],
+            }
+
+        def ids(rng, population, count):
+            return ','.join(str(pk) for pk in rng.sample(population, min(count, len(population))))
+
+        return {
+            'branches': ('GET', lambda rng: ('/api/branches', None), False),
+            'branches_nearby': ('GET', lambda rng: ('/api/branches/nearby?lat=21.03&lng=105.85&radius=300', None), False),
+            'products': ('GET', lambda rng: (f'/api/products?page={rng.randint(1, pages)}', None), False),
+            'products_in_stock': ('GET', lambda rng: (
+                f'/api/products?branch={rng.choice(branch_ids)}&in_stock=true&pagination=cursor', None
+            ), False),
+            'product_search': ('GET', lambda rng: (f'/api/products/search?q={rng.choice(SEARCH_TERMS)}', None), False),
+            'product_availability': ('GET', lambda rng: (
+                f'/api/products/availability?products={ids(rng, product_ids, 50)}&branches={ids(rng, branch_ids, 10)}',
+                None,
+            ), False),
+            'profile': ('GET', lambda rng: ('/api/users/profile', None), True),
+            'points': ('GET', lambda rng: ('/api/users/points', None), True),
+            'leaderboard': ('GET', lambda rng: ('/api/users/leaderboard?limit=20', None), True),
+            'orders': ('GET', lambda rng: ('/api/users/order/details', None), True),
+            'orders_expanded': ('GET', lambda rng: ('/api/users/order/details?expand=true&pagination=cursor', None), True),
+            'create_order': ('POST', order_body, True),
+        }
+
+    def request(self, client, method, path, body):
+        if not self.cached:
+            # Measure the views rather than the response cache.
+            bump_version(BRANCHES)
+            bump_version(CATALOG)
+        start = time.perf_counter()
+        if method == 'POST':
+            response = client.post(path, body, format='json')
+        else:
+            response = client.get(path)
+        return response, (time.perf_counter() - start) * 1000
+
+    def run_endpoint(self, name, method, make_request, authenticated, options):
+        client = APIClient()
+        if authenticated:
+            client.force_authenticate(self.user)
+        rng = random.Random(options['seed'])
+        errors = 0
+        timings = []
+        for _ in range(options['requests']):
+            response, elapsed = self.request(client, method, *make_request(rng))
+            timings.append(elapsed)
+            errors += response.status_code >= 400
+
+        queries = []
+        peaks = []
+        tracemalloc.start()
+        try:
+            for _ in range(options['profile_requests']):
+                request = make_request(rng)
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                with CaptureQueriesContext(connection) as captured:
+                    self.request(client, method, *request)
+                peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+                queries.append(len(captured))
+        finally:
+            tracemalloc.stop()
+
+        timings.sort()
+        return {
+            'name': name,
+            'method': method,
+            'path': make_request(random.Random(options['seed']))[0],
+            'requests': len(timings),
+            'errors': errors,
+            'latency_ms': {
+                'mean': round(statistics.mean(timings), 3),
+                **{f'p{pct}': round(percentile(timings, pct), 3) for pct in (50, 95, 99)},
+            },
+            'queries': {'min': min(queries, default=0), 'max': max(queries, default=0)},
+            'peak_memory_kib': round(max(peaks, default=0) / 1024, 1),
+        }
+
+    def compare(self, report, baseline_path, tolerance):
+        with open(baseline_path) as baseline_file:
+            baseline = {entry['name']: entry for entry in json.load(baseline_file)['endpoints']}
+        regressions = []
+        for entry in report['endpoints']:
+            previous = baseline.get(entry['name'])
+            if previous is None:
+                continue
+            p95, previous_p95 = entry['latency_ms']['p95'], previous['latency_ms']['p95']
+            if p95 > previous_p95 * (1 + tolerance):
+                regressions.append(f"{entry['name']}: p95 {previous_p95} -> {p95} ms")
+            if entry['queries']['max'] > previous['queries']['max']:
+                regressions.append(
+                    f"{entry['name']}: queries {previous['queries']['max']} -> {entry['queries']['max']}"
+                )
+        return regressions
+
+    def handle(self, *args, **options):
+        options['requests'] = max(options['requests'], 1)
+        self.cached = options['cached']
+        endpoints = self.endpoints()
+        selected = options['endpoints'] or list(endpoints)
+        unknown = set(selected) - set(endpoints)
+        if unknown:
+            raise CommandError(f'Unknown endpoints {sorted(unknown)}; choose from {sorted(endpoints)}')
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'dataset': {
+                model._meta.db_table: model.objects.count()
+                for model in (Branches, Products, Inventory, Users, Orders, OrderItems)
+            },
+            'options': {key: options[key] for key in ('requests', 'profile_requests', 'cached', 'seed')},
+            'endpoints': [],
+        }
+        self.stdout.write(f"{connection.vendor}: {report['dataset']}")
+        self.stdout.write(
+            f"{'endpoint':<22}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'peak KiB':>10}{'errors':>8}"
+        )
+        with transaction.atomic():
+            for name in selected:
+                method, make_request, authenticated = endpoints[name]
+                entry = self.run_endpoint(name, method, make_request, authenticated, options)
+                report['endpoints'].append(entry)
+                latency = entry['latency_ms']
+                self.stdout.write(
+                    f"{name:<22}{latency['p50']:>9.2f}{latency['p95']:>9.2f}{latency['p99']:>9.2f}"
+                    f"{entry['queries']['max']:>9}{entry['peak_memory_kib']:>10.1f}{entry['errors']:>8}"
+                )
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+        if options['baseline']:
+            regressions = self.compare(report, options['baseline'], options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline.'))
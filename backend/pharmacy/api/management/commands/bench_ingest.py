@@ -0,0 +1,60 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from api.ingest import event_queue
+from api.models import Products, Users
+
+
+class Command(BaseCommand):
+    help = 'Measure telemetry ingestion throughput (events/sec) through the users/events endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batches', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def make_events(self, count, product_ids):
+        events = []
+        for _ in range(count):
+            kind = random.choice(('ui_interaction', 'product_view', 'activity', 'search'))
+            if kind == 'ui_interaction':
+                events.append({'type': kind, 'component': 'ProductCard', 'action': 'tap', 'value': 'add_to_cart'})
+            elif kind == 'product_view' and product_ids:
+                events.append({'type': kind, 'product': random.choice(product_ids)})
+            elif kind == 'search':
+                events.append({'type': kind, 'keyword': 'paracetamol', 'results_count': 12})
+            else:
+                events.append({'type': 'activity', 'time_spent_seconds': random.randint(1, 600), 'points_earned': 1})
+        return events
+
+    def handle(self, *args, **options):
+        product_ids = list(Products.objects.values_list('pk', flat=True)[:1000])
+        user = User.objects.create_user(username=f'bench-ingest-{int(time.time())}')
+        Users.objects.create(id=user, role='patient')
+        client = APIClient()
+        client.force_authenticate(user)
+        payloads = [
+            {'events': self.make_events(options['batch_size'], product_ids)}
+            for _ in range(options['batches'])
+        ]
+        try:
+            start = time.perf_counter()
+            accepted = 0
+            for payload in payloads:
+                response = client.post('/api/users/events', payload, format='json')
+                accepted += response.json()['accepted']
+            request_time = time.perf_counter() - start
+            event_queue.stop()
+            elapsed = time.perf_counter() - start
+            stats = event_queue.stats()
+            self.stdout.write(
+                f'{accepted} events accepted in {request_time:.2f}s '
+                f'({accepted / request_time:,.0f} events/sec at the API), '
+                f'written in {elapsed:.2f}s ({stats["flushed"] / elapsed:,.0f} events/sec end to end)'
+            )
+            self.stdout.write(f'queue counters: {stats}')
+        finally:
+            user.delete()
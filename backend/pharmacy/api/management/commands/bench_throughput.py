@@ -0,0 +1,155 @@
+import http.client
+import json
+import math
+import platform
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.models import Orders, Products
+
+from .bench_endpoints import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure throughput and latency of the read endpoints over HTTP at high concurrency, '
+        'comparing a WSGI server running the sync views with an ASGI server running the async '
+        'ones. Start the servers against the seeded database first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi', help='Base URL of the WSGI server, e.g. http://127.0.0.1:8000.')
+        parser.add_argument('--asgi', help='Base URL of the ASGI server, e.g. http://127.0.0.1:8001.')
+        parser.add_argument('--concurrency', type=int, default=64, help='Clients sending requests at once.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to load each endpoint for.')
+        parser.add_argument('--endpoints', nargs='*', help='Only run these endpoints.')
+        parser.add_argument('--output', help='Write the JSON report here.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def endpoints(self):
+        """Name -> (sync path, async path, function(rng) -> query string)."""
+        pages = max(math.ceil(Products.objects.count() / 10), 1)
+        return {
+            'branches': ('/api/branches', '/api/async/branches', lambda rng: ''),
+            'products': ('/api/products', '/api/async/products', lambda rng: f'?page={rng.randint(1, pages)}'),
+            'orders': ('/api/users/order/details', '/api/async/users/order/details', lambda rng: ''),
+            'profile': ('/api/users/profile', '/api/async/users/profile', lambda rng: ''),
+        }
+
+    def client(self, base_url, path, make_query, seed, deadline, results):
+        url = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        # One persistent connection per client, reopened whenever the server closes it.
+        conn = connection_class(url.hostname, url.port, timeout=30)
+        rng = random.Random(seed)
+        timings = []
+        errors = 0
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    conn.request('GET', url.path.rstrip('/') + path + make_query(rng), headers=self.headers)
+                    response = conn.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    errors += 1
+                    continue
+                if response.status >= 400:
+                    errors += 1
+                else:
+                    timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            conn.close()
+        results.append((timings, errors))
+
+    def run(self, base_url, path, make_query, options):
+        results = []
+        deadline = time.perf_counter() + options['duration']
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(
+                target=self.client, args=(base_url, path, make_query, options['seed'] + i, deadline, results)
+            )
+            for i in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        # Only successful responses count towards throughput and latency.
+        timings = sorted(timing for client_timings, _ in results for timing in client_timings)
+        errors = sum(errors for _, errors in results)
+        return {
+            'path': path,
+            'requests': len(timings) + errors,
+            'errors': errors,
+            'requests_per_second': round(len(timings) / elapsed, 1),
+            'latency_ms': {
+                f'p{pct}': round(percentile(timings, pct), 3) if timings else None for pct in (50, 95, 99)
+            },
+        }
+
+    def handle(self, *args, **options):
+        servers = [
+            (name, options[server], variant)
+            for name, server, variant in (
+                ('wsgi', 'wsgi', 'sync'),
+                ('asgi', 'asgi', 'async'),
+                ('asgi (sync views)', 'asgi', 'sync'),
+            )
+            if options[server]
+        ]
+        if not servers:
+            raise CommandError('Pass the base URL of a server to load with --wsgi and/or --asgi.')
+        options['concurrency'] = max(options['concurrency'], 1)
+
+        user_id = Orders.objects.order_by('-pk').values_list('user_id', flat=True).first()
+        if user_id is None:
+            raise CommandError('No orders to benchmark with; run seed_dataset first.')
+        token = RefreshToken.for_user(User.objects.get(pk=user_id)).access_token
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+        endpoints = self.endpoints()
+        selected = options['endpoints'] or list(endpoints)
+        unknown = set(selected) - set(endpoints)
+        if unknown:
+            raise CommandError(f'Unknown endpoints {sorted(unknown)}; choose from {sorted(endpoints)}')
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'options': {key: options[key] for key in ('concurrency', 'duration', 'seed')},
+            'servers': {name: base_url for name, base_url, _ in servers},
+            'endpoints': [],
+        }
+        self.stdout.write(f"{options['concurrency']} clients, {options['duration']}s per endpoint and server")
+        self.stdout.write(
+            f"{'endpoint':<12}{'server':<20}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"
+        )
+        for name in selected:
+            sync_path, async_path, make_query = endpoints[name]
+            for server, base_url, variant in servers:
+                entry = self.run(base_url, sync_path if variant == 'sync' else async_path, make_query, options)
+                entry.update(name=name, server=server)
+                report['endpoints'].append(entry)
+                latency = {pct: value or 0 for pct, value in entry['latency_ms'].items()}
+                self.stdout.write(
+                    f"{name:<12}{server:<20}{entry['requests_per_second']:>10.1f}{latency['p50']:>9.2f}"
+                    f"{latency['p95']:>9.2f}{latency['p99']:>9.2f}{entry['errors']:>8}"
+                )
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
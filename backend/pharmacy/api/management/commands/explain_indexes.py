@@ -0,0 +1,132 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models
+from django.utils import timezone
+
+from api.models import (
+    Inventory,
+    Orders,
+    StatusDimension,
+    UserActivityLogs,
+    UserPointTransactions,
+    UserProductViews,
+    Users,
+    UserSearchLogs,
+    UserUiInteractions,
+)
+
+# (model, index or constraint name) added in 0004_composite_indexes.
+INDEXES = [
+    (Inventory, 'inventory_product_branch_uniq'),
+    (Orders, 'orders_user_created_idx'),
+    (StatusDimension, 'status_dimension_type_name_idx'),
+    (UserActivityLogs, 'user_activity_user_time_idx'),
+    (UserPointTransactions, 'user_points_user_time_idx'),
+    (UserProductViews, 'user_views_user_time_idx'),
+    (UserSearchLogs, 'user_search_user_time_idx'),
+    (UserUiInteractions, 'user_ui_user_time_idx'),
+]
+
+
+def find_index(model, name):
+    for index in [*model._meta.indexes, *model._meta.constraints]:
+        if index.name == name:
+            return index
+    raise CommandError(f'{model.__name__} has no index {name}')
+
+
+class Command(BaseCommand):
+    help = (
+        "Show the query plan and latency of the API's hot lookups, optionally with and "
+        'without the composite indexes. Seed data first with seed_dataset.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200, help='Timed runs per query.')
+        parser.add_argument('--compare', action='store_true',
+                            help='Also measure with the composite indexes dropped (they are recreated).')
+        parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (PostgreSQL).')
+
+    def queries(self):
+        """Name -> function(rng) returning a queryset shaped like the API's."""
+        inventory = list(Inventory.objects.values_list('product_id', 'branch_id')[:1000])
+        user_ids = list(Users.objects.values_list('pk', flat=True)[:1000])
+        if not inventory or not user_ids:
+            raise CommandError('No data to query; run seed_dataset first.')
+        since = timezone.now() - timedelta(days=7)
+
+        def recent(model, field):
+            return lambda rng: model.objects.filter(
+                user_id=rng.choice(user_ids), **{f'{field}__gte': since}
+            ).order_by(f'-{field}')[:50]
+
+        return {
+            'inventory by product+branch': lambda rng: Inventory.objects.filter(
+                product_id=(pair := rng.choice(inventory))[0], branch_id=pair[1]
+            ),
+            'orders by user, newest first': lambda rng: Orders.objects.filter(
+                user_id=rng.choice(user_ids)
+            ).order_by('-created_at', '-order_id')[:10],
+            'status by type+name': lambda rng: StatusDimension.objects.filter(
+                entity_type='order', status_name='Processing'
+            ),
+            'activity by user, last 7 days': recent(UserActivityLogs, 'recorded_at'),
+            'point transactions by user, last 7 days': recent(UserPointTransactions, 'recorded_at'),
+            'product views by user, last 7 days': recent(UserProductViews, 'viewed_at'),
+            'searches by user, last 7 days': recent(UserSearchLogs, 'searched_at'),
+            'ui interactions by user, last 7 days': recent(UserUiInteractions, 'occurred_at'),
+        }
+
+    def measure(self, queries, options, label):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'== {label} =='))
+        for name, make_query in queries.items():
+            rng = random.Random(0)
+            plan = make_query(rng).explain(**({'analyze': True} if options['analyze'] else {}))
+            timings = []
+            for _ in range(options['repeat']):
+                query = make_query(rng)
+                start = time.perf_counter()
+                list(query)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            self.stdout.write(
+                f'{name:<42} p50 {timings[len(timings) // 2]:8.3f} ms  '
+                f'p95 {timings[int(len(timings) * 0.95) - 1]:8.3f} ms'
+            )
+            for line in plan.splitlines():
+                self.stdout.write(f'    {line}')
+
+    def handle(self, *args, **options):
+        options['repeat'] = max(options['repeat'], 1)
+        queries = self.queries()
+        self.stdout.write(
+            f'{connection.vendor}: {Inventory.objects.count()} inventory rows, '
+            f'{Orders.objects.count()} orders, {UserActivityLogs.objects.count()} activity rows'
+        )
+        self.measure(queries, options, 'with composite indexes')
+        if not options['compare']:
+            return
+        indexes = [(model, find_index(model, name)) for model, name in INDEXES]
+        with connection.schema_editor() as editor:
+            for model, index in indexes:
+                if isinstance(index, models.UniqueConstraint):
+                    # SQLite drops a constraint by rebuilding the table from
+                    # the model's Meta, so take it out of there too.
+                    model._meta.constraints = [c for c in model._meta.constraints if c is not index]
+                    editor.remove_constraint(model, index)
+                else:
+                    editor.remove_index(model, index)
+        try:
+            self.measure(queries, options, 'without composite indexes')
+        finally:
+            self.stdout.write('Recreating indexes...')
+            with connection.schema_editor() as editor:
+                for model, index in indexes:
+                    if isinstance(index, models.UniqueConstraint):
+                        model._meta.constraints = [*model._meta.constraints, index]
+                        editor.add_constraint(model, index)
+                    else:
+                        editor.add_index(model, index)
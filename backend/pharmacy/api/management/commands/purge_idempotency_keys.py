@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import IdempotencyKeys
+
+
+class Command(BaseCommand):
+    help = 'Delete expired idempotency keys, a batch at a time. Run it periodically, e.g. from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Keys per DELETE.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = IdempotencyKeys.objects.filter(expires_at__lte=now).order_by('expires_at')
+        deleted = 0
+        # Short deletes served by idempotency_keys_expires_idx, so live
+        # requests claiming keys aren't held up behind one large one.
+        while batch := list(expired.values_list('pk', flat=True)[:options['batch_size']]):
+            deleted += IdempotencyKeys.objects.filter(pk__in=batch).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired idempotency keys.'))
@@ -0,0 +1,92 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+from api import rollups
+from api.leaderboard import leaderboard
+from api.models import (
+    UserActivityLogs,
+    UserDailyRollups,
+    UserPointBalances,
+    UserPointTransactions,
+    Users,
+)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute user_daily_rollups and user_point_balances from the '
+        'user_activity_logs and user_point_transactions ledgers, a chunk of users at a time. '
+        'Safe while events are being written: each chunk holds the rollup lock the '
+        'write-behind flush also takes (PostgreSQL), so flushes wait for the chunk and '
+        'are then applied on top of the rebuilt totals.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users per transaction.')
+
+    def rebuild(self, user_ids):
+        # Lock out increments, and delete before reading: on SQLite the
+        # first write is what keeps other writers out until commit.
+        rollups.lock_rollups(exclusive=True)
+        UserDailyRollups.objects.filter(user_id__in=user_ids).delete()
+        UserPointBalances.objects.filter(user_id__in=user_ids).delete()
+        daily = {}
+
+        def totals(user_id, day):
+            return daily.setdefault((user_id, day), {
+                'time_spent_seconds': 0, 'points_earned': 0, 'points_received': 0, 'activity_count': 0,
+            })
+
+        activity = UserActivityLogs.objects.filter(user_id__in=user_ids).annotate(
+            day=TruncDate('recorded_at')
+        ).values('user_id', 'day').annotate(
+            time_spent=Sum('time_spent_seconds'), points=Sum('points_earned'), count=Count('activity_id')
+        ).order_by()
+        for row in activity:
+            day_totals = totals(row['user_id'], row['day'])
+            day_totals['time_spent_seconds'] = row['time_spent'] or 0
+            day_totals['points_earned'] = row['points'] or 0
+            day_totals['activity_count'] = row['count']
+
+        transactions = UserPointTransactions.objects.filter(user_id__in=user_ids).annotate(
+            day=TruncDate('recorded_at')
+        ).values('user_id', 'day').annotate(points=Sum('points')).order_by()
+        for row in transactions:
+            totals(row['user_id'], row['day'])['points_received'] = row['points'] or 0
+
+        balances = {}
+        for (user_id, _), day_totals in daily.items():
+            balance = balances.setdefault(user_id, UserPointBalances(user_id=user_id))
+            balance.points += day_totals['points_received']
+            balance.time_spent_seconds += day_totals['time_spent_seconds']
+
+        UserDailyRollups.objects.bulk_create(
+            [UserDailyRollups(user_id=user_id, day=day, **day_totals)
+             for (user_id, day), day_totals in daily.items()],
+            batch_size=1000,
+        )
+        UserPointBalances.objects.bulk_create(balances.values(), batch_size=1000)
+        return len(daily)
+
+    def handle(self, *args, **options):
+        user_ids = Users.objects.order_by('pk').values_list('pk', flat=True).iterator(
+            chunk_size=options['chunk_size']
+        )
+        users = rows = 0
+        for chunk in chunked(user_ids, options['chunk_size']):
+            with transaction.atomic():
+                rows += self.rebuild(chunk)
+            users += len(chunk)
+            self.stdout.write(f'{users} users, {rows} daily rollups')
+        leaderboard.invalidate()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rollups for {users} users.'))
@@ -0,0 +1,170 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api.management.commands.rebuild_rollups import chunked
+from api.models import (
+    Branches,
+    Inventory,
+    OrderItems,
+    Orders,
+    Products,
+    StatusDimension,
+    UserActivityLogs,
+    UserPointTransactions,
+    UserProductViews,
+    Users,
+    UserSearchLogs,
+    UserUiInteractions,
+)
+
+CATEGORIES = ('Pain Relief', 'Antibiotics', 'Vitamins', 'Allergy', 'Digestive', 'Skin Care', 'Cold & Flu')
+PROVINCES = ('Hanoi', 'Ho Chi Minh City', 'Da Nang', 'Hai Phong', 'Can Tho', 'Hue')
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Let bulk_create keep the values given for auto_now_add fields."""
+    auto_now_add = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, auto_now_add):
+            field.auto_now_add = value
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a synthetic dataset (branches, products, inventory, users, orders with items '
+        'and telemetry) with bulk inserts, for benchmarks and query plans.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branches', type=int, default=50)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--orders-per-user', type=int, default=5)
+        parser.add_argument('--items-per-order', type=int, default=3)
+        parser.add_argument('--events-per-user', type=int, default=50, help='Rows per telemetry table per user.')
+        parser.add_argument('--days', type=int, default=90, help='Spread timestamps over this many days.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable datasets.')
+
+    def insert(self, model, rows):
+        """bulk_create a generator of instances, one batch in memory at a time."""
+        count = 0
+        for batch in chunked(rows, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch, batch_size=self.batch_size)
+            count += len(batch)
+        self.stdout.write(f'{model._meta.db_table}: {count} rows')
+        return count
+
+    def moment(self):
+        return self.now - timedelta(seconds=self.random.randrange(self.days * 86400))
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.days = max(options['days'], 1)
+        self.now = timezone.now()
+        start = time.perf_counter()
+        prefix = f"seed{options['seed']}-{int(time.time())}"
+
+        branch_start = Branches.objects.count()
+        self.insert(Branches, (
+            Branches(
+                name=f'Branch {branch_start + i}', address=f'{i} Seed Street',
+                province=self.random.choice(PROVINCES),
+                latitude=Decimal(f'{self.random.uniform(8.5, 23):.6f}'),
+                longitude=Decimal(f'{self.random.uniform(102, 109.5):.6f}'),
+            ) for i in range(options['branches'])
+        ))
+        branch_ids = list(Branches.objects.order_by('-pk').values_list('pk', flat=True)[:options['branches']])
+
+        self.insert(Products, (
+            Products(
+                name=f'{self.random.choice(CATEGORIES)} {prefix}-{i}',
+                category=self.random.choice(CATEGORIES),
+                manufacturer=f'Manufacturer {i % 40}',
+                no_approval=self.random.random() > 0.2,
+                unit_price=Decimal(self.random.randrange(100, 50000)) / 100,
+            ) for i in range(options['products'])
+        ))
+        products = list(Products.objects.order_by('-pk').values_list('pk', 'unit_price')[:options['products']])
+        product_ids = [product_id for product_id, _ in products]
+
+        self.insert(Inventory, (
+            Inventory(
+                product_id=product_id, branch_id=branch_id,
+                available_qty=self.random.randrange(0, 500), reserved_qty=0,
+            ) for branch_id in branch_ids for product_id in product_ids
+        ))
+
+        password = make_password('password123')
+        self.insert(User, (
+            User(username=f'{prefix}-user{i}', password=password, email=f'{prefix}-user{i}@example.com')
+            for i in range(options['users'])
+        ))
+        user_ids = list(User.objects.filter(username__startswith=f'{prefix}-user').values_list('pk', flat=True))
+        self.insert(Users, (Users(id_id=user_id, role='patient') for user_id in user_ids))
+
+        status, _ = StatusDimension.objects.get_or_create(entity_type='order', status_name='Processing')
+        last_order_id = Orders.objects.aggregate(last=Max('pk'))['last'] or 0
+        with explicit_timestamps(Orders._meta.get_field('created_at')):
+            self.insert(Orders, (
+                Orders(
+                    user_id=user_id, branch_id=self.random.choice(branch_ids),
+                    status_id=status.pk, created_at=self.moment(),
+                ) for user_id in user_ids for _ in range(options['orders_per_user'])
+            ))
+        order_ids = list(Orders.objects.filter(pk__gt=last_order_id).values_list('pk', flat=True))
+        items = min(options['items_per_order'], len(products))
+        self.insert(OrderItems, (
+            OrderItems(order_id=order_id, product_id=product_id, quantity=self.random.randrange(1, 4), price=price)
+            for order_id in order_ids for product_id, price in self.random.sample(products, items)
+        ))
+
+        events = options['events_per_user']
+        telemetry = [
+            (UserActivityLogs, 'recorded_at', lambda user_id: UserActivityLogs(
+                user_id=user_id, time_spent_seconds=self.random.randrange(1, 900),
+                points_earned=self.random.randrange(0, 5), recorded_at=self.moment(),
+            )),
+            (UserPointTransactions, 'recorded_at', lambda user_id: UserPointTransactions(
+                user_id=user_id, source='order', points=self.random.randrange(1, 50), recorded_at=self.moment(),
+            )),
+            (UserProductViews, 'viewed_at', lambda user_id: UserProductViews(
+                user_id=user_id, product_id=self.random.choice(product_ids), viewed_at=self.moment(),
+            )),
+            (UserSearchLogs, 'searched_at', lambda user_id: UserSearchLogs(
+                user_id=user_id, keyword=self.random.choice(CATEGORIES).lower(),
+                results_count=self.random.randrange(0, 100), searched_at=self.moment(),
+            )),
+            (UserUiInteractions, 'occurred_at', lambda user_id: UserUiInteractions(
+                user_id=user_id, component='ProductCard', action='tap', value='add_to_cart',
+                occurred_at=self.moment(),
+            )),
+        ]
+        for model, timestamp_field, make_row in telemetry:
+            with explicit_timestamps(model._meta.get_field(timestamp_field)):
+                self.insert(model, (make_row(user_id) for user_id in user_ids for _ in range(events)))
+        if events:
+            # Telemetry was inserted around the ledgers' signals.
+            call_command('rebuild_rollups', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(user_ids)} users as {prefix}-user* in {time.perf_counter() - start:.1f}s.'
+        ))
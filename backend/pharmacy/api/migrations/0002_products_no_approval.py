@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+def copy_need_approval(apps, schema_editor):
+    Products = apps.get_model('api', 'Products')
+    Products.objects.filter(need_approval=True).update(no_approval=False)
+
+
+def copy_no_approval(apps, schema_editor):
+    Products = apps.get_model('api', 'Products')
+    Products.objects.filter(no_approval=False).update(need_approval=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='products',
+            name='no_approval',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(copy_need_approval, copy_no_approval),
+        migrations.RemoveField(
+            model_name='products',
+            name='need_approval',
+        ),
+    ]
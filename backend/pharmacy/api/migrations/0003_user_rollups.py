@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_products_no_approval'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPointBalances',
+            fields=[
+                ('user', models.OneToOneField(db_column='user_id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='api.users')),
+                ('points', models.IntegerField(default=0)),
+                ('time_spent_seconds', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'user_point_balances',
+                'indexes': [models.Index(fields=['-points'], name='user_point_balances_pts_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserDailyRollups',
+            fields=[
+                ('rollup_id', models.AutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('time_spent_seconds', models.IntegerField(default=0)),
+                ('points_earned', models.IntegerField(default=0)),
+                ('points_received', models.IntegerField(default=0)),
+                ('activity_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.users')),
+            ],
+            options={
+                'db_table': 'user_daily_rollups',
+                'constraints': [models.UniqueConstraint(fields=('user', 'day'), name='user_daily_rollups_user_day_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:09
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_inventory(apps, schema_editor):
+    """Fold duplicate (product, branch) rows into the oldest one."""
+    Inventory = apps.get_model('api', 'Inventory')
+    duplicates = Inventory.objects.values('product_id', 'branch_id').annotate(
+        rows=Count('inventory_id'), keep=Min('inventory_id'),
+        available=Sum('available_qty'), reserved=Sum('reserved_qty'),
+    ).filter(rows__gt=1).order_by()
+    for row in duplicates:
+        Inventory.objects.filter(pk=row['keep']).update(
+            available_qty=row['available'], reserved_qty=row['reserved']
+        )
+        Inventory.objects.filter(
+            product_id=row['product_id'], branch_id=row['branch_id']
+        ).exclude(pk=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_user_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orders',
+            index=models.Index(fields=['user', '-created_at', '-order_id'], name='orders_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='statusdimension',
+            index=models.Index(fields=['entity_type', 'status_name'], name='status_dimension_type_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivitylogs',
+            index=models.Index(fields=['user', 'recorded_at'], name='user_activity_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpointtransactions',
+            index=models.Index(fields=['user', 'recorded_at'], name='user_points_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userproductviews',
+            index=models.Index(fields=['user', 'viewed_at'], name='user_views_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersearchlogs',
+            index=models.Index(fields=['user', 'searched_at'], name='user_search_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useruiinteractions',
+            index=models.Index(fields=['user', 'occurred_at'], name='user_ui_user_time_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_inventory, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='inventory',
+            constraint=models.UniqueConstraint(fields=('product', 'branch'), name='inventory_product_branch_uniq'),
+        ),
+    ]
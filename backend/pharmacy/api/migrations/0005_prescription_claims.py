@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prescriptions',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='prescriptions',
+            name='claimed_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='claimed_prescriptions', to='api.users'),
+        ),
+        migrations.AddIndex(
+            model_name='prescriptions',
+            index=models.Index(fields=['status', 'submitted_at', 'prescription_id'], name='prescriptions_queue_idx'),
+        ),
+    ]
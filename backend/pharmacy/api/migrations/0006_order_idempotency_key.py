@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_prescription_claims'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orders',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='orders',
+            constraint=models.UniqueConstraint(fields=('user', 'idempotency_key'), name='orders_user_idempotency_key_uniq'),
+        ),
+    ]
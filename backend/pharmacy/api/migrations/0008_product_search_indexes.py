@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:20
+
+from django.db import DatabaseError, migrations, transaction
+from django.db.models import F, Func, Value
+from django.db.models.functions import Lower
+
+# api.search's folding as of this migration. Its translate() table is built
+# from unicodedata at import time, so it is frozen here: the index has to
+# keep the expression it was built with. Changing the live folding needs a
+# new migration that rebuilds these indexes.
+UNFOLDED = (
+    '\xc6\xd0\xd8\xde\u0110\u0111\u0126\u013f\u0140\u0141\u014a\u0152\u0166\u0181\u0182\u0184\u0186\u0187\u0189'
+    '\u018a\u018b\u018e\u018f\u0190\u0191\u0193\u0194\u0196\u0197\u0198\u019c\u019d\u019f\u01a2\u01a4\u01a6\u01a7'
+    '\u01a9\u01ac\u01ae\u01b1\u01b2\u01b3\u01b5\u01b7\u01b8\u01bc\u01e2\u01e4\u01ee\u01f6\u01f7\u01fc\u01fe\u021c'
+    '\u0220\u0222\u0224\u023a\u023b\u023d\u023e\u0241\u0243\u0244\u0245\u0246\u0248\u024a\u024c\u024e\u1e9e\u1efa'
+    '\u1efc\u1efe'
+)
+FOLDED = (
+    '\xe6\xf0\xf8\xfedd\u0127ll\u0142\u014b\u0153\u0167\u0253\u0183\u0185\u0254\u0188\u0256\u0257\u018c\u01dd\u0259'
+    '\u025b\u0192\u0260\u0263\u0269\u0268\u0199\u026f\u0272\u0275\u01a3\u01a5\u0280\u01a8\u0283\u01ad\u0288\u028a'
+    '\u028b\u01b4\u01b6\u0292\u01b9\u01bd\xe6\u01e5\u0292\u0195\u01bf\xe6\xf8\u021d\u019e\u0223\u0225\u2c65\u023c'
+    '\u019a\u2c66\u0242\u0180\u0289\u028c\u0247\u0249\u024b\u024d\u024f\xdf\u1efb\u1efd\u1eff'
+)
+COMBINING_MARKS = '[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]'
+
+
+def folded(field):
+    text = Func(F(field), Value(UNFOLDED), Value(FOLDED), function='translate')
+    text = Func(text, template='normalize(%(expressions)s, NFKD)')
+    return Lower(Func(text, Value(COMBINING_MARKS), Value(''), Value('g'), function='regexp_replace'))
+
+
+def search_document():
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector(folded('name'), weight='A', config='simple')
+        + SearchVector(folded('manufacturer'), weight='B', config='simple')
+        + SearchVector(folded('category'), weight='C', config='simple')
+    )
+
+
+def add_search_indexes(apps, schema_editor):
+    """Index the database search backend's expressions; other databases search in memory."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SHOW server_encoding')
+        if cursor.fetchone()[0] != 'UTF8':
+            # normalize() in the indexed expression only runs in UTF8
+            # databases; the search backend stays in memory on others.
+            return
+    from django.contrib.postgres.indexes import GinIndex, OpClass
+
+    Products = apps.get_model('api', 'Products')
+    schema_editor.add_index(Products, GinIndex(search_document(), name='products_search_idx'))
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except DatabaseError:
+        # Not installed on the server or not allowed for this role: search
+        # works without typo tolerance until an admin creates the extension.
+        return
+    schema_editor.add_index(
+        Products, GinIndex(OpClass(folded('name'), name='gin_trgm_ops'), name='products_name_trgm_idx')
+    )
+
+
+def remove_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS products_name_trgm_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS products_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_indexes, remove_search_indexes),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:43
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_product_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='useractivitylogs',
+            name='recorded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='userproductviews',
+            name='viewed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='usersearchlogs',
+            name='searched_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='useruiinteractions',
+            name='occurred_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,7 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import User
 import uuid
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 
 
 class Branches(models.Model):
@@ -36,6 +38,9 @@ class StatusDimension(models.Model):
 
     class Meta:
         db_table = 'status_dimension'
+        indexes = [
+            models.Index(fields=['entity_type', 'status_name'], name='status_dimension_type_name_idx'),
+        ]
 
 class Users(models.Model):
     ROLE_CHOICES = [
@@ -68,7 +73,10 @@ class Inventory(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        db_table = 'inventory'  
+        db_table = 'inventory'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'branch'], name='inventory_product_branch_uniq'),
+        ]
 
 class Prescriptions(models.Model):
     prescription_id = models.AutoField(primary_key=True)
@@ -78,9 +86,17 @@ class Prescriptions(models.Model):
     submitted_at = models.DateTimeField(auto_now_add=True)
     patient = models.ForeignKey('Users', on_delete=models.CASCADE)
     doctor = models.ForeignKey('Users', on_delete=models.CASCADE, related_name='prescriptions_doctor_set')
+    # The pharmacist reviewing it; claims lapse after PRESCRIPTION_CLAIM_TIMEOUT.
+    claimed_by = models.ForeignKey(
+        'Users', on_delete=models.SET_NULL, blank=True, null=True, related_name='claimed_prescriptions'
+    )
+    claimed_at = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         db_table = 'prescriptions'
+        indexes = [
+            models.Index(fields=['status', 'submitted_at', 'prescription_id'], name='prescriptions_queue_idx'),
+        ]
 
 class Orders(models.Model):
     order_id = models.AutoField(primary_key=True)
@@ -89,9 +105,17 @@ class Orders(models.Model):
     prescription = models.ForeignKey('Prescriptions', on_delete=models.CASCADE, blank=True, null=True)
     status = models.ForeignKey('StatusDimension', on_delete=models.RESTRICT)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Client-supplied Idempotency-Key the order was created with, if any.
+    idempotency_key = models.CharField(max_length=255, blank=True, null=True)
 
     class Meta:
         db_table = 'orders'
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-order_id'], name='orders_user_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='orders_user_idempotency_key_uniq'),
+        ]
 
 class OrderItems(models.Model):
     order_item_id = models.AutoField(primary_key=True)
@@ -151,10 +175,13 @@ class UserActivityLogs(models.Model):
     user = models.ForeignKey('Users', on_delete=models.CASCADE)
     time_spent_seconds = models.IntegerField(validators=[MinValueValidator(0)])
     points_earned = models.IntegerField(blank=True, null=True, validators=[MinValueValidator(0)])
-    recorded_at = models.DateTimeField(auto_now_add=True)
+    recorded_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         db_table = 'user_activity_logs'
+        indexes = [
+            models.Index(fields=['user', 'recorded_at'], name='user_activity_user_time_idx'),
+        ]
 
 class UserMedicalHistory(models.Model):
     history_id = models.AutoField(primary_key=True)
@@ -176,15 +203,21 @@ class UserPointTransactions(models.Model):
 
     class Meta:
         db_table = 'user_point_transactions'
+        indexes = [
+            models.Index(fields=['user', 'recorded_at'], name='user_points_user_time_idx'),
+        ]
 
 class UserProductViews(models.Model):
     view_id = models.AutoField(primary_key=True)
     user = models.ForeignKey('Users', on_delete=models.CASCADE)
     product = models.ForeignKey(Products, on_delete=models.CASCADE)
-    viewed_at = models.DateTimeField(auto_now_add=True)
+    viewed_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         db_table = 'user_product_views'
+        indexes = [
+            models.Index(fields=['user', 'viewed_at'], name='user_views_user_time_idx'),
+        ]
 
 class UserSearchLogs(models.Model):
     search_id = models.AutoField(primary_key=True)
@@ -193,10 +226,13 @@ class UserSearchLogs(models.Model):
     category = models.CharField(max_length=100, blank=True, null=True)
     search_filters = models.CharField(max_length=255, blank=True, null=True)
     results_count = models.IntegerField(blank=True, null=True, validators=[MinValueValidator(0)])
-    searched_at = models.DateTimeField(auto_now_add=True)
+    searched_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         db_table = 'user_search_logs'
+        indexes = [
+            models.Index(fields=['user', 'searched_at'], name='user_search_user_time_idx'),
+        ]
 
 class UserUiInteractions(models.Model):
     interaction_id = models.AutoField(primary_key=True)
@@ -204,10 +240,13 @@ class UserUiInteractions(models.Model):
     component = models.CharField(max_length=100)
     value = models.CharField(max_length=255, blank=True, null=True)
     action = models.CharField(max_length=100)
-    occurred_at = models.DateTimeField(auto_now_add=True)
+    occurred_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         db_table = 'user_ui_interactions'
+        indexes = [
+            models.Index(fields=['user', 'occurred_at'], name='user_ui_user_time_idx'),
+        ]
 
 class ApiMedicine(models.Model):
     id = models.BigAutoField(primary_key=True)
@@ -219,3 +258,52 @@ class ApiMedicine(models.Model):
     class Meta:
         db_table = 'api_medicine'
 
+
+class UserDailyRollups(models.Model):
+    rollup_id = models.AutoField(primary_key=True)
+    user = models.ForeignKey('Users', on_delete=models.CASCADE)
+    day = models.DateField()
+    time_spent_seconds = models.IntegerField(default=0)
+    points_earned = models.IntegerField(default=0)
+    points_received = models.IntegerField(default=0)
+    activity_count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'user_daily_rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='user_daily_rollups_user_day_uniq'),
+        ]
+
+class UserPointBalances(models.Model):
+    user = models.OneToOneField('Users', on_delete=models.CASCADE, db_column='user_id', primary_key=True)
+    points = models.IntegerField(default=0)
+    time_spent_seconds = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'user_point_balances'
+        indexes = [
+            models.Index(fields=['-points'], name='user_point_balances_pts_idx'),
+        ]
+
+class IdempotencyKeys(models.Model):
+    """A client's Idempotency-Key and the response it was first answered with."""
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # Hash of the method, path and body the key was first sent with.
+    request_hash = models.CharField(max_length=64)
+    # Both empty while the first request is still running.
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_keys_user_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_keys_expires_idx'),
+        ]
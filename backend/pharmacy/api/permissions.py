@@ -0,0 +1,21 @@
+from rest_framework.permissions import BasePermission
+
+from .models import Users
+
+# Roles that may review prescriptions. They are granted by an administrator,
+# never chosen at sign-up or in a profile update.
+STAFF_ROLES = ('pharmacist', 'admin')
+
+
+class IsPharmacist(BasePermission):
+    """Pharmacists and admins. Authentication has already loaded the profile."""
+
+    message = 'Only pharmacists can review prescriptions.'
+
+    def has_permission(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return False
+        try:
+            return request.user.users.role in STAFF_ROLES
+        except Users.DoesNotExist:
+            return False
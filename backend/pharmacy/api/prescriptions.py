@@ -0,0 +1,277 @@
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, IntegerField, Prefetch, Q, Value, When
+from django.utils import timezone
+
+from .inventory import reserve_inventory
+from .models import Branches, OrderItems, Orders, PrescriptionApprovals, PrescriptionItems, Prescriptions, StatusDimension
+from .status import status_registry
+
+PRESCRIPTION = 'prescription'
+PENDING = 'Pending'
+# Review decision -> the prescription status it moves to.
+DECISIONS = {'approved': 'Approved', 'rejected': 'Rejected'}
+MAX_DECISIONS = 100
+# Units in which an item's dosage_amount is a number of packs to dispense.
+# Items in clinical units (mg, ml, tablets...) can't be ordered as is.
+PACKAGING_UNITS = frozenset({
+    'ampoule', 'ampoules', 'blister', 'blisters', 'bottle', 'bottles', 'box', 'boxes', 'pack', 'packs',
+    'sachet', 'sachets', 'strip', 'strips', 'tube', 'tubes', 'vial', 'vials',
+    'chai', 'gói', 'hộp', 'lọ', 'ống', 'tuýp', 'vỉ',
+})
+
+
+class StaleReviewError(Exception):
+    """A prescription was decided by someone else between the check and the update."""
+
+
+class AlreadyOrderedError(ValueError):
+    def __init__(self, order_id):
+        self.order_id = order_id
+        super().__init__('Prescription has already been ordered')
+
+
+def pending_status_id():
+    """The id of the Pending prescription status, or None if there is none."""
+    try:
+        return status_registry.get_id(PRESCRIPTION, PENDING)
+    except StatusDimension.DoesNotExist:
+        return None
+
+
+def unclaimed(now=None):
+    """Prescriptions nobody holds a live review claim on. A claim without a claimed_at has lapsed."""
+    expired = (now or timezone.now()) - timedelta(seconds=settings.PRESCRIPTION_CLAIM_TIMEOUT)
+    return Q(claimed_by__isnull=True) | Q(claimed_at__isnull=True) | Q(claimed_at__lt=expired)
+
+
+def review_queryset():
+    """Prescriptions with their patient summary and items loaded in two queries."""
+    return Prescriptions.objects.select_related('patient__id').prefetch_related(
+        Prefetch('prescriptionitems_set', queryset=PrescriptionItems.objects.select_related('product').order_by('pk'))
+    )
+
+
+def review_queue(pharmacist_id):
+    """
+    Pending prescriptions ``pharmacist_id`` may review, oldest first: those
+    nobody has claimed, claimed so long ago the claim has lapsed, or
+    claimed by them. Served by ``prescriptions_queue_idx``.
+    """
+    status_id = pending_status_id()
+    if status_id is None:
+        return Prescriptions.objects.none()
+    return review_queryset().filter(
+        unclaimed() | Q(claimed_by_id=pharmacist_id), status_id=status_id,
+    ).order_by('submitted_at', 'prescription_id')
+
+
+def claim_prescriptions(pharmacist_id, limit):
+    """
+    Claim up to ``limit`` of the oldest unclaimed pending prescriptions for
+    ``pharmacist_id`` and return their ids.
+
+    Candidates are picked with ``SELECT ... FOR UPDATE SKIP LOCKED``, so
+    pharmacists claiming at the same time each get different prescriptions
+    without waiting on one another. The claim is a conditional UPDATE, so on
+    backends without row locks (SQLite) a prescription claimed in between is
+    skipped rather than claimed twice.
+    """
+    status_id = pending_status_id()
+    if status_id is None:
+        return []
+    now = timezone.now()
+    with transaction.atomic():
+        candidates = list(
+            Prescriptions.objects.select_for_update(skip_locked=True)
+            .filter(unclaimed(now), status_id=status_id)
+            .order_by('submitted_at', 'prescription_id')
+            .values_list('pk', flat=True)[:limit]
+        )
+        if not candidates:
+            return []
+        claimed = Prescriptions.objects.filter(unclaimed(now), pk__in=candidates, status_id=status_id).update(
+            claimed_by_id=pharmacist_id, claimed_at=now
+        )
+    if claimed == len(candidates):
+        return candidates
+    return list(
+        Prescriptions.objects.filter(pk__in=candidates, claimed_by_id=pharmacist_id, claimed_at=now)
+        .order_by('submitted_at', 'prescription_id')
+        .values_list('pk', flat=True)
+    )
+
+
+def record_decisions(pharmacist_id, decisions):
+    """
+    Record ``pharmacist_id``'s review ``decisions`` ([{'prescription',
+    'decision', 'comment'}]) and return one result per decision, in order.
+
+    A decision applies if its status exists (checked against the status
+    registry) and its prescription is pending and not claimed by another
+    pharmacist. Applied decisions release the claim. The prescriptions are
+    locked in one query, the approvals inserted in one statement and the
+    statuses set in one UPDATE, whatever the batch size. Decisions that don't
+    apply are reported and skipped. Raises StaleReviewError, rolling back,
+    if a prescription was decided concurrently (only possible without row
+    locks, on SQLite).
+    """
+    results = []
+    status_ids = {}
+    for entry in decisions:
+        decision = entry['decision'].lower()
+        result = {'prescription': entry['prescription'], 'decision': decision, 'recorded': False}
+        results.append(result)
+        if decision not in DECISIONS:
+            result['error'] = f"decision must be one of {', '.join(DECISIONS)}"
+            continue
+        try:
+            status_ids[decision] = status_registry.get_id(PRESCRIPTION, DECISIONS[decision])
+        except StatusDimension.DoesNotExist:
+            result['error'] = f'Prescription status {DECISIONS[decision]} not found'
+
+    pending_id = pending_status_id()
+    now = timezone.now()
+    lapsed = now - timedelta(seconds=settings.PRESCRIPTION_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        prescriptions = Prescriptions.objects.select_for_update().only(
+            'status_id', 'claimed_by_id', 'claimed_at'
+        ).in_bulk([result['prescription'] for result in results if 'error' not in result])
+
+        accepted = {}
+        for entry, result in zip(decisions, results):
+            if 'error' in result:
+                continue
+            prescription = prescriptions.get(result['prescription'])
+            if prescription is None:
+                result['error'] = 'Prescription not found'
+            elif prescription.pk in accepted:
+                result['error'] = 'Prescription already decided in this batch'
+            elif pending_id is None or prescription.status_id != pending_id:
+                result['error'] = 'Prescription is not pending review'
+            elif (
+                prescription.claimed_by_id not in (None, pharmacist_id)
+                and prescription.claimed_at is not None
+                and prescription.claimed_at >= lapsed
+            ):
+                result['error'] = 'Prescription is claimed by another pharmacist'
+            else:
+                accepted[prescription.pk] = (entry, result)
+        if not accepted:
+            return results
+
+        approvals = PrescriptionApprovals.objects.bulk_create([
+            PrescriptionApprovals(
+                prescription_id=prescription_id,
+                approved_by_id=pharmacist_id,
+                decision=result['decision'],
+                comment=entry.get('comment'),
+            )
+            for prescription_id, (entry, result) in accepted.items()
+        ])
+        updated = Prescriptions.objects.filter(pk__in=accepted, status_id=pending_id).update(
+            status_id=Case(
+                *[When(pk=prescription_id, then=Value(status_ids[result['decision']]))
+                  for prescription_id, (_, result) in accepted.items()],
+                output_field=IntegerField(),
+            ),
+            claimed_by=None,
+            claimed_at=None,
+        )
+        if updated != len(accepted):
+            raise StaleReviewError('Prescriptions changed during review, please retry')
+
+    for (_, result), approval in zip(accepted.values(), approvals):
+        result.update(
+            recorded=True,
+            approval_id=approval.pk,
+            status_name=DECISIONS[result['decision']],
+        )
+    return results
+
+
+def pack_count(item):
+    """The whole packs to order for a prescription item, or ValueError if it isn't prescribed in packs."""
+    if item.unit.strip().lower() not in PACKAGING_UNITS:
+        raise ValueError(
+            f"Prescription item {item.pk} is prescribed in '{item.unit}', not in packs (e.g. box, bottle)"
+        )
+    count = math.ceil(item.dosage_amount)
+    if count < 1:
+        raise ValueError(f'Invalid dosage for prescription item {item.pk}')
+    return count
+
+
+def order_prescription(user_id, prescription_id, branch_id, idempotency_key=None):
+    """
+    Turn ``user_id``'s approved prescription into a Processing order at
+    ``branch_id`` and return ``(order, order_items, created)``. Must be
+    called inside ``transaction.atomic()``.
+
+    Items are ordered at the prescription's prices, each dosage rounded up
+    to whole packs (see ``pack_count``), and their stock is reserved
+    together. The prescription
+    row is locked, and one query finds an earlier order of it or one
+    created with ``idempotency_key``. Such an order is returned as is, with
+    ``created`` False, so retries don't order twice. Raises
+    Prescriptions.DoesNotExist, AlreadyOrderedError if the prescription was
+    ordered under another key, or ValueError (InsufficientStockError
+    included).
+    """
+    prescription = Prescriptions.objects.select_for_update(of=('self',)).prefetch_related(
+        Prefetch('prescriptionitems_set', queryset=PrescriptionItems.objects.order_by('pk'))
+    ).filter(pk=prescription_id, patient_id=user_id).first()
+    if prescription is None:
+        raise Prescriptions.DoesNotExist('Prescription not found')
+
+    previous = Q(prescription_id=prescription_id)
+    if idempotency_key is not None:
+        previous |= Q(user_id=user_id, idempotency_key=idempotency_key)
+    for order in Orders.objects.filter(previous).order_by('pk'):
+        if idempotency_key is not None and order.idempotency_key == idempotency_key:
+            if order.prescription_id != prescription.pk:
+                raise ValueError('Idempotency-Key was already used for another request')
+            return order, list(order.orderitems_set.all()), False
+        raise AlreadyOrderedError(order.pk)
+
+    try:
+        approved = prescription.status_id == status_registry.get_id(PRESCRIPTION, DECISIONS['approved'])
+        order_status_id = status_registry.get_id('order', 'Processing')
+    except StatusDimension.DoesNotExist as e:
+        raise ValueError(str(e))
+    if not approved:
+        raise ValueError('Prescription has not been approved')
+    items = prescription.prescriptionitems_set.all()
+    if not items:
+        raise ValueError('Prescription has no items')
+    try:
+        branch = Branches.objects.get(pk=branch_id)
+    except Branches.DoesNotExist:
+        raise ValueError('Invalid branch')
+
+    packs = [pack_count(item) for item in items]
+    quantities = {}
+    for item, count in zip(items, packs):
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + count
+    reserved = reserve_inventory(branch, quantities)
+
+    order = Orders.objects.create(
+        user_id=user_id,
+        branch=branch,
+        prescription=prescription,
+        status_id=order_status_id,
+        idempotency_key=idempotency_key,
+    )
+    order_items = OrderItems.objects.bulk_create([
+        OrderItems(
+            order=order,
+            product=reserved[item.product_id].product,
+            quantity=count,
+            price=item.unit_price,
+        )
+        for item, count in zip(items, packs)
+    ])
+    return order, order_items, True
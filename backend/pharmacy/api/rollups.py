@@ -0,0 +1,129 @@
+from collections import defaultdict
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import UserDailyRollups, UserPointBalances
+
+DAILY_FIELDS = ('time_spent_seconds', 'points_earned', 'points_received', 'activity_count')
+# A balance is the user_point_transactions ledger; activity points_earned is
+# kept per day only.
+BALANCE_FIELDS = ('points', 'time_spent_seconds')
+UPSERT_BATCH_SIZE = 500
+# pg_advisory_xact_lock key serialising rollup increments with rebuild_rollups.
+REBUILD_LOCK_ID = 0x726f6c6c  # 'roll'
+
+
+def lock_rollups(exclusive=False):
+    """
+    Hold the rollup lock until the current transaction ends: shared for
+    increments, which don't block each other, exclusive for a rebuild. An
+    increment's ledger rows must be written in the same transaction, so a
+    rebuild either sees them or runs before the increment is applied.
+    PostgreSQL only; SQLite has a single writer, and rebuild_rollups writes
+    before it reads.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    function = 'pg_advisory_xact_lock' if exclusive else 'pg_advisory_xact_lock_shared'
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {function}(%s)', [REBUILD_LOCK_ID])
+
+
+def _day(moment):
+    return timezone.localdate(moment) if timezone.is_aware(moment) else moment.date()
+
+
+def _upsert_increments(model, key_fields, rows, set_fields=(), returning=()):
+    """
+    Insert ``rows`` (dicts of field -> value) or, where a row with the same
+    ``key_fields`` exists, add the values onto it, in one
+    ``INSERT ... ON CONFLICT DO UPDATE`` statement (PostgreSQL and SQLite).
+    ``set_fields`` are overwritten rather than added. The resulting values of
+    the ``returning`` fields are returned as a list of tuples.
+    """
+    if not rows:
+        return []
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in rows[0]]
+    columns = [quote(field.column) for field in fields]
+    keys = {model._meta.get_field(name).column for name in key_fields}
+    assignments = []
+    for field in fields:
+        column = quote(field.column)
+        if field.column in keys:
+            continue
+        if field.name in set_fields:
+            assignments.append(f'{column} = EXCLUDED.{column}')
+        else:
+            assignments.append(f'{column} = {table}.{column} + EXCLUDED.{column}')
+    placeholders = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    returning_sql = ''
+    if returning:
+        returning_sql = ' RETURNING ' + ', '.join(
+            quote(model._meta.get_field(name).column) for name in returning
+        )
+    results = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            sql = (
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+                f"{', '.join([placeholders] * len(batch))} "
+                f"ON CONFLICT ({', '.join(quote(column) for column in sorted(keys))}) "
+                f"DO UPDATE SET {', '.join(assignments)}{returning_sql}"
+            )
+            params = [
+                field.get_db_prep_value(row[field.name], connection)
+                for row in batch for field in fields
+            ]
+            cursor.execute(sql, params)
+            if returning:
+                results.extend(cursor.fetchall())
+    return results
+
+
+def _apply(daily):
+    """
+    Fold {(user_id, day): {field: increment}} into both rollup tables and
+    return the new {user_id: points} balances.
+    """
+    lock_rollups()
+    now = timezone.now()
+    balances = defaultdict(lambda: dict.fromkeys(BALANCE_FIELDS, 0))
+    daily_rows = []
+    for (user_id, day), totals in sorted(daily.items()):
+        daily_rows.append({'user': user_id, 'day': day, **totals})
+        balances[user_id]['points'] += totals['points_received']
+        balances[user_id]['time_spent_seconds'] += totals['time_spent_seconds']
+    _upsert_increments(UserDailyRollups, ('user', 'day'), daily_rows)
+    return dict(_upsert_increments(
+        UserPointBalances,
+        ('user',),
+        [{'user': user_id, **totals, 'updated_at': now} for user_id, totals in sorted(balances.items())],
+        set_fields=('updated_at',),
+        returning=('user', 'points'),
+    ))
+
+
+def record_activity(rows):
+    """Add user_activity_logs rows (dicts of field values) to the rollups."""
+    daily = defaultdict(lambda: dict.fromkeys(DAILY_FIELDS, 0))
+    for values in rows:
+        totals = daily[(values['user_id'], _day(values.get('recorded_at') or timezone.now()))]
+        totals['time_spent_seconds'] += values['time_spent_seconds']
+        totals['points_earned'] += values.get('points_earned') or 0
+        totals['activity_count'] += 1
+    _apply(daily)
+
+
+def record_point_transactions(transactions):
+    """
+    Add UserPointTransactions to the rollups and point balances; returns the
+    new {user_id: points} balances.
+    """
+    daily = defaultdict(lambda: dict.fromkeys(DAILY_FIELDS, 0))
+    for transaction in transactions:
+        daily[(transaction.user_id, _day(transaction.recorded_at))]['points_received'] += transaction.points
+    return _apply(daily)
@@ -0,0 +1,440 @@
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Func, Value
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from .ingest import event_queue
+from .models import Products, UserSearchLogs
+
+FIELD_WEIGHTS = (('name', 3.0), ('manufacturer', 1.5), ('category', 1.0))
+EXACT_BOOST = 1.0
+PREFIX_BOOST = 0.6
+MAX_PREFIX_EXPANSIONS = 64
+MIN_PREFIX_LENGTH = 2
+MIN_TRIGRAM_SIMILARITY = 0.4
+RESULT_CACHE_SIZE = 1024
+# Sets of candidate products at most this large are scored outright.
+DIRECT_SCORING_LIMIT = 1000
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Lowercase, accent-folded word tokens (``'Thuốc Ho'`` -> ``['thuoc', 'ho']``)."""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text.replace('đ', 'd').replace('Đ', 'D'))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _TOKEN_RE.findall(text.lower())
+
+
+# Combining marks as a PostgreSQL regex, covering those ``tokenize`` drops from Latin text.
+COMBINING_MARKS = '[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]'
+_COMBINING_MARKS_RE = re.compile(COMBINING_MARKS)
+
+
+def _fold_table():
+    """
+    The Latin letters ``tokenize`` folds that NFKD and a C-locale lower()
+    alone miss in SQL (đ, ø, æ, non-ASCII capitals), as translate() arguments.
+    """
+    unfolded, folded = [], []
+    for code in [*range(0xC0, 0x250), *range(0x1E00, 0x1F00)]:
+        char = chr(code)
+        tokens = tokenize(char)
+        in_sql = _COMBINING_MARKS_RE.sub('', unicodedata.normalize('NFKD', char))
+        in_sql = ''.join(c.lower() if c.isascii() else c for c in in_sql)
+        if len(tokens) == 1 and len(tokens[0]) == 1 and tokens[0] != in_sql:
+            unfolded.append(char)
+            folded.append(tokens[0])
+    return ''.join(unfolded), ''.join(folded)
+
+
+# 0008_product_search_indexes indexes a frozen copy of folded()'s
+# expression; changing it needs a migration that rebuilds those indexes.
+UNFOLDED, FOLDED = _fold_table()
+
+
+def folded(field):
+    """``field`` folded in SQL the way ``tokenize`` folds text; needs a UTF8 database."""
+    text = Func(F(field), Value(UNFOLDED), Value(FOLDED), function='translate')
+    text = Func(text, template='normalize(%(expressions)s, NFKD)')
+    return Lower(Func(text, Value(COMBINING_MARKS), Value(''), Value('g'), function='regexp_replace'))
+
+
+def search_document():
+    """The weighted tsvector the database backend matches, GIN-indexed by 0008_product_search_indexes."""
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector(folded('name'), weight='A', config='simple')
+        + SearchVector(folded('manufacturer'), weight='B', config='simple')
+        + SearchVector(folded('category'), weight='C', config='simple')
+    )
+
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _by_weight(postings):
+    return lambda product_id: (-postings[product_id], product_id)
+
+
+def _best_first(entry):
+    score, product_id = entry
+    return -score, product_id
+
+
+class ProductSearchIndex:
+    """
+    In-memory inverted index over product name, manufacturer and category.
+
+    Every query token is matched exactly, then as a prefix of indexed tokens
+    (the typeahead case) and, when neither matches, by trigram similarity to
+    tolerate typos. Scores add up the field weights of every matched token.
+    The index is built on first use and kept current per product by the
+    Products save/delete receivers in ``api.signals``.
+
+    Each token's postings are also kept ranked by weight, so a query reads
+    only as far down them as its top ``limit`` results need (see ``_top``)
+    instead of scoring every matching product.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._documents = {}
+        self._postings = {}
+        # token -> its product ids, highest weight (then lowest id) first.
+        self._ranked = {}
+        self._categories = defaultdict(set)
+        self._vocabulary = []
+        self._trigrams = defaultdict(set)
+        # Typeahead repeats the same short prefixes across users, so recent
+        # results are kept until the index next changes.
+        self._results = OrderedDict()
+
+    def _ensure_built(self):
+        if self._built:
+            return
+        with self._lock:
+            if self._built:
+                return
+            products = Products.objects.values_list('product_id', 'name', 'manufacturer', 'category')
+            for product_id, name, manufacturer, category in products.iterator(chunk_size=5000):
+                self._add(product_id, {'name': name, 'manufacturer': manufacturer, 'category': category}, False)
+            for token, postings in self._postings.items():
+                self._ranked[token] = sorted(postings, key=_by_weight(postings))
+            self._built = True
+
+    def _add(self, product_id, fields, keep_sorted=True):
+        # The initial build ranks every token's postings once at the end instead.
+        weights = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS:
+            for token in tokenize(fields.get(field)):
+                weights[token] += weight
+        self._documents[product_id] = (fields.get('category'), tuple(weights))
+        self._categories[fields.get('category')].add(product_id)
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                self._ranked[token] = []
+                bisect.insort(self._vocabulary, token)
+                for trigram in trigrams(token):
+                    self._trigrams[trigram].add(token)
+            postings[product_id] = weight
+            if keep_sorted:
+                bisect.insort(self._ranked[token], product_id, key=_by_weight(postings))
+
+    def _remove(self, product_id):
+        document = self._documents.pop(product_id, None)
+        if document is None:
+            return
+        self._categories[document[0]].discard(product_id)
+        for token in document[1]:
+            postings = self._postings[token]
+            ranked = self._ranked[token]
+            key = _by_weight(postings)
+            del ranked[bisect.bisect_left(ranked, key(product_id), key=key)]
+            del postings[product_id]
+            if not postings:
+                del self._postings[token]
+                del self._ranked[token]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+                for trigram in trigrams(token):
+                    self._trigrams[trigram].discard(token)
+
+    def update(self, product):
+        with self._lock:
+            if not self._built:
+                return
+            self._results.clear()
+            self._remove(product.product_id)
+            self._add(product.product_id, {
+                'name': product.name,
+                'manufacturer': product.manufacturer,
+                'category': product.category,
+            })
+
+    def remove(self, product_id):
+        with self._lock:
+            if self._built:
+                self._results.clear()
+                self._remove(product_id)
+
+    def invalidate(self):
+        with self._lock:
+            self._built = False
+            self._documents = {}
+            self._postings = {}
+            self._ranked = {}
+            self._categories = defaultdict(set)
+            self._vocabulary = []
+            self._trigrams = defaultdict(set)
+            self._results = OrderedDict()
+
+    def _expand(self, token):
+        """Return [(indexed token, boost)] that ``token`` matches."""
+        matches = []
+        if token in self._postings:
+            matches.append((token, EXACT_BOOST))
+        start = bisect.bisect_right(self._vocabulary, token)
+        if len(token) < MIN_PREFIX_LENGTH:
+            start = len(self._vocabulary)
+        for candidate in self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not candidate.startswith(token):
+                break
+            matches.append((candidate, PREFIX_BOOST))
+        if matches or len(token) < 3:
+            return matches
+
+        query_trigrams = trigrams(token)
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] += 1
+        for candidate, count in shared.items():
+            similarity = count / len(query_trigrams | trigrams(candidate))
+            if similarity >= MIN_TRIGRAM_SIMILARITY:
+                matches.append((candidate, similarity * PREFIX_BOOST))
+        return matches
+
+    def _score(self, product_id, expansions):
+        """The product's score: per query token, its best matching token's weight times boost."""
+        total = 0.0
+        for expansion in expansions:
+            best = 0
+            for token in self._documents[product_id][1]:
+                boost = expansion.get(token)
+                if boost:
+                    score = self._postings[token][product_id] * boost
+                    if score > best:
+                        best = score
+            total += best
+        return total
+
+    def _stream(self, expansion, members):
+        """Yield ``(score, product_id)`` for one query token, best first, once per product."""
+        def scaled(token, boost):
+            postings = self._postings[token]
+            return ((-postings[product_id] * boost, product_id) for product_id in self._ranked[token])
+
+        seen = set()
+        for negative, product_id in heapq.merge(*(scaled(token, boost) for token, boost in expansion.items())):
+            if product_id not in seen and (members is None or product_id in members):
+                seen.add(product_id)
+                yield -negative, product_id
+
+    def _top(self, expansions, matched, members, limit):
+        """
+        The best ``limit`` ``(score, product_id)`` among ``members`` (all
+        products if None), which each match ``matched`` of the query tokens.
+
+        Small sets are scored outright. Otherwise each token's postings are
+        read best first, in turn, scoring every product met (the threshold
+        algorithm), until no product not yet met can score higher than the
+        current ``limit``-th: its score is at most the sum of the
+        ``matched`` best next scores, with ties going to lower ids.
+        """
+        if members is not None and len(members) <= DIRECT_SCORING_LIMIT:
+            scored = [(self._score(product_id, expansions), product_id) for product_id in members]
+            return heapq.nsmallest(limit, [entry for entry in scored if entry[0]], key=_best_first)
+
+        streams = [self._stream(expansion, members) for expansion in expansions]
+        upcoming = [next(stream, None) for stream in streams]
+        seen = set()
+        worst_first = []  # (score, -product_id) heap of the current best ``limit``
+        while True:
+            for index, entry in enumerate(upcoming):
+                if entry is None:
+                    continue
+                product_id = entry[1]
+                if product_id not in seen:
+                    seen.add(product_id)
+                    item = (self._score(product_id, expansions), -product_id)
+                    if len(worst_first) < limit:
+                        heapq.heappush(worst_first, item)
+                    elif item > worst_first[0]:
+                        heapq.heapreplace(worst_first, item)
+                upcoming[index] = next(streams[index], None)
+            live = [entry for entry in upcoming if entry is not None]
+            if len(live) < matched:
+                break
+            if len(worst_first) == limit:
+                bound = sum(sorted(score for score, _ in live)[-matched:])
+                score, negative_id = worst_first[0]
+                if score > bound or (score == bound and -negative_id < min(entry[1] for entry in live)):
+                    break
+        return sorted(((score, -negative_id) for score, negative_id in worst_first), key=_best_first)
+
+    def _ranked_results(self, expansions, members, limit):
+        if len(expansions) == 1:
+            return self._top(expansions, 1, members, limit)
+
+        # Products matching more of the query rank first, then by score.
+        matching = [
+            set().union(*(self._postings[token].keys() for token in expansion)) for expansion in expansions
+        ]
+        if members is not None:
+            matching = [products & members for products in matching]
+        everything = set.intersection(*sorted(matching, key=len))
+        results = self._top(expansions, len(expansions), everything, limit)
+        if len(results) == limit:
+            return results
+        # at_least[count]: products matching at least ``count`` tokens.
+        at_least = [None] + [set() for _ in expansions]
+        for products in matching:
+            for count in range(len(expansions), 1, -1):
+                at_least[count] |= at_least[count - 1] & products
+            at_least[1] |= products
+        for count in range(len(expansions) - 1, 0, -1):
+            results += self._top(expansions, count, at_least[count] - at_least[count + 1], limit - len(results))
+            if len(results) == limit:
+                break
+        return results
+
+    def search(self, query, category=None, limit=20):
+        """Return up to ``limit`` (product_id, score) pairs, best first."""
+        self._ensure_built()
+        tokens = tuple(dict.fromkeys(tokenize(query)))
+        key = (tokens, category, limit)
+        with self._lock:
+            results = self._results.get(key)
+            if results is not None:
+                self._results.move_to_end(key)
+                return results
+
+            expansions = [expansion for expansion in (dict(self._expand(token)) for token in tokens) if expansion]
+            members = self._categories.get(category, set()) if category else None
+            if not expansions or members == set():
+                ranked = []
+            else:
+                ranked = self._ranked_results(expansions, members, limit)
+            results = [(product_id, round(score, 3)) for score, product_id in ranked]
+            self._results[key] = results
+            if len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+            return results
+
+
+def _is_utf8():
+    """``folded`` relies on normalize(), which PostgreSQL only runs in UTF8 databases."""
+    # The server reports its encoding when the connection opens, so this
+    # costs no query.
+    connection.ensure_connection()
+    raw = connection.connection
+    if hasattr(raw, 'get_parameter_status'):  # psycopg2
+        encoding = raw.get_parameter_status('server_encoding')
+    else:  # psycopg 3
+        encoding = raw.info.parameter_status('server_encoding')
+    return encoding == 'UTF8'
+
+
+# Cleared the first time the typo fallback finds pg_trgm missing;
+# 0008_product_search_indexes installs it where the database allows.
+_trigrams = {'installed': True}
+
+
+def _similar_names(products, terms, limit):
+    """Products whose name is close to ``terms``, to tolerate typos; ``[]`` without pg_trgm."""
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    if not _trigrams['installed']:
+        return []
+    text = ' '.join(terms)
+    # trigram_word_similar (pg_trgm's %> operator, at least
+    # pg_trgm.word_similarity_threshold) is what products_name_trgm_idx serves.
+    similar = products.alias(folded_name=folded('name')).filter(folded_name__trigram_word_similar=text).annotate(
+        similarity=TrigramWordSimilarity(text, 'folded_name')
+    )
+    try:
+        # Trying the query costs less than asking whether the extension is there.
+        with transaction.atomic():
+            return list(similar.order_by('-similarity', 'product_id').values_list('product_id', 'similarity')[:limit])
+    except DatabaseError:
+        _trigrams['installed'] = False
+        return []
+
+
+def _database_search(query, category=None, limit=20):
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+
+    terms = tokenize(query)
+    if not terms:
+        return []
+    products = Products.objects.all()
+    if category:
+        products = products.filter(category=category)
+    vector = search_document()
+    # Tokens are plain \w+ words, so they are safe to use as raw tsquery terms.
+    search_query = SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw', config='simple')
+    results = list(
+        products.annotate(document=vector, rank=SearchRank(vector, search_query))
+        .filter(document=search_query)
+        .order_by('-rank', 'product_id')
+        .values_list('product_id', 'rank')[:limit]
+    )
+    if results:
+        return results
+    # Nothing matches word for word.
+    return _similar_names(products, terms, limit)
+
+
+def use_database_search():
+    backend = getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'auto')
+    if backend == 'auto':
+        return connection.vendor == 'postgresql' and _is_utf8()
+    return backend == 'database'
+
+
+def search_products(query, category=None, limit=20):
+    """Return up to ``limit`` (product_id, score) pairs for ``query``, best first."""
+    if use_database_search():
+        return _database_search(query, category=category, limit=limit)
+    return product_index.search(query, category=category, limit=limit)
+
+
+def log_search(user_id, keyword, category, search_filters, results_count):
+    """Queue a user_search_logs row on the analytics write-behind queue."""
+    event_queue.put([(UserSearchLogs, {
+        'user_id': user_id,
+        'keyword': keyword[:255],
+        'category': category[:100] if category else None,
+        'search_filters': search_filters[:255] if search_filters else None,
+        'results_count': results_count,
+        'searched_at': timezone.now(),
+    })])
+
+
+product_index = ProductSearchIndex()
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import *
+from .status import status_registry
+from .permissions import STAFF_ROLES
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 import re
@@ -31,8 +33,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         ]
 
     def validate(self, data):
-        if User.objects.filter(username=data['username']).exists():
-            raise serializers.ValidationError({'username': 'Username already exists'})
+        # The username's UniqueValidator has already rejected duplicates.
         if User.objects.filter(email=data['email']).exists():
             raise serializers.ValidationError({'email': 'Email already exists'})
         if len(data['password']) < 8:
@@ -44,6 +45,8 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         valid_roles = ['patient', 'doctor', 'pharmacist', 'admin']
         if data['role'] not in valid_roles:
             raise serializers.ValidationError({'role': f'Role must be one of {valid_roles}'})
+        if data['role'] in STAFF_ROLES:
+            raise serializers.ValidationError({'role': 'Staff roles are assigned by an administrator'})
         return data
 
     def create(self, validated_data):
@@ -64,17 +67,18 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
             first_name=validated_data['first_name'],
             last_name=validated_data['last_name']
         )
-        Users.objects.create(id=user, **users_data)
+        users = Users.objects.create(id=user, **users_data)
         refresh = RefreshToken.for_user(user)
         return {
             'user': user,
+            'users': users,
             'refresh': str(refresh),
             'access': str(refresh.access_token)
         }
 
     def to_representation(self, instance):
         user = instance['user']
-        users = Users.objects.get(id=user)
+        users = instance.get('users') or Users.objects.get(id=user)
         return {
             'refresh': instance['refresh'],
             'access': instance['access'],
@@ -133,6 +137,8 @@ class UsersModelSerializer(serializers.ModelSerializer):
             'role',
             'birth_date',
         ]
+        # Roles grant access (see permissions.IsPharmacist); users can't change their own.
+        read_only_fields = ['role']
 
 class UsersSerializer(serializers.ModelSerializer):
     users = UsersModelSerializer(allow_null=True)
@@ -167,8 +173,12 @@ class UsersSerializer(serializers.ModelSerializer):
         users_data = validated_data.pop('users', {})
         instance = super().update(instance, validated_data)
         
-        # Update or create Users instance, excluding role
-        users, _ = Users.objects.get_or_create(id=instance.id, defaults={'role': 'patient'})
+        # Update or create Users instance, excluding role. Authentication
+        # has usually loaded it already.
+        try:
+            users = instance.users
+        except Users.DoesNotExist:
+            users = Users(id=instance, role='patient')
         users_serializer = UsersModelSerializer(users, data=users_data, partial=True)
         if users_serializer.is_valid():
             users_serializer.save()
@@ -187,6 +197,9 @@ class ProductsSerializer(serializers.ModelSerializer):
         model = Products
         fields = '__all__'
 
+class CatalogProductSerializer(ProductsSerializer):
+    available_quantity = serializers.IntegerField(read_only=True)
+
 class InventorySerializer(serializers.ModelSerializer):
     product = serializers.PrimaryKeyRelatedField(queryset=Products.objects.all())
     branch = serializers.PrimaryKeyRelatedField(queryset=Branches.objects.all())
@@ -213,14 +226,126 @@ class StatusDimensionSerializer(serializers.ModelSerializer):
         model = StatusDimension
         fields = '__all__'
 
+class StatusField(serializers.PrimaryKeyRelatedField):
+    """Status foreign key validated against the in-process status registry."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('queryset', StatusDimension.objects.all())
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            return status_registry.get(int(data))
+        except StatusDimension.DoesNotExist:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
 class OrdersSerializer(serializers.ModelSerializer):
+    status = StatusField()
     order_items = serializers.SerializerMethodField()
+    status_name = serializers.SerializerMethodField()
 
     class Meta:
         model = Orders
-        fields = '__all__'
+        exclude = ['idempotency_key']
+
+    def get_status_name(self, obj):
+        return status_registry.get_name(obj.status_id)
 
     def get_order_items(self, obj):
-        order_items = obj.orderitems_set.all()
+        # Callers that already hold the items pass them in the context.
+        order_items = self.context.get('order_items')
+        if order_items is None:
+            order_items = obj.orderitems_set.all()
         return OrderItemsSerializer(order_items, many=True).data
-    
+
+
+class ProductSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Products
+        fields = ['product_id', 'name', 'category', 'unit_price']
+
+class OrderHistoryItemSerializer(serializers.ModelSerializer):
+    product = ProductSummarySerializer(read_only=True)
+
+    class Meta:
+        model = OrderItems
+        fields = ['order_item_id', 'product', 'quantity', 'price']
+
+class OrderHistorySerializer(serializers.ModelSerializer):
+    """Order with its items, product summaries, branch and status names."""
+    branch_name = serializers.CharField(source='branch.name', read_only=True)
+    status_name = serializers.SerializerMethodField()
+    order_items = OrderHistoryItemSerializer(source='orderitems_set', many=True, read_only=True)
+
+    class Meta:
+        model = Orders
+        fields = [
+            'order_id',
+            'user',
+            'branch',
+            'branch_name',
+            'prescription',
+            'status',
+            'status_name',
+            'created_at',
+            'order_items',
+        ]
+
+    def get_status_name(self, obj):
+        return status_registry.get_name(obj.status_id)
+
+
+class PatientSummarySerializer(serializers.ModelSerializer):
+    user_id = serializers.IntegerField(source='pk', read_only=True)
+    username = serializers.CharField(source='id.username', read_only=True)
+    first_name = serializers.CharField(source='id.first_name', read_only=True)
+    last_name = serializers.CharField(source='id.last_name', read_only=True)
+
+    class Meta:
+        model = Users
+        fields = ['user_id', 'username', 'first_name', 'last_name', 'birth_date', 'phone_number']
+
+class PrescriptionItemSerializer(serializers.ModelSerializer):
+    product = ProductSummarySerializer(read_only=True)
+
+    class Meta:
+        model = PrescriptionItems
+        fields = ['prescription_items_id', 'product', 'dosage_amount', 'unit', 'unit_price']
+
+class ReviewQueueSerializer(serializers.ModelSerializer):
+    """Prescription with its items and a summary of the patient."""
+    status_name = serializers.SerializerMethodField()
+    patient = PatientSummarySerializer(read_only=True)
+    items = PrescriptionItemSerializer(source='prescriptionitems_set', many=True, read_only=True)
+
+    class Meta:
+        model = Prescriptions
+        fields = [
+            'prescription_id',
+            'image_url',
+            'classification',
+            'status',
+            'status_name',
+            'submitted_at',
+            'patient',
+            'doctor',
+            'claimed_by',
+            'claimed_at',
+            'items',
+        ]
+
+    def get_status_name(self, obj):
+        return status_registry.get_name(obj.status_id)
+
+class PrescriptionDecisionSerializer(serializers.Serializer):
+    prescription = serializers.IntegerField(min_value=1)
+    decision = serializers.CharField(max_length=50)
+    comment = serializers.CharField(max_length=255, required=False, allow_blank=True, allow_null=True)
+
+
+class UserDailyRollupsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserDailyRollups
+        fields = ['day', 'time_spent_seconds', 'points_earned', 'points_received', 'activity_count']
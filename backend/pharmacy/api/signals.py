@@ -0,0 +1,84 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import bump_version, invalidate_profile, BRANCHES, CATALOG
+from .geo import branch_index
+from .instrumentation import install_query_recorder
+from .leaderboard import leaderboard
+from .search import product_index
+from . import rollups
+from .models import StatusDimension, Branches, Products, Inventory, Users, UserActivityLogs, UserPointTransactions
+from .status import status_registry
+
+
+@receiver(connection_created)
+def record_connection_queries(sender, connection, **kwargs):
+    install_query_recorder(connection)
+
+
+@receiver([post_save, post_delete], sender=StatusDimension)
+def invalidate_status_registry(sender, **kwargs):
+    status_registry.invalidate()
+    # Drop it again once the change is visible to other connections.
+    transaction.on_commit(status_registry.invalidate)
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Users)
+def invalidate_profile_cache(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_profile(user_id))
+
+
+@receiver([post_save, post_delete], sender=Branches)
+def invalidate_branches_cache(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(BRANCHES))
+
+
+@receiver([post_save, post_delete], sender=Branches)
+def invalidate_branch_index(sender, **kwargs):
+    branch_index.invalidate()
+    transaction.on_commit(branch_index.invalidate)
+
+
+@receiver([post_save, post_delete], sender=Products)
+@receiver([post_save, post_delete], sender=Inventory)
+def invalidate_catalog_cache(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(CATALOG))
+
+
+@receiver(post_save, sender=Products)
+def update_product_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: product_index.update(instance))
+
+
+@receiver(post_delete, sender=Products)
+def remove_from_product_index(sender, instance, **kwargs):
+    product_id = instance.product_id
+    transaction.on_commit(lambda: product_index.remove(product_id))
+
+
+@receiver(post_save, sender=UserActivityLogs)
+def roll_up_activity(sender, instance, created, **kwargs):
+    if created:
+        rollups.record_activity([{
+            'user_id': instance.user_id,
+            'recorded_at': instance.recorded_at,
+            'time_spent_seconds': instance.time_spent_seconds,
+            'points_earned': instance.points_earned,
+        }])
+
+
+@receiver(post_save, sender=UserPointTransactions)
+def roll_up_point_transaction(sender, instance, created, **kwargs):
+    if created:
+        balances = rollups.record_point_transactions([instance])
+
+        def update_leaderboard():
+            for user_id, points in balances.items():
+                leaderboard.set_points(user_id, points)
+
+        transaction.on_commit(update_leaderboard)
@@ -0,0 +1,67 @@
+import threading
+
+from .models import StatusDimension
+
+
+class StatusRegistry:
+    """
+    In-process copy of the ``status_dimension`` table.
+
+    The table is loaded on first use and resolves ``(entity_type, status_name)``
+    to a status id (and back) from memory. Saving or deleting a StatusDimension
+    clears it (see ``api.signals``); a lookup that misses reloads once so rows
+    added by another worker process are still found.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = None
+        self._statuses = None
+
+    def _load(self):
+        with self._lock:
+            ids = {}
+            statuses = {}
+            for status in StatusDimension.objects.all():
+                ids[(status.entity_type, status.status_name)] = status.status_id
+                statuses[status.status_id] = status
+            self._ids, self._statuses = ids, statuses
+        return ids, statuses
+
+    def _tables(self, reload=False):
+        ids, statuses = self._ids, self._statuses
+        if ids is None or statuses is None or reload:
+            ids, statuses = self._load()
+        return ids, statuses
+
+    def get_id(self, entity_type, status_name):
+        ids, _ = self._tables()
+        key = (entity_type, status_name)
+        if key not in ids:
+            ids, _ = self._tables(reload=True)
+            if key not in ids:
+                raise StatusDimension.DoesNotExist(
+                    f'No {entity_type} status named {status_name!r}'
+                )
+        return ids[key]
+
+    def get(self, status_id):
+        _, statuses = self._tables()
+        if status_id not in statuses:
+            _, statuses = self._tables(reload=True)
+            if status_id not in statuses:
+                raise StatusDimension.DoesNotExist(f'No status with id {status_id}')
+        return statuses[status_id]
+
+    def get_name(self, status_id):
+        try:
+            return self.get(status_id).status_name
+        except StatusDimension.DoesNotExist:
+            return None
+
+    def invalidate(self):
+        self._ids = None
+        self._statuses = None
+
+
+status_registry = StatusRegistry()
@@ -1,3 +1,1498 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import json
+import re
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction, IntegrityError, OperationalError
+from django.http import HttpResponse
+from django.test import AsyncClient, LiveServerTestCase, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+
+from . import search, urls
+from .models import *
+from .async_views import _in_worker
+from .geo import branch_index
+from .idempotency import request_fingerprint
+from .ingest import event_queue, write_rows, WriteBehindQueue
+from .leaderboard import leaderboard, RankedSkipList
+from .instrumentation import is_transaction_control, QueryMetricsMiddleware, request_metrics, sql_shape
+from .search import _is_utf8, _trigrams, product_index, search_document
+from .serializer import BranchesSerializer
+from .status import status_registry
+
+
+def create_user(username, role='patient'):
+    user = User.objects.create_user(username=username, password='password123')
+    Users.objects.create(id=user, role=role)
+    return user
+
+
+def cursor_pages(client, response, key):
+    """Follow a cursor-paginated response's next links; returns each page's ``key`` values."""
+    pages = []
+    while True:
+        page = response.json()
+        assert 'count' not in page, page
+        pages.append([result[key] for result in page['results']])
+        if page['next'] is None:
+            return pages
+        response = client.get(page['next'])
+
+
+def close_worker_connections(test):
+    """
+    Have the async views' worker threads close their connection after each
+    call for the rest of ``test``; kept open, they outlive the test and stop
+    the test database from being dropped.
+    """
+    conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+    connection.settings_dict['CONN_MAX_AGE'] = 0
+    test.addCleanup(connection.settings_dict.__setitem__, 'CONN_MAX_AGE', conn_max_age)
+    test.enterContext(override_settings(DB_WORKER_CONN_MAX_AGE=0))
+
+
+class CreateOrderTestCase(TestCase):
+    def setUp(self):
+        self.user = create_user('patient')
+        self.branch = Branches.objects.create(name='Central', address='1 Main St')
+        StatusDimension.objects.create(entity_type='order', status_name='Processing')
+        self.products = [
+            Products.objects.create(name=f'Product {i}', unit_price=10) for i in range(3)
+        ]
+        for product in self.products:
+            Inventory.objects.create(product=product, branch=self.branch, available_qty=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def order(self, items):
+        return self.client.post('/api/users/order/create', {
+            'order': {'branch': self.branch.pk},
+            'order_items': [{'product': product.pk, 'quantity': qty} for product, qty in items],
+        }, format='json')
+
+    def test_reserves_stock(self):
+        response = self.order([(self.products[0], 2), (self.products[1], 5)])
+        self.assertEqual(response.status_code, 201)
+        stock = Inventory.objects.get(product=self.products[1], branch=self.branch)
+        self.assertEqual((stock.available_qty, stock.reserved_qty), (0, 5))
+
+    def test_one_inventory_row_per_product_and_branch(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Inventory.objects.create(product=self.products[0], branch=self.branch, available_qty=1)
+
+    def test_query_count_independent_of_cart_size(self):
+        products = [Products.objects.create(name=f'Bulk {i}', unit_price=2) for i in range(40)]
+        for product in products:
+            Inventory.objects.create(product=product, branch=self.branch, available_qty=5)
+        status_registry.get_id('order', 'Processing')
+        with CaptureQueriesContext(connection) as small:
+            self.order([(products[0], 1)])
+        with CaptureQueriesContext(connection) as large:
+            response = self.order([(product, 1) for product in products[1:]])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['order_items']), 39)
+        self.assertEqual(len(small), len(large))
+
+    def test_out_of_range_ids_and_quantities_are_rejected(self):
+        for order, items in [
+            ({'branch': 10 ** 20}, [{'product': self.products[0].pk, 'quantity': 1}]),
+            ({'branch': self.branch.pk}, [{'product': 10 ** 20, 'quantity': 1}]),
+            ({'branch': self.branch.pk}, [{'product': self.products[0].pk, 'quantity': 2 ** 31}]),
+        ]:
+            response = self.client.post(
+                '/api/users/order/create', {'order': order, 'order_items': items}, format='json'
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(response.json()['error'], ('Invalid branch', 'Invalid order item format'))
+        self.assertFalse(Orders.objects.exists())
+
+    def test_reports_every_short_item(self):
+        response = self.order([(self.products[0], 6), (self.products[1], 1), (self.products[2], 9)])
+        self.assertEqual(response.status_code, 400)
+        shortages = response.json()['shortages']
+        self.assertEqual([s['product'] for s in shortages], [self.products[0].pk, self.products[2].pk])
+        self.assertFalse(Orders.objects.exists())
+        self.assertFalse(Inventory.objects.filter(reserved_qty__gt=0).exists())
+
+
+class OrderHistoryTestCase(TestCase):
+    def setUp(self):
+        self.user = create_user('patient')
+        self.users = Users.objects.get(id=self.user)
+        self.branch = Branches.objects.create(name='Central', address='1 Main St')
+        self.status = StatusDimension.objects.create(entity_type='order', status_name='Processing')
+        self.products = [
+            Products.objects.create(name=f'Product {i}', unit_price=10) for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_orders(self, count):
+        orders = Orders.objects.bulk_create(
+            Orders(user=self.users, branch=self.branch, status=self.status) for _ in range(count)
+        )
+        OrderItems.objects.bulk_create(
+            OrderItems(order=order, product=product, quantity=1, price=10)
+            for order in orders for product in self.products
+        )
+
+    def fetch(self):
+        return self.client.get('/api/users/order/details', {'expand': 'true', 'page_size': 100})
+
+    def fetch_cursor(self):
+        return self.client.get('/api/users/order/details', {'pagination': 'cursor'})
+
+    def test_cursor_pages_newest_first_without_duplicates_or_gaps(self):
+        self.create_orders(7)
+        # Orders created together tie on created_at; order_id breaks the tie.
+        Orders.objects.update(created_at=timezone.now())
+        expected = list(Orders.objects.order_by('-order_id').values_list('order_id', flat=True))
+        pages = cursor_pages(self.client, self.fetch_cursor(), 'order_id')
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+        # An order placed while paging doesn't shift the pages still to come.
+        response = self.fetch_cursor()
+        self.create_orders(1)
+        rest = cursor_pages(self.client, self.client.get(response.json()['next']), 'order_id')
+        self.assertEqual([order['order_id'] for order in response.json()['results']] + sum(rest, []), expected)
+
+    def test_cursor_pages_follow_created_at_like_page_numbers(self):
+        self.create_orders(7)
+        # Older ids created later, with ties: created_at and order_id disagree.
+        now = timezone.now()
+        for i, order_id in enumerate(Orders.objects.order_by('order_id').values_list('order_id', flat=True)):
+            Orders.objects.filter(pk=order_id).update(created_at=now - timezone.timedelta(minutes=i // 2))
+        expected = [order['order_id'] for order in self.fetch().json()['results']]
+        self.assertNotEqual(expected, sorted(expected, reverse=True))
+        pages = cursor_pages(self.client, self.fetch_cursor(), 'order_id')
+        self.assertEqual(sum(pages, []), expected)
+
+        # Orders cancelled and placed between pages don't shift the rest.
+        response = self.fetch_cursor()
+        first = [order['order_id'] for order in response.json()['results']]
+        Orders.objects.filter(pk=first[-1]).delete()
+        self.create_orders(1)
+        placed = Orders.objects.latest('order_id').pk
+        rest = cursor_pages(self.client, self.client.get(response.json()['next']), 'order_id')
+        self.assertEqual(first + sum(rest, []), expected)
+        previous = self.client.get(self.client.get(response.json()['next']).json()['previous']).json()
+        self.assertEqual([order['order_id'] for order in previous['results']], [placed] + first[:-1])
+
+    def test_expanded_history(self):
+        self.create_orders(1)
+        order = self.fetch().json()['results'][0]
+        self.assertEqual(order['branch_name'], 'Central')
+        self.assertEqual(order['status_name'], 'Processing')
+        self.assertEqual(order['order_items'][0]['product']['name'], 'Product 0')
+
+    def test_query_count_independent_of_order_count(self):
+        self.create_orders(3)
+        status_registry.get_id('order', 'Processing')
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(len(self.fetch().json()['results']), 3)
+        self.create_orders(97)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(len(self.fetch().json()['results']), 100)
+        self.assertEqual(len(few), len(many))
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.branch = Branches.objects.create(name='Central', address='1 Main St')
+        self.product = Products.objects.create(name='Paracetamol', unit_price=3)
+
+    def test_catalog_cached_until_stock_changes(self):
+        first = self.client.get('/api/products')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/products').json(), first.json())
+        with self.captureOnCommitCallbacks(execute=True):
+            Inventory.objects.create(product=self.product, branch=self.branch, available_qty=4)
+        response = self.client.get('/api/products')
+        self.assertEqual(response.json()['results'][0]['available_quantity'], 4)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get('/api/branches')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/branches', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Branches.objects.create(name='North', address='2 Side St')
+        response = self.client.get('/api/branches', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_etag_follows_content_not_cache_version(self):
+        etag = self.client.get('/api/branches')['ETag']
+        # A restarted worker, or one whose local cache expired before it saw
+        # a change, starts again from version 1.
+        cache.clear()
+        self.assertEqual(self.client.get('/api/branches', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Branches.objects.create(name='North', address='2 Side St')
+        cache.clear()
+        response = self.client.get('/api/branches', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, len(response.json())), (200, 2))
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class NearbyBranchesTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hanoi = Branches.objects.create(name='Hanoi', address='a', latitude=21.0285, longitude=105.8542)
+        self.hue = Branches.objects.create(name='Hue', address='b', latitude=16.4637, longitude=107.5909)
+        self.saigon = Branches.objects.create(name='Saigon', address='c', latitude=10.8231, longitude=106.6297)
+        Branches.objects.create(name='Unmapped', address='d')
+
+    def test_nearest_first_with_radius_and_stock(self):
+        product = Products.objects.create(name='Paracetamol', unit_price=3)
+        Inventory.objects.create(product=product, branch=self.hue, available_qty=6)
+        near_hanoi = {'lat': 20.8449, 'lng': 106.6881, 'product': product.pk}
+        results = self.client.get('/api/branches/nearby', near_hanoi).json()
+        self.assertEqual([branch['name'] for branch in results], ['Hanoi', 'Hue', 'Saigon'])
+        self.assertAlmostEqual(results[0]['distance_km'], 89, delta=5)
+        self.assertEqual([branch['available_qty'] for branch in results], [0, 6, 0])
+
+        results = self.client.get('/api/branches/nearby', {**near_hanoi, 'radius': 100}).json()
+        self.assertEqual([branch['name'] for branch in results], ['Hanoi'])
+
+        response = self.client.get('/api/branches/nearby', {**near_hanoi, 'product': 10 ** 20})
+        self.assertEqual(response.status_code, 400)
+
+    def test_index_rebuilt_on_branch_change(self):
+        self.client.get('/api/branches/nearby', {'lat': 16.0544, 'lng': 108.2022})
+        Branches.objects.create(name='Da Nang', address='e', latitude=16.0544, longitude=108.2022)
+        response = self.client.get('/api/branches/nearby', {'lat': 16.0544, 'lng': 108.2022, 'limit': 1})
+        self.assertEqual(response.json()[0]['name'], 'Da Nang')
+
+
+class ProductCatalogTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.branches = [Branches.objects.create(name=f'Branch {i}', address='a') for i in range(2)]
+        self.products = [Products.objects.create(name=f'Product {i}') for i in range(3)]
+        Inventory.objects.create(product=self.products[0], branch=self.branches[0], available_qty=4)
+        Inventory.objects.create(product=self.products[0], branch=self.branches[1], available_qty=3)
+        Inventory.objects.create(product=self.products[1], branch=self.branches[1], available_qty=2)
+        self.client = APIClient()
+
+    def fetch(self, **params):
+        cache.clear()
+        return self.client.get('/api/products', {'page_size': 100, **params})
+
+    def stock(self, **params):
+        return {product['product_id']: product['available_quantity'] for product in self.fetch(**params).json()['results']}
+
+    def test_stock_summed_over_branches_and_filtered(self):
+        first, second, unstocked = (product.pk for product in self.products)
+        north, south = (branch.pk for branch in self.branches)
+        self.assertEqual(self.stock(), {first: 7, second: 2, unstocked: 0})
+        self.assertEqual(self.stock(branch=north), {first: 4, second: 0, unstocked: 0})
+        self.assertEqual(self.stock(in_stock='true'), {first: 7, second: 2})
+        self.assertEqual(self.stock(branch=north, in_stock='true'), {first: 4})
+        self.assertEqual(self.stock(branch=south, in_stock='true'), {first: 3, second: 2})
+        self.assertEqual(self.fetch(branch='north').status_code, 400)
+        self.assertEqual(self.fetch(branch=str(10 ** 20)).status_code, 400)
+
+    def test_cursor_pages_in_id_order_without_duplicates_or_gaps(self):
+        for i in range(8):
+            Products.objects.create(name=f'Extra {i}')
+        expected = list(Products.objects.order_by('product_id').values_list('product_id', flat=True))
+        pages = cursor_pages(self.client, self.fetch(pagination='cursor', page_size=4), 'product_id')
+        self.assertEqual([len(page) for page in pages], [4, 4, 3])
+        self.assertEqual(sum(pages, []), expected)
+        in_stock = cursor_pages(
+            self.client, self.fetch(pagination='cursor', page_size=1, in_stock='true'), 'product_id'
+        )
+        self.assertEqual(in_stock, [[self.products[0].pk], [self.products[1].pk]])
+
+    def test_query_count_independent_of_catalog_size(self):
+        params = {'branch': self.branches[0].pk, 'in_stock': 'true'}
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(len(self.fetch(**params).json()['results']), 1)
+        for i in range(30):
+            product = Products.objects.create(name=f'Extra {i}')
+            for branch in self.branches:
+                Inventory.objects.create(product=product, branch=branch, available_qty=i + 1)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(len(self.fetch(**params).json()['results']), 31)
+        self.assertEqual(len(few), len(many))
+
+
+class ProductAvailabilityTestCase(TestCase):
+    def test_matrix_from_one_query(self):
+        branches = [Branches.objects.create(name=f'Branch {i}', address='a') for i in range(2)]
+        products = [Products.objects.create(name=f'Product {i}') for i in range(3)]
+        Inventory.objects.create(product=products[0], branch=branches[1], available_qty=4, reserved_qty=1)
+        Inventory.objects.create(product=products[2], branch=branches[0], available_qty=7)
+        ids = ','.join(str(product.pk) for product in products)
+        with self.assertNumQueries(1):
+            dense = APIClient().get('/api/products/availability', {'products': ids}).json()
+        self.assertEqual(dense['branches'], [branch.pk for branch in branches])
+        self.assertEqual(dense['available_qty'], [[0, 4], [0, 0], [7, 0]])
+        self.assertEqual(dense['reserved_qty'], [[0, 1], [0, 0], [0, 0]])
+        sparse = APIClient().get('/api/products/availability', {'products': ids, 'encoding': 'sparse'}).json()
+        self.assertCountEqual(sparse['entries'], [[0, 1, 4, 1], [2, 0, 7, 0]])
+
+    def test_out_of_range_ids_are_rejected(self):
+        response = APIClient().get('/api/products/availability', {'products': f'1,{10 ** 20}'})
+        self.assertEqual(response.status_code, 400)
+        response = APIClient().get('/api/products/availability', {'products': '1', 'branches': str(2 ** 31)})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(PRODUCT_SEARCH_BACKEND='memory')
+class ProductSearchTestCase(TestCase):
+    def setUp(self):
+        product_index.invalidate()
+        self.paracetamol = Products.objects.create(name='Paracetamol 500mg', manufacturer='DHG', category='Medicine')
+        self.panadol = Products.objects.create(name='Panadol Extra', manufacturer='GSK', category='Medicine')
+        self.syrup = Products.objects.create(name='Thuốc ho Bảo Thanh', manufacturer='Hoa Linh', category='Medicine')
+        self.client = APIClient()
+
+    def search(self, query, **params):
+        response = self.client.get('/api/products/search', {'q': query, **params})
+        return [product['product_id'] for product in response.json()['results']]
+
+    def test_prefix_typo_and_accent_matching(self):
+        self.assertEqual(self.search('parac'), [self.paracetamol.pk])
+        self.assertEqual(self.search('panadl'), [self.panadol.pk])
+        self.assertEqual(self.search('thuoc ho'), [self.syrup.pk])
+
+    def test_index_follows_product_changes(self):
+        self.search('para')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.panadol.name = 'Paracetamol Kids'
+            self.panadol.save()
+        self.assertEqual(set(self.search('paracetamol')), {self.paracetamol.pk, self.panadol.pk})
+        self.assertEqual(self.search('paracetamol 500'), [self.paracetamol.pk, self.panadol.pk])
+
+    def test_search_indexes_match_the_live_folding(self):
+        # The migration freezes folded()'s expression; if this fails, add a
+        # migration rebuilding the search indexes with the new one.
+        migration = importlib.import_module('api.migrations.0008_product_search_indexes')
+        self.assertEqual(
+            (migration.UNFOLDED, migration.FOLDED, migration.COMBINING_MARKS),
+            (search.UNFOLDED, search.FOLDED, search.COMBINING_MARKS),
+        )
+
+    def test_only_users_with_a_profile_are_logged(self):
+        admin = User.objects.create_superuser('admin', password='password123')
+        with mock.patch.object(event_queue, 'put', return_value=0) as put:
+            self.client.force_authenticate(admin)
+            self.assertEqual(self.search('parac'), [self.paracetamol.pk])
+            put.assert_not_called()
+            self.client.force_authenticate(create_user('patient'))
+            self.search('parac')
+        [(model, values)] = put.call_args.args[0]
+        self.assertEqual((model, values['keyword']), (UserSearchLogs, 'parac'))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgreSQL full-text search')
+@override_settings(PRODUCT_SEARCH_BACKEND='database')
+class DatabaseSearchTestCase(TestCase):
+    def setUp(self):
+        if not _is_utf8():
+            self.skipTest('the database search backend needs a UTF8 database')
+        self.panadol = Products.objects.create(name='Panadol Extra', manufacturer='GSK', category='Medicine')
+        self.syrup = Products.objects.create(name='Thuốc ho Bảo Thanh', manufacturer='Hoa Linh', category='Medicine')
+        self.vitamin = Products.objects.create(name='GSK Vitamin C', manufacturer='DHG', category='Vitamins')
+        self.client = APIClient()
+
+    def search(self, query, **params):
+        response = self.client.get('/api/products/search', {'q': query, **params})
+        return [product['product_id'] for product in response.json()['results']]
+
+    def test_accents_are_folded_on_both_sides(self):
+        self.assertEqual(self.search('thuoc ho'), [self.syrup.pk])
+        self.assertEqual(self.search('THUỐC bảo'), [self.syrup.pk])
+        self.assertEqual(self.search('đỏ'), [])
+
+    def test_prefixes_rank_by_field_and_filter_by_category(self):
+        # A name match outranks a manufacturer match.
+        self.assertEqual(self.search('gs'), [self.vitamin.pk, self.panadol.pk])
+        self.assertEqual(self.search('gs', category='Medicine'), [self.panadol.pk])
+
+    def test_typos_fall_back_to_trigram_similarity(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if cursor.fetchone() is None:
+                self.skipTest('pg_trgm is not installed')
+        self.assertEqual(self.search('panadl'), [self.panadol.pk])
+
+    def test_typo_fallback_turns_off_without_pg_trgm(self):
+        self.enterContext(mock.patch.dict(_trigrams, installed=True))
+        with connection.cursor() as cursor:
+            cursor.execute('DROP EXTENSION IF EXISTS pg_trgm CASCADE')
+        self.assertEqual(self.search('panadl'), [])
+        self.assertFalse(_trigrams['installed'])
+        # Searches still work, and no longer try the fallback.
+        self.assertEqual(self.search('panadol'), [self.panadol.pk])
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.search('panadl'), [])
+        self.assertFalse(any('word_similarity' in query['sql'].lower() for query in captured))
+
+    def test_matching_uses_the_search_index(self):
+        from django.contrib.postgres.search import SearchQuery
+
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        query = SearchQuery('thuoc:*', search_type='raw', config='simple')
+        plan = Products.objects.annotate(document=search_document()).filter(document=query).explain()
+        self.assertIn('products_search_idx', plan)
+
+
+class EventIngestTestCase(TestCase):
+    def setUp(self):
+        # Keep the background writer idle; the test flushes on its own thread.
+        self.enterContext(mock.patch.object(event_queue, 'max_delay', 3600))
+        event_queue.flush()
+        self.user = create_user('patient')
+        self.product = Products.objects.create(name='Paracetamol')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_valid_events_buffered_and_flushed_in_bulk(self):
+        response = self.client.post('/api/users/events', {'events': [
+            {'type': 'ui_interaction', 'component': 'Cart', 'action': 'tap'},
+            {'type': 'product_view', 'product': self.product.pk},
+            {'type': 'product_view', 'product': 999999},
+            {'type': 'activity', 'time_spent_seconds': -5},
+            {'type': 'activity', 'time_spent_seconds': 30, 'points_earned': 2},
+            {'type': 'unknown'},
+            {'type': 'product_view', 'product': 10 ** 20},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['accepted'], 3)
+        self.assertEqual([r['index'] for r in response.json()['rejected']], [2, 3, 5, 6])
+        # Savepoint, one insert per model, two rollup upserts, release, and
+        # on PostgreSQL the rollup lock. The COPYs PostgreSQL inserts with
+        # bypass the query log.
+        with self.assertNumQueries(5 if connection.vendor == 'postgresql' else 7):
+            self.assertEqual(event_queue.flush(), 3)
+        self.assertEqual(UserProductViews.objects.get().product_id, self.product.pk)
+        self.assertEqual(UserActivityLogs.objects.get().points_earned, 2)
+
+    def test_profile_checked_without_a_query(self):
+        event = {'type': 'product_view', 'product': self.product.pk}
+        # Only the product lookup; the user and profile come from authentication.
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/users/events', {'events': [event]}, format='json')
+        self.assertEqual(response.json()['accepted'], 1)
+        self.client.force_authenticate(User.objects.create_superuser('admin', password='password123'))
+        response = self.client.post('/api/users/events', {'events': [event]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_client_timestamps_kept_within_bounds(self):
+        now = timezone.now()
+        yesterday = now - timezone.timedelta(days=1)
+        hanoi = timezone.get_fixed_timezone(7 * 60)
+        response = self.client.post('/api/users/events', {'events': [
+            {'type': 'activity', 'time_spent_seconds': 30, 'timestamp': yesterday.astimezone(hanoi).isoformat()},
+            {'type': 'activity', 'time_spent_seconds': 5, 'timestamp': yesterday.replace(tzinfo=None).isoformat()},
+            {'type': 'activity', 'time_spent_seconds': 5, 'timestamp': (now + timezone.timedelta(hours=1)).isoformat()},
+            {'type': 'activity', 'time_spent_seconds': 5, 'timestamp': (now - timezone.timedelta(days=30)).isoformat()},
+            {'type': 'activity', 'time_spent_seconds': 5, 'timestamp': '2026-13-01T00:00:00Z'},
+            {'type': 'ui_interaction', 'component': 'Cart', 'action': 'tap'},
+        ]}, format='json')
+        self.assertEqual(response.json()['accepted'], 2)
+        self.assertEqual([r['index'] for r in response.json()['rejected']], [1, 2, 3, 4])
+        event_queue.flush()
+
+        self.assertEqual(UserActivityLogs.objects.get().recorded_at, yesterday)
+        self.assertGreaterEqual(UserUiInteractions.objects.get().occurred_at, now)
+        # The rollup counts the activity on the day it happened.
+        rollup = UserDailyRollups.objects.get()
+        self.assertEqual((rollup.day, rollup.time_spent_seconds), (timezone.localdate(yesterday), 30))
+
+    def test_queue_drops_overflow_when_full(self):
+        queue = WriteBehindQueue(max_size=100, max_delay=3600, capacity=2, policy='drop')
+        row = (UserUiInteractions, {'user_id': self.user.id, 'component': 'Cart', 'action': 'tap'})
+        self.assertEqual(queue.put([row, row, row]), 1)
+        stats = queue.stats()
+        self.assertEqual((stats['queued'], stats['dropped'], stats['pending']), (2, 1, 2))
+        self.assertEqual(queue.flush(), 2)
+        self.assertEqual(queue.stats()['flushed'], 2)
+
+
+class EventWriterFailureTestCase(TransactionTestCase):
+    def test_a_bad_row_does_not_lose_the_batch(self):
+        user = create_user('patient')
+        # Foreign keys are checked at commit, so this needs real transactions.
+        admin = User.objects.create_superuser('admin', password='password123')
+        queue = WriteBehindQueue(max_size=100, max_delay=3600)
+        queue.put([
+            (UserSearchLogs, {'user_id': user.id, 'keyword': 'para', 'searched_at': timezone.now()}),
+            (UserSearchLogs, {'user_id': admin.id, 'keyword': 'para', 'searched_at': timezone.now()}),
+            (UserUiInteractions, {'user_id': user.id, 'component': 'Cart', 'action': 'tap'}),
+        ])
+        with self.assertLogs('api.ingest', 'WARNING'):
+            self.assertEqual(queue.flush(), 2)
+        self.assertEqual(list(UserSearchLogs.objects.values_list('user_id', flat=True)), [user.id])
+        self.assertTrue(UserUiInteractions.objects.exists())
+        stats = queue.stats()
+        self.assertEqual((stats['flushed'], stats['failed']), (2, 1))
+
+
+class RollupsTestCase(TestCase):
+    def setUp(self):
+        self.user = create_user('patient')
+        self.users = Users.objects.get(id=self.user)
+
+    def test_rollups_follow_ledgers_and_rebuild(self):
+        UserPointTransactions.objects.create(user=self.users, source='order', points=30)
+        UserPointTransactions.objects.create(user=self.users, source='review', points=5)
+        UserActivityLogs.objects.create(user=self.users, time_spent_seconds=120, points_earned=1)
+        write_rows(UserActivityLogs, [
+            {'user_id': self.user.id, 'recorded_at': timezone.now(), 'time_spent_seconds': 60},
+        ])
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.assertNumQueries(2):
+            summary = client.get('/api/users/points').json()
+        self.assertEqual((summary['points'], summary['time_spent_seconds']), (35, 180))
+        today = summary['last_7_days'][0]
+        self.assertEqual((today['points_received'], today['activity_count'], today['points_earned']), (35, 2, 1))
+
+        UserPointBalances.objects.all().delete()
+        UserDailyRollups.objects.update(points_received=0)
+        with CaptureQueriesContext(connection) as captured:
+            call_command('rebuild_rollups', stdout=io.StringIO())
+        statements = [query['sql'] for query in captured]
+        self.assertEqual(client.get('/api/users/points').json(), summary)
+
+        # Flushes can't slip in between reading the ledgers and writing the
+        # rollups: the chunk locks them out, or on SQLite writes first.
+        first_delete = next(i for i, sql in enumerate(statements) if sql.startswith('DELETE'))
+        first_read = next(i for i, sql in enumerate(statements) if 'user_activity_logs' in sql)
+        self.assertLess(first_delete, first_read)
+        if connection.vendor == 'postgresql':
+            lock = next(i for i, sql in enumerate(statements) if 'pg_advisory_xact_lock(' in sql)
+            self.assertLess(lock, first_delete)
+
+
+class LeaderboardTestCase(TestCase):
+    def setUp(self):
+        leaderboard.invalidate()
+        self.addCleanup(leaderboard.invalidate)
+
+    def test_skip_list_ranks_match_sorted_list(self):
+        keys = sorted(((i * 7919) % 100, i) for i in range(300))
+        entries = RankedSkipList(keys)
+        for key in ((5, 300), (50, 301), (99, 302), (-1, 303)):
+            entries.insert(key)
+            keys.append(key)
+        for key in ((0, 0), (50, 301), (99, 302)):
+            entries.remove(key)
+            keys.remove(key)
+        keys.sort()
+        self.assertEqual(entries.first(len(keys) + 1), keys)
+        for key in ((-5, 0), (0, 1), (5, 300), (33, 0), (100, 0)):
+            self.assertEqual(entries.count_less(key), sum(1 for existing in keys if existing < key))
+
+    def test_ranks_follow_point_transactions(self):
+        alice, bob, carol = (create_user(name) for name in ('alice', 'bob', 'carol'))
+        UserPointTransactions.objects.create(user_id=alice.id, source='order', points=10)
+        UserPointTransactions.objects.create(user_id=bob.id, source='order', points=10)
+        client = APIClient()
+        client.force_authenticate(carol)
+        self.assertEqual(client.get('/api/users/leaderboard/me').json(), {'rank': None, 'points': 0, 'total': 2})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UserPointTransactions.objects.create(user_id=carol.id, source='review', points=25)
+        with self.captureOnCommitCallbacks(execute=True):
+            UserPointTransactions.objects.create(user_id=bob.id, source='review', points=1)
+        with self.assertNumQueries(1):
+            top = client.get('/api/users/leaderboard?limit=2').json()
+        self.assertEqual(top, [
+            {'rank': 1, 'user_id': carol.id, 'username': 'carol', 'points': 25},
+            {'rank': 2, 'user_id': bob.id, 'username': 'bob', 'points': 11},
+        ])
+        client.force_authenticate(alice)
+        self.assertEqual(client.get('/api/users/leaderboard/me').json(), {'rank': 3, 'points': 10, 'total': 3})
+
+
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        request_metrics.reset()
+        self.addCleanup(request_metrics.reset)
+
+    def test_server_timing_and_admin_stats(self):
+        Branches.objects.create(name='Central', address='1 Main St')
+        response = self.client.get('/api/branches')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+        admin = User.objects.create_user(username='admin', password='password123', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+        stats = client.get('/api/requests/stats').json()
+        branches = stats['get_branches']
+        self.assertEqual(branches['requests'], 1)
+        self.assertEqual(branches['queries']['p50'], 1)
+        self.assertEqual(sum(branches['latency_histogram'].values()), 1)
+        self.assertEqual(branches['n_plus_one']['requests'], 0)
+        self.assertEqual(APIClient().get('/api/requests/stats').status_code, 401)
+
+    def test_serializer_time_reported_apart_from_rendering(self):
+        Branches.objects.create(name='Central', address='1 Main St')
+        to_representation = BranchesSerializer.to_representation
+
+        def slow(serializer, instance):
+            time.sleep(0.05)
+            return to_representation(serializer, instance)
+
+        with mock.patch.object(BranchesSerializer, 'to_representation', slow):
+            response = self.client.get('/api/branches')
+        timings = {name: float(ms) for name, ms in re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing'])}
+        self.assertGreaterEqual(timings['serialize'], 50)
+        self.assertGreaterEqual(timings['view'], timings['serialize'])
+        self.assertLess(timings['render'], 50)
+        self.assertIn('serialize_ms', request_metrics.summary()['get_branches'])
+
+    def test_flags_repeated_sql_shapes(self):
+        products = [Products.objects.create(name=f'Product {i}') for i in range(6)]
+
+        def n_plus_one_view(request):
+            for product in products:
+                list(Inventory.objects.filter(product=product))
+            list(Inventory.objects.filter(product__in=products[:2]))
+            list(Inventory.objects.filter(product__in=products))
+            return HttpResponse()
+
+        request = RequestFactory().get('/api/products')
+        request.resolver_match = resolve('/api/products')
+        with self.assertLogs('api.instrumentation', 'WARNING'):
+            response = QueryMetricsMiddleware(n_plus_one_view)(request)
+        self.assertIn('desc="8 queries"', response['Server-Timing'])
+        flagged = request_metrics.summary()['get_products']['n_plus_one']
+        self.assertEqual((flagged['requests'], flagged['last']['count']), (1, 6))
+        self.assertEqual(sql_shape('WHERE id IN (%s, %s, %s)'), sql_shape('WHERE id IN (%s, %s)'))
+
+
+class ProfileTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('patient')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def test_login_loads_user_and_profile_together(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = APIClient().post('/api/users/login', {'username': 'patient', 'password': 'password123'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['role'], 'patient')
+        selects = [query['sql'] for query in captured if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 1)
+        self.assertIn('INNER JOIN "users"', selects[0].replace('LEFT OUTER', 'INNER'))
+
+    def test_profile_reads_are_cached_and_never_write(self):
+        Users.objects.filter(id=self.user).delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/users/profile').json()['role'], 'patient')
+        with self.assertNumQueries(0):
+            self.client.get('/api/users/profile')
+        self.assertFalse(Users.objects.filter(id=self.user).exists())
+
+    def test_update_refreshes_cached_profile(self):
+        self.client.get('/api/users/profile')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                '/api/users/update', {'first_name': 'Lan', 'users': {'city': 'Hue'}}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            profile = self.client.get('/api/users/profile').json()
+        self.assertEqual((profile['city'], profile['first_name']), ('Hue', 'Lan'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Users.objects.filter(id=self.user).update(city='Hanoi')
+            Users.objects.get(id=self.user).save()
+        self.assertEqual(self.client.get('/api/users/profile').json()['city'], 'Hanoi')
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Every API view declares a query_budget. Each view is run after seeding
+    a small and a large fixture: it must stay within budget both times and
+    run the same number of queries.
+    """
+    small, large = 2, 25
+
+    def setUp(self):
+        self.user = create_user('patient', role='pharmacist')
+        self.user.is_staff = True
+        self.user.save()
+        self.branch = Branches.objects.create(name='Central', address='1 Main St', latitude=21.03, longitude=105.85)
+        StatusDimension.objects.create(entity_type='order', status_name='Processing')
+        StatusDimension.objects.create(entity_type='prescription', status_name='Pending')
+        StatusDimension.objects.create(entity_type='prescription', status_name='Approved')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.products = []
+        self.prescriptions = []
+
+    def populate(self, count):
+        status_id = status_registry.get_id('order', 'Processing')
+        for i in range(count):
+            branch = Branches.objects.create(name=f'Branch {i}', address='x', latitude=21 + i / 100, longitude=105.8)
+            product = Products.objects.create(name=f'Vitamin {len(self.products)}', unit_price=5)
+            self.products.append(product)
+            Inventory.objects.create(product=product, branch=self.branch, available_qty=100)
+            Inventory.objects.create(product=product, branch=branch, available_qty=100)
+            order = Orders.objects.create(user_id=self.user.id, branch=self.branch, status_id=status_id)
+            OrderItems.objects.create(order=order, product=product, quantity=1, price=5)
+            UserPointTransactions.objects.create(user_id=self.user.id, source='order', points=i)
+            UserActivityLogs.objects.create(user_id=self.user.id, time_spent_seconds=10)
+            prescription = Prescriptions.objects.create(
+                classification=1, status_id=status_registry.get_id('prescription', 'Pending'),
+                patient_id=self.user.id, doctor_id=self.user.id,
+            )
+            PrescriptionItems.objects.create(
+                prescription=prescription, product=product, dosage_amount=1, unit='box', unit_price=5
+            )
+            self.prescriptions.append(prescription)
+
+    def cases(self):
+        product_ids = ','.join(str(product.pk) for product in self.products)
+        return {
+            'get_branches': ('get', '/api/branches', None),
+            'get_nearby_branches': ('get', f'/api/branches/nearby?lat=21&lng=105.8&limit=100&product={self.products[0].pk}', None),
+            'get_products': ('get', '/api/products?page_size=100', None),
+            'get_products (cursor, in stock)': ('get', f'/api/products?pagination=cursor&in_stock=true&branch={self.branch.pk}', None),
+            'product_search': ('get', '/api/products/search?q=vitamin&limit=100', None),
+            'product_search (typo)': ('get', '/api/products/search?q=vitamni&limit=100', None),
+            'get_product_availability': ('get', f'/api/products/availability?products={product_ids}', None),
+            'create_order': ('post', '/api/users/order/create', {
+                'order': {'branch': self.branch.pk},
+                'order_items': [{'product': product.pk, 'quantity': 1} for product in self.products],
+            }),
+            'get_orders': ('get', '/api/users/order/details?page_size=100', None),
+            'get_orders (expanded)': ('get', '/api/users/order/details?expand=true&pagination=cursor&page_size=100', None),
+            'ingest_events': ('post', '/api/users/events', {
+                'events': [{'type': 'product_view', 'product': product.pk} for product in self.products],
+            }),
+            'get_user': ('get', '/api/users/profile', None),
+            'get_points_summary': ('get', '/api/users/points', None),
+            'get_leaderboard': ('get', '/api/users/leaderboard?limit=100', None),
+            'get_my_rank': ('get', '/api/users/leaderboard/me', None),
+            'get_event_stats': ('get', '/api/events/stats', None),
+            'get_request_stats': ('get', '/api/requests/stats', None),
+            'get_review_queue': ('get', '/api/prescriptions/queue?page_size=100', None),
+            'claim_review_queue': ('post', '/api/prescriptions/queue/claim', {'limit': 50}),
+            'create_prescription_order': (
+                'post', f'/api/prescriptions/{self.approved_prescription().pk}/order', {'branch': self.branch.pk}
+            ),
+            'decide_prescriptions': ('post', '/api/prescriptions/decisions', {
+                'decisions': [{'prescription': prescription.pk, 'decision': 'approved'}
+                              for prescription in self.prescriptions],
+            }),
+        }
+
+    def approved_prescription(self):
+        prescription = Prescriptions.objects.create(
+            classification=1, status_id=status_registry.get_id('prescription', 'Approved'),
+            patient_id=self.user.id, doctor_id=self.user.id,
+        )
+        PrescriptionItems.objects.bulk_create([
+            PrescriptionItems(prescription=prescription, product=product, dosage_amount=1, unit='box', unit_price=4)
+            for product in self.products
+        ])
+        return prescription
+
+    def run_view(self, method, path, data=None):
+        """Return (queries run, budget), leaving out the savepoints this
+        TestCase's transaction turns the view's own transaction into."""
+        cache.clear()
+        for index in (branch_index, product_index, leaderboard):
+            index.invalidate()
+        # POSTs carry a fresh Idempotency-Key, so idempotent views are
+        # measured storing their response.
+        headers = {'Idempotency-Key': uuid.uuid4().hex} if method == 'post' else {}
+        with CaptureQueriesContext(connection) as captured, mock.patch.object(event_queue, 'put', return_value=0):
+            response = getattr(self.client, method)(path, data, format='json', headers=headers)
+        self.assertLess(response.status_code, 400, response.content)
+        queries = [query for query in captured if not is_transaction_control(query['sql'])]
+        return len(queries), resolve(path.split('?')[0]).func.query_budget
+
+    def test_views_stay_within_budget_as_data_grows(self):
+        self.populate(self.small)
+        small = {name: self.run_view(*case) for name, case in self.cases().items()}
+        self.populate(self.large - self.small)
+        for name, case in self.cases().items():
+            with self.subTest(name):
+                queries, budget = self.run_view(*case)
+                self.assertLessEqual(queries, budget)
+                self.assertEqual(queries, small[name][0], 'query count grows with the input')
+
+    def test_account_views_stay_within_budget(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        cases = [
+            ('put', '/api/users/update', {'first_name': 'Lan', 'users': {'city': 'Hue'}}),
+            ('post', '/api/users/register', {
+                'username': 'new', 'password': 'password123', 'email': 'new@example.com',
+                'first_name': 'New', 'last_name': 'Patient', 'role': 'patient',
+            }),
+            ('post', '/api/users/login', {'username': 'patient', 'password': 'password123'}),
+            ('post', '/api/users/logout', {'refresh': refresh}),
+        ]
+        for case in cases:
+            with self.subTest(case[1]):
+                queries, budget = self.run_view(*case)
+                self.assertLessEqual(queries, budget)
+
+    def test_every_api_view_declares_a_budget(self):
+        for pattern in urls.urlpatterns:
+            if getattr(pattern.callback, 'view_class', None) in (TokenObtainPairView, TokenRefreshView):
+                continue
+            with self.subTest(pattern.name):
+                self.assertTrue(hasattr(pattern.callback, 'query_budget'))
+
+
+class BenchmarkCommandsTestCase(TestCase):
+    def test_seed_and_benchmark_report(self):
+        call_command(
+            'seed_dataset', branches=2, products=30, users=5, orders_per_user=2, events_per_user=2,
+            stdout=io.StringIO(),
+        )
+        self.assertEqual(OrderItems.objects.count(), 5 * 2 * 3)
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('bench_endpoints', requests=2, profile_requests=1, output=output.name, stdout=io.StringIO())
+            report = json.load(output)
+        self.assertEqual(report['dataset']['orders'], 10)
+        for entry in report['endpoints']:
+            self.assertEqual(entry['errors'], 0, entry['name'])
+            self.assertEqual(set(entry['latency_ms']), {'mean', 'p50', 'p95', 'p99'})
+        # The benchmark's orders are rolled back.
+        self.assertEqual(Orders.objects.count(), 10)
+
+
+class AsyncReadViewsTestCase(TransactionTestCase):
+    """The async endpoints run their paired queries on other connections,
+    which only see committed data."""
+
+    def setUp(self):
+        close_worker_connections(self)
+        cache.clear()
+        self.user = create_user('patient')
+        self.token = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=self.token)
+        self.branch = Branches.objects.create(name='Central', address='1 Main St')
+        self.status_id = StatusDimension.objects.create(entity_type='order', status_name='Processing').pk
+        status_registry.get(self.status_id)
+
+    def populate(self, count):
+        for i in range(count):
+            product = Products.objects.create(name=f'Vitamin {i}', unit_price=5)
+            Inventory.objects.create(product=product, branch=self.branch, available_qty=i)
+            order = Orders.objects.create(user_id=self.user.id, branch=self.branch, status_id=self.status_id)
+            OrderItems.objects.create(order=order, product=product, quantity=1, price=5)
+
+    def queries(self, response):
+        return int(re.search(r'desc="(\d+) queries"', response['Server-Timing']).group(1))
+
+    def compare(self, path):
+        """Return the async response's query count once it matches the sync one."""
+        cache.clear()
+        expected = self.client.get(f'/api{path}')
+        cache.clear()
+        response = self.client.get(f'/api/async{path}')
+        self.assertEqual(response.status_code, expected.status_code, path)
+        self.assertEqual(response.json(), json.loads(expected.content.decode().replace('/api/', '/api/async/')), path)
+        self.assertLessEqual(self.queries(response), resolve(f'/api/async{path.split("?")[0]}').func.query_budget, path)
+        return self.queries(response)
+
+    def test_match_sync_views_within_budget(self):
+        paths = [
+            '/branches',
+            '/products?page=2&page_size=3',
+            f'/products?branch={self.branch.pk}&in_stock=true',
+            '/products?page=100',
+            f'/products?branch={10 ** 20}',
+            '/users/order/details?page=2',
+            '/users/order/details?expand=true&page_size=100',
+            '/users/profile',
+        ]
+        self.populate(8)
+        small = {path: self.compare(path) for path in paths}
+        self.populate(30)
+        for path in paths:
+            self.assertEqual(self.compare(path), small[path], f'query count grows with the input: {path}')
+
+    def test_require_a_valid_token(self):
+        for path in ('/users/profile', '/users/order/details'):
+            for client in (APIClient(), APIClient(HTTP_AUTHORIZATION='Bearer invalid')):
+                expected = client.get(f'/api{path}')
+                response = client.get(f'/api/async{path}')
+                self.assertEqual((response.status_code, response.json()), (401, expected.json()))
+                self.assertEqual(response['WWW-Authenticate'], expected['WWW-Authenticate'])
+
+    def test_deactivated_users_see_no_orders(self):
+        self.populate(2)
+        self.assertEqual(self.client.get('/api/async/users/order/details').json()['count'], 2)
+        User.objects.filter(pk=self.user.id).update(is_active=False)
+
+        self.assertEqual(self.client.get('/api/users/order/details').status_code, 401)
+        response = self.client.get('/api/async/users/order/details?expand=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['count'], response.json()['results']), (0, []))
+        self.assertEqual(self.client.get('/api/async/users/profile').status_code, 404)
+
+    def test_worker_threads_keep_their_connection(self):
+        def worker(kept):
+            # SQLite's in-memory test database ignores close(); check expiry.
+            _in_worker(Branches.objects.exists)()
+            kept.append(connection.close_at - time.monotonic() > 30)
+            _in_worker(Branches.objects.exists)()
+            kept.append(connection.close_at - time.monotonic() > 30)
+            connection.close()
+
+        # CONN_MAX_AGE is 0, as under ASGI.
+        for max_age, expected in ((60, True), (0, False)):
+            kept = []
+            with override_settings(DB_WORKER_CONN_MAX_AGE=max_age):
+                thread = threading.Thread(target=worker, args=(kept,))
+                thread.start()
+                thread.join()
+            self.assertEqual(kept, [expected, expected])
+
+    def test_run_natively_under_asgi(self):
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(import_string(path).async_capable, path)
+
+        self.populate(3)
+        client = AsyncClient()
+        # The test client keeps request_finished from closing connections, so
+        # close the one the async ORM opens on asgiref's shared sync thread.
+        self.addCleanup(lambda: asyncio.run(sync_to_async(connections.close_all)()))
+
+        async def fetch():
+            return await asyncio.gather(*(
+                client.get(path, headers={'Authorization': self.token})
+                for path in ('/api/async/branches', '/api/async/products', '/api/async/users/order/details')
+            ))
+
+        branches, products, orders = asyncio.run(fetch())
+        self.assertEqual(len(branches.json()), 1)
+        self.assertEqual(products.json()['count'], 3)
+        self.assertEqual(orders.json()['count'], 3)
+        # Queries from the worker threads are counted.
+        self.assertEqual(self.queries(products), 2)
+        not_modified = asyncio.run(client.get('/api/async/branches', headers={'If-None-Match': branches['ETag']}))
+        self.assertEqual(not_modified.status_code, 304)
+
+
+class ThroughputBenchmarkTestCase(LiveServerTestCase):
+    def setUp(self):
+        close_worker_connections(self)
+
+    def test_reports_each_server_and_endpoint(self):
+        call_command('seed_dataset', branches=1, products=10, users=2, orders_per_user=1, stdout=io.StringIO())
+        status_registry.get_id('order', 'Processing')
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command(
+                'bench_throughput', wsgi=self.live_server_url, asgi=self.live_server_url,
+                concurrency=2, duration=0.2, output=output.name, stdout=io.StringIO(),
+            )
+            report = json.load(output)
+        self.assertEqual(len(report['endpoints']), 4 * 3)
+        for entry in report['endpoints']:
+            self.assertEqual(entry['errors'], 0, entry)
+            self.assertGreater(entry['requests'], 0, entry)
+
+
+class PrescriptionQueueTestCase(TestCase):
+    def setUp(self):
+        self.pharmacists = [create_user('pharmacist1', 'pharmacist'), create_user('pharmacist2', 'pharmacist')]
+        self.patient = create_user('patient')
+        doctor = create_user('doctor', 'doctor')
+        pending = StatusDimension.objects.create(entity_type='prescription', status_name='Pending')
+        approved = StatusDimension.objects.create(entity_type='prescription', status_name='Approved')
+        status_registry.get(pending.pk)
+        product = Products.objects.create(name='Amoxicillin', unit_price=8)
+        start = timezone.now() - timezone.timedelta(days=1)
+        self.pending = []
+        for i in range(5):
+            prescription = Prescriptions.objects.create(
+                classification=1, status=approved if i == 2 else pending,
+                patient_id=self.patient.id, doctor_id=doctor.id,
+            )
+            # Submitted newest first, so the queue order differs from the ids'.
+            Prescriptions.objects.filter(pk=prescription.pk).update(submitted_at=start - timezone.timedelta(hours=i))
+            PrescriptionItems.objects.create(
+                prescription=prescription, product=product, dosage_amount=2, unit='box', unit_price=8
+            )
+            if i != 2:
+                self.pending.insert(0, prescription.pk)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        return client
+
+    def test_lists_pending_prescriptions_oldest_first(self):
+        response = self.client_for(self.pharmacists[0]).get('/api/prescriptions/queue')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['prescription_id'] for result in results], self.pending)
+        self.assertEqual(results[0]['status_name'], 'Pending')
+        self.assertEqual(results[0]['patient']['username'], 'patient')
+        self.assertEqual(results[0]['items'][0]['product']['name'], 'Amoxicillin')
+        self.assertEqual(self.client_for(self.patient).get('/api/prescriptions/queue').status_code, 403)
+        self.assertEqual(self.client_for(self.patient).post('/api/prescriptions/queue/claim').status_code, 403)
+
+    def test_cursor_pages_survive_ties_and_claims(self):
+        # Submitted together, so only prescription_id orders the queue.
+        Prescriptions.objects.update(submitted_at=timezone.now())
+        queue = sorted(self.pending)
+        client = self.client_for(self.pharmacists[0])
+        pages = cursor_pages(client, client.get('/api/prescriptions/queue', {'page_size': 1}), 'prescription_id')
+        self.assertEqual(sum(pages, []), queue)
+
+        # Prescriptions claimed by someone else between pages don't shift the rest.
+        first = client.get('/api/prescriptions/queue', {'page_size': 2}).json()
+        Prescriptions.objects.filter(pk=queue[2]).update(
+            claimed_by_id=self.pharmacists[1].id, claimed_at=timezone.now()
+        )
+        rest = cursor_pages(client, client.get(first['next']), 'prescription_id')
+        self.assertEqual([result['prescription_id'] for result in first['results']] + sum(rest, []),
+                         queue[:2] + queue[3:])
+        previous = client.get(client.get(first['next']).json()['previous']).json()
+        self.assertEqual([result['prescription_id'] for result in previous['results']], queue[:2])
+        self.assertEqual(client.get('/api/prescriptions/queue', {'cursor': 'cD1nYXJiYWdl'}).status_code, 404)
+
+    def test_claims_without_a_claim_time_have_lapsed(self):
+        Prescriptions.objects.filter(pk=self.pending[0]).update(claimed_by_id=self.pharmacists[1].id, claimed_at=None)
+        client = self.client_for(self.pharmacists[0])
+        queue = client.get('/api/prescriptions/queue').json()['results']
+        self.assertEqual(queue[0]['prescription_id'], self.pending[0])
+        response = client.post(
+            '/api/prescriptions/decisions', {'decisions': [{'prescription': self.pending[0], 'decision': 'approved'}]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['results'][0]['recorded'])
+
+    def test_patients_cannot_make_themselves_pharmacists(self):
+        client = self.client_for(self.patient)
+        response = client.put('/api/users/update', {'users': {'role': 'pharmacist', 'city': 'Hue'}}, format='json')
+        self.assertEqual((response.status_code, response.json()['role']), (200, 'patient'))
+        self.assertEqual(Users.objects.get(id=self.patient).role, 'patient')
+        self.assertEqual(client.get('/api/prescriptions/queue').status_code, 403)
+        self.assertEqual(client.post('/api/prescriptions/decisions', {'decisions': [
+            {'prescription': self.pending[0], 'decision': 'approved'},
+        ]}, format='json').status_code, 403)
+
+        response = APIClient().post('/api/users/register', {
+            'username': 'new', 'password': 'password123', 'email': 'new@example.com',
+            'first_name': 'New', 'last_name': 'Pharmacist', 'role': 'pharmacist',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(username='new').exists())
+
+    def test_claims_are_exclusive_until_they_lapse(self):
+        first, second = (self.client_for(pharmacist) for pharmacist in self.pharmacists)
+        claimed = first.post('/api/prescriptions/queue/claim', {'limit': 3}, format='json').json()['claimed']
+        self.assertEqual([result['prescription_id'] for result in claimed], self.pending[:3])
+        self.assertEqual(claimed[0]['claimed_by'], self.pharmacists[0].id)
+
+        claimed = second.post('/api/prescriptions/queue/claim', {'limit': 3}, format='json').json()['claimed']
+        self.assertEqual([result['prescription_id'] for result in claimed], self.pending[3:])
+        queue = first.get('/api/prescriptions/queue').json()['results']
+        self.assertEqual([result['prescription_id'] for result in queue], self.pending[:3])
+        self.assertEqual(second.post('/api/prescriptions/queue/claim', format='json').json()['claimed'], [])
+        self.assertEqual(second.post('/api/prescriptions/queue/claim', [3], format='json').status_code, 400)
+
+        Prescriptions.objects.filter(pk=self.pending[0]).update(
+            claimed_at=timezone.now() - timezone.timedelta(seconds=settings.PRESCRIPTION_CLAIM_TIMEOUT + 1)
+        )
+        claimed = second.post('/api/prescriptions/queue/claim', format='json').json()['claimed']
+        self.assertEqual([result['prescription_id'] for result in claimed], self.pending[:1])
+
+    def test_records_a_batch_of_decisions(self):
+        StatusDimension.objects.create(entity_type='prescription', status_name='Rejected')
+        status_registry.get_id('prescription', 'Rejected')
+        first, second = (self.client_for(pharmacist) for pharmacist in self.pharmacists)
+        second.post('/api/prescriptions/queue/claim', {'limit': 1}, format='json')
+        approved = Prescriptions.objects.exclude(pk__in=self.pending).get().pk
+        decisions = [
+            {'prescription': self.pending[1], 'decision': 'approved', 'comment': 'ok'},
+            {'prescription': self.pending[2], 'decision': 'Rejected'},
+            {'prescription': self.pending[2], 'decision': 'approved'},
+            {'prescription': self.pending[0], 'decision': 'approved'},
+            {'prescription': approved, 'decision': 'rejected'},
+            {'prescription': self.pending[3], 'decision': 'maybe'},
+            {'prescription': 999999, 'decision': 'approved'},
+            {'prescription': self.pending[3]},
+        ]
+        with CaptureQueriesContext(connection) as captured:
+            response = first.post('/api/prescriptions/decisions', {'decisions': decisions}, format='json')
+        self.assertEqual(response.status_code, 200)
+        # The user, the locked prescriptions, the approvals and the statuses.
+        self.assertEqual(len([query for query in captured if not is_transaction_control(query['sql'])]), 4)
+        data = response.json()
+        self.assertEqual((data['recorded'], data['failed']), (2, 6))
+        results = data['results']
+        self.assertEqual([result['recorded'] for result in results], [True, True] + [False] * 6)
+        self.assertEqual((results[0]['status_name'], results[1]['status_name']), ('Approved', 'Rejected'))
+        self.assertIn('already decided', results[2]['error'])
+        self.assertIn('claimed by another', results[3]['error'])
+        self.assertIn('not pending', results[4]['error'])
+        self.assertIn('decision must be one of', results[5]['error'])
+        self.assertEqual(results[6]['error'], 'Prescription not found')
+        self.assertIn('decision', results[7]['error'])
+
+        statuses = dict(Prescriptions.objects.values_list('pk', 'status__status_name'))
+        self.assertEqual((statuses[self.pending[1]], statuses[self.pending[2]]), ('Approved', 'Rejected'))
+        approval = PrescriptionApprovals.objects.get(pk=results[0]['approval_id'])
+        self.assertEqual((approval.prescription_id, approval.approved_by_id, approval.comment),
+                         (self.pending[1], self.pharmacists[0].id, 'ok'))
+        self.assertEqual(PrescriptionApprovals.objects.count(), 2)
+        self.assertEqual(
+            first.post('/api/prescriptions/decisions', {'decisions': []}, format='json').status_code, 400
+        )
+        self.assertEqual(
+            first.post('/api/prescriptions/decisions', decisions, format='json').status_code, 400
+        )
+
+
+class PrescriptionOrderTestCase(TestCase):
+    def setUp(self):
+        self.patient = create_user('patient')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.patient).access_token}')
+        self.branch = Branches.objects.create(name='Central', address='1 Main St')
+        StatusDimension.objects.create(entity_type='order', status_name='Processing')
+        self.pending = StatusDimension.objects.create(entity_type='prescription', status_name='Pending')
+        approved = StatusDimension.objects.create(entity_type='prescription', status_name='Approved')
+        status_registry.get(approved.pk)
+        self.products = [Products.objects.create(name=name, unit_price=10) for name in ('Amoxicillin', 'Ibuprofen')]
+        for product in self.products:
+            Inventory.objects.create(product=product, branch=self.branch, available_qty=10)
+        self.prescription = self.create_prescription(approved)
+
+    def create_prescription(self, status, patient=None):
+        prescription = Prescriptions.objects.create(
+            classification=1, status=status, patient_id=(patient or self.patient).id, doctor_id=self.patient.id
+        )
+        PrescriptionItems.objects.bulk_create([
+            PrescriptionItems(prescription=prescription, product=self.products[0], dosage_amount=2, unit='box', unit_price=7),
+            PrescriptionItems(prescription=prescription, product=self.products[1], dosage_amount='1.5', unit='box', unit_price=3),
+            PrescriptionItems(prescription=prescription, product=self.products[0], dosage_amount=1, unit='box', unit_price=7),
+        ])
+        return prescription
+
+    def order(self, prescription, key=None, branch=None):
+        headers = {'Idempotency-Key': key} if key else {}
+        return self.client.post(
+            f'/api/prescriptions/{prescription.pk}/order', {'branch': branch or self.branch.pk},
+            format='json', headers=headers,
+        )
+
+    def stock(self):
+        return dict(Inventory.objects.values_list('product_id', 'available_qty'))
+
+    def test_orders_items_at_prescription_prices(self):
+        response = self.order(self.prescription, key='retry-1')
+        self.assertEqual(response.status_code, 201, response.content)
+        order = Orders.objects.get()
+        self.assertEqual((order.prescription_id, order.user_id), (self.prescription.pk, self.patient.id))
+        items = list(order.orderitems_set.order_by('pk').values_list('product_id', 'quantity', 'price'))
+        self.assertEqual(items, [
+            (self.products[0].pk, 2, 7), (self.products[1].pk, 2, 3), (self.products[0].pk, 1, 7),
+        ])
+        self.assertEqual(self.stock(), {self.products[0].pk: 7, self.products[1].pk: 8})
+        self.assertNotIn('idempotency_key', response.json()['order'])
+
+    def test_retries_with_the_same_key_replay_the_order(self):
+        first = self.order(self.prescription, key='retry-1')
+        retry = self.order(self.prescription, key='retry-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        # Once the stored response has expired the order's own key still matches.
+        IdempotencyKeys.objects.all().delete()
+        late_retry = self.order(self.prescription, key='retry-1')
+        self.assertEqual(late_retry.status_code, 200)
+        self.assertEqual(late_retry.json(), first.json())
+        self.assertEqual(Orders.objects.count(), 1)
+        self.assertEqual(self.stock(), {self.products[0].pk: 7, self.products[1].pk: 8})
+
+        conflict = self.order(self.prescription, key='retry-2')
+        self.assertEqual((conflict.status_code, conflict.json()['order']), (409, first.json()['order']['order_id']))
+        other = self.create_prescription(self.prescription.status)
+        self.assertEqual(self.order(other, key='retry-1').status_code, 422)
+        IdempotencyKeys.objects.all().delete()
+        self.assertEqual(self.order(other, key='retry-1').status_code, 400)
+
+    def test_conflicts_are_not_replayed(self):
+        self.order(self.prescription, key='retry-1')
+        self.assertEqual(self.order(self.prescription, key='retry-2').status_code, 409)
+        # Once the first order is cancelled, retrying the same key orders again.
+        Orders.objects.all().delete()
+        response = self.order(self.prescription, key='retry-2')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+        self.assertEqual(Orders.objects.get().idempotency_key, 'retry-2')
+
+    def test_rejects_prescriptions_that_cannot_be_ordered(self):
+        self.assertEqual(self.order(self.create_prescription(self.pending)).status_code, 400)
+        someone_else = self.create_prescription(self.prescription.status, patient=create_user('other'))
+        self.assertEqual(self.order(someone_else).status_code, 404)
+        self.assertEqual(self.order(self.prescription, branch='x').status_code, 400)
+        response = self.client.post(f'/api/prescriptions/{self.prescription.pk}/order', [self.branch.pk], format='json')
+        self.assertEqual(response.status_code, 400)
+
+        Inventory.objects.filter(product=self.products[1]).update(available_qty=1)
+        response = self.order(self.prescription)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['shortages'][0]['product'], self.products[1].pk)
+        self.assertFalse(Orders.objects.exists())
+        self.assertEqual(self.stock(), {self.products[0].pk: 10, self.products[1].pk: 1})
+
+    def test_only_items_prescribed_in_packs_are_ordered(self):
+        item = self.prescription.prescriptionitems_set.get(product=self.products[1])
+        item.unit = 'mg'
+        item.save()
+        response = self.order(self.prescription)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("'mg'", response.json()['error'])
+        self.assertFalse(Orders.objects.exists())
+        self.assertEqual(self.stock(), {self.products[0].pk: 10, self.products[1].pk: 10})
+
+        item.unit = ' Bottles '
+        item.save()
+        self.assertEqual(self.order(self.prescription).status_code, 201)
+        self.assertEqual(self.stock(), {self.products[0].pk: 7, self.products[1].pk: 8})
+
+
+class IdempotencyTestCase(TestCase):
+    def setUp(self):
+        self.user = create_user('patient')
+        self.branch = Branches.objects.create(name='Central', address='1 Main St')
+        status_registry.get(StatusDimension.objects.create(entity_type='order', status_name='Processing').pk)
+        self.product = Products.objects.create(name='Paracetamol', unit_price=10)
+        Inventory.objects.create(product=self.product, branch=self.branch, available_qty=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, quantity=2):
+        return {'order': {'branch': self.branch.pk}, 'order_items': [{'product': self.product.pk, 'quantity': quantity}]}
+
+    def order(self, key=None, quantity=2):
+        headers = {'Idempotency-Key': key} if key else {}
+        return self.client.post('/api/users/order/create', self.payload(quantity), format='json', headers=headers)
+
+    def reserved(self):
+        return Inventory.objects.get(product=self.product).reserved_qty
+
+    def store(self, key, **fields):
+        fingerprint = request_fingerprint('POST', '/api/users/order/create', self.payload())
+        fields.setdefault('expires_at', timezone.now() + timezone.timedelta(hours=1))
+        return IdempotencyKeys.objects.create(user_id=self.user.id, key=key, request_hash=fingerprint, **fields)
+
+    def test_retries_replay_the_first_response(self):
+        first = self.order('checkout-1')
+        retry = self.order('checkout-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+        self.assertEqual((retry.status_code, retry.headers['Idempotent-Replayed']), (201, 'true'))
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual((Orders.objects.count(), self.reserved()), (1, 2))
+
+        self.assertEqual(self.order().status_code, 201)
+        self.assertEqual(self.order().status_code, 201)
+        self.assertEqual((Orders.objects.count(), self.reserved()), (3, 6))
+
+    def test_keys_are_per_user_and_request(self):
+        self.order('checkout-1')
+        self.assertEqual(self.order('checkout-1', quantity=3).status_code, 422)
+        self.client.force_authenticate(create_user('other'))
+        self.assertEqual(self.order('checkout-1').status_code, 201)
+        self.assertEqual(self.order('x' * 256).status_code, 400)
+        self.assertEqual(Orders.objects.count(), 2)
+
+    def test_client_errors_are_not_replayed(self):
+        self.assertEqual(self.order('checkout-1', quantity=11).status_code, 400)
+        self.assertFalse(IdempotencyKeys.objects.exists())
+        Inventory.objects.update(available_qty=20)
+        self.assertEqual(self.order('checkout-1', quantity=11).status_code, 201)
+        self.assertEqual(self.order('checkout-1', quantity=11).headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(Orders.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0.1)
+    def test_retry_of_a_request_in_flight_conflicts(self):
+        self.store('checkout-1')
+        response = self.order('checkout-1')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertFalse(Orders.objects.exists())
+
+    def test_retry_waits_for_the_request_in_flight(self):
+        record = self.store('checkout-1')
+
+        def first_request_finishes(delay):
+            IdempotencyKeys.objects.filter(pk=record.pk).update(status_code=201, response_body={'order': 'first'})
+
+        with mock.patch('api.idempotency.time.sleep', side_effect=first_request_finishes) as sleep:
+            response = self.order('checkout-1')
+        sleep.assert_called_once()
+        self.assertEqual((response.status_code, response.json()), (201, {'order': 'first'}))
+        self.assertFalse(Orders.objects.exists())
+
+    def test_expired_and_abandoned_keys_are_reclaimed(self):
+        self.store('expired', status_code=201, response_body={}, expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        abandoned = self.store('abandoned')
+        IdempotencyKeys.objects.filter(pk=abandoned.pk).update(
+            created_at=timezone.now() - timezone.timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT + 1)
+        )
+        # Clearing a dead key costs a failed insert, a lookup and a delete.
+        with self.assertLogs('api.instrumentation', 'WARNING'):
+            self.assertEqual(self.order('expired').status_code, 201)
+            self.assertEqual(self.order('abandoned').status_code, 201)
+        self.assertEqual(Orders.objects.count(), 2)
+        self.assertEqual(IdempotencyKeys.objects.filter(status_code=201).count(), 2)
+
+    def test_server_errors_are_not_stored(self):
+        with mock.patch('api.views.reserve_inventory', side_effect=RuntimeError('database unavailable')):
+            self.assertEqual(self.order('checkout-1').status_code, 500)
+        self.assertFalse(IdempotencyKeys.objects.exists())
+        self.assertEqual(self.order('checkout-1').status_code, 201)
+        self.assertEqual(self.reserved(), 2)
+
+    def test_purge_deletes_expired_keys(self):
+        self.store('live')
+        for i in range(3):
+            self.store(f'old-{i}', expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        call_command('purge_idempotency_keys', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(list(IdempotencyKeys.objects.values_list('key', flat=True)), ['live'])
+
+
+class ConcurrentClaimTestCase(TransactionTestCase):
+    threads = 6
+
+    def test_no_prescription_is_claimed_twice(self):
+        pharmacists = [create_user(f'pharmacist{i}', 'pharmacist') for i in range(self.threads)]
+        patient = create_user('patient')
+        status = StatusDimension.objects.create(entity_type='prescription', status_name='Pending')
+        for _ in range(self.threads * 2):
+            Prescriptions.objects.create(classification=1, status=status, patient_id=patient.id, doctor_id=patient.id)
+
+        barrier = threading.Barrier(self.threads)
+        claims = []
+        errors = []
+
+        def claim(pharmacist):
+            client = APIClient()
+            client.force_authenticate(pharmacist)
+            barrier.wait()
+            try:
+                response = client.post('/api/prescriptions/queue/claim', {'limit': 2}, format='json')
+                claims.extend((result['prescription_id'], pharmacist.id) for result in response.json()['claimed'])
+            except OperationalError as error:
+                # SQLite's shared-cache test database fails writers on
+                # contention instead of waiting; those claims get nothing.
+                # Any other backend must wait or skip, never fail.
+                if connection.vendor != 'sqlite':
+                    errors.append(error)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=claim, args=(pharmacist,)) for pharmacist in pharmacists]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        claimed_ids = [prescription_id for prescription_id, _ in claims]
+        self.assertEqual(len(claimed_ids), len(set(claimed_ids)))
+        owners = dict(Prescriptions.objects.filter(pk__in=claimed_ids).values_list('pk', 'claimed_by_id'))
+        self.assertEqual(owners, dict(claims))
+        if connection.features.has_select_for_update_skip_locked:
+            # Locked rows are skipped rather than waited for, so nobody comes away empty.
+            self.assertEqual(len(claimed_ids), self.threads * 2)
+
+
+class ConcurrentCheckoutTestCase(TransactionTestCase):
+    threads = 12
+    stock = 10
+    quantity = 2
+
+    def test_no_oversell_on_single_sku(self):
+        users = [create_user(f'patient{i}') for i in range(self.threads)]
+        branch = Branches.objects.create(name='Central', address='1 Main St')
+        StatusDimension.objects.create(entity_type='order', status_name='Processing')
+        product = Products.objects.create(name='Paracetamol', unit_price=3)
+        Inventory.objects.create(product=product, branch=branch, available_qty=self.stock)
+
+        barrier = threading.Barrier(self.threads)
+        results = []
+
+        def checkout(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                response = client.post('/api/users/order/create', {
+                    'order': {'branch': branch.pk},
+                    'order_items': [{'product': product.pk, 'quantity': self.quantity}],
+                }, format='json')
+                results.append(response.status_code)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=checkout, args=(user,)) for user in users]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        sold = results.count(201) * self.quantity
+        stock = Inventory.objects.get(product=product, branch=branch)
+        self.assertLessEqual(sold, self.stock)
+        self.assertEqual(stock.available_qty, self.stock - sold)
+        self.assertEqual(stock.reserved_qty, sold)
+        self.assertEqual(Orders.objects.count(), results.count(201))
+        if connection.features.has_select_for_update:
+            # With row locks every checkout that fits in stock succeeds.
+            self.assertEqual(sold, self.stock)
+
+
+class StatusRegistryTestCase(TestCase):
+    def test_resolves_without_queries_and_invalidates(self):
+        processing = StatusDimension.objects.create(entity_type='order', status_name='Processing')
+        status_registry.get_id('order', 'Processing')
+        with self.assertNumQueries(0):
+            self.assertEqual(status_registry.get_id('order', 'Processing'), processing.pk)
+            self.assertEqual(status_registry.get_name(processing.pk), 'Processing')
+
+        processing.status_name = 'Packing'
+        processing.save()
+        self.assertEqual(status_registry.get_name(processing.pk), 'Packing')
+        with self.assertRaises(StatusDimension.DoesNotExist):
+            status_registry.get_id('order', 'Processing')
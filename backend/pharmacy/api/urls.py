@@ -1,5 +1,6 @@
 from django.urls import path
 from .views import  *
+from .async_views import async_get_branches, async_get_products, async_get_orders, async_get_user
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 urlpatterns = [
 
@@ -12,8 +13,25 @@ urlpatterns = [
     path('users/update', update_user, name='update_user'),
     path('users/order/create', create_order, name='create_order'),
     path('users/order/details', get_orders, name='get_orders'),
+    path('users/events', ingest_events, name='ingest_events'),
+    path('users/points', get_points_summary, name='get_points_summary'),
+    path('users/leaderboard', get_leaderboard, name='get_leaderboard'),
+    path('users/leaderboard/me', get_my_rank, name='get_my_rank'),
+    path('events/stats', get_event_stats, name='get_event_stats'),
+    path('requests/stats', get_request_stats, name='get_request_stats'),
     path('branches', get_branches, name='get_branches'),
+    path('branches/nearby', get_nearby_branches, name='get_nearby_branches'),
     path('products', get_products, name='get_products'),
+    path('products/search', product_search, name='product_search'),
+    path('products/availability', get_product_availability, name='get_product_availability'),
+    path('prescriptions/queue', get_review_queue, name='get_review_queue'),
+    path('prescriptions/queue/claim', claim_review_queue, name='claim_review_queue'),
+    path('prescriptions/decisions', decide_prescriptions, name='decide_prescriptions'),
+    path('prescriptions/<int:prescription_id>/order', create_prescription_order, name='create_prescription_order'),
+    path('async/branches', async_get_branches, name='async_get_branches'),
+    path('async/products', async_get_products, name='async_get_products'),
+    path('async/users/order/details', async_get_orders, name='async_get_orders'),
+    path('async/users/profile', async_get_user, name='async_get_user'),
     
 
 ]
\ No newline at end of file
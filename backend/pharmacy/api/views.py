@@ -1,18 +1,40 @@
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 from rest_framework import status
 from django.db import transaction
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
 from .serializer import *
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from django.conf import settings
+from django.core.cache import cache
 from .models import Users, Branches
-from django.db.models import Sum
+from .inventory import reserve_inventory, InsufficientStockError
+from .status import status_registry
+from .cache import cache_response, profile_key, BRANCHES, CATALOG
+from .authentication import users_with_profile
+from .geo import branch_index
+from .search import search_products, log_search
+from .ingest import validate_events, event_queue, MAX_EVENTS_PER_REQUEST, MAX_INTEGER
+from .leaderboard import leaderboard
+from .permissions import IsPharmacist
+from .prescriptions import (
+    claim_prescriptions, order_prescription, record_decisions, review_queryset, review_queue,
+    AlreadyOrderedError, StaleReviewError, MAX_DECISIONS,
+)
+from .instrumentation import query_budget, request_metrics
+from .idempotency import idempotent, HEADER as IDEMPOTENCY_HEADER
+from django.db.models import Exists, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404
 from django.db import transaction, IntegrityError
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 
+@query_budget(6)
 @api_view(['POST'])
 def register_user(request):
     serializer = UserRegistrationSerializer(data=request.data)
@@ -21,34 +43,22 @@ def register_user(request):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@query_budget(3)
 @api_view(['POST'])
 def login_user(request):
     serializer = UserLoginSerializer(data=request.data)
     if serializer.is_valid():
+        # ProfileModelBackend loaded the profile along with the user.
         user = serializer.validated_data['user']
         refresh = RefreshToken.for_user(user)
-        users = Users.objects.get(id=user)
         return Response({
             'refresh': str(refresh),
             'access': str(refresh.access_token),
-            'user': {
-                'id': user.id,
-                'username': user.username,
-                'email': user.email,
-                'first_name': user.first_name,
-                'last_name': user.last_name,
-                'phone_number': users.phone_number,
-                'current_address': users.current_address,
-                'province': users.province,
-                'city': users.city,
-                'avatar_url': users.avatar_url,
-                'preferred_theme': users.preferred_theme,
-                'role': users.role,
-                'birth_date': users.birth_date
-            }
+            'user': UsersSerializer(user).data,
         }, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@query_budget(6)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def logout_user(request):
@@ -57,15 +67,25 @@ def logout_user(request):
         return Response({'message': 'Successfully logged out'}, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@query_budget(1)
 @api_view(['GET'])
+@authentication_classes([JWTStatelessUserAuthentication])
 @permission_classes([IsAuthenticated])
 def get_user(request):
-    user = request.user
-    Users.objects.get_or_create(id=user, defaults={'role': 'patient'})
-    serializer = UsersSerializer(user)
-    return Response(serializer.data)
+    # The token alone identifies the user, so a cached profile costs no
+    # queries. Saving a User or Users row drops it (see api.signals).
+    key = profile_key(request.user.id)
+    data = cache.get(key)
+    if data is None:
+        user = users_with_profile().filter(pk=request.user.id, is_active=True).first()
+        if user is None:
+            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+        data = UsersSerializer(user).data
+        cache.set(key, data, settings.PROFILE_CACHE_TIMEOUT)
+    return Response(data)
 
 
+@query_budget(3)
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
 def update_user(request):
@@ -81,8 +101,13 @@ def update_user(request):
             
             # Save the updated data
             serializer.save()
+            data = serializer.data
+            # Replace the cached profile once the update is visible.
+            transaction.on_commit(
+                lambda: cache.set(profile_key(user.id), data, settings.PROFILE_CACHE_TIMEOUT)
+            )
             
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(data, status=status.HTTP_200_OK)
             
     except IntegrityError as e:
         return Response({'error': 'Database error, e.g., duplicate email'}, status=status.HTTP_400_BAD_REQUEST)
@@ -90,40 +115,275 @@ def update_user(request):
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 
+@query_budget(2)
 @api_view(['GET'])
+@cache_response(BRANCHES)
 def get_branches(request):
     branches = Branches.objects.all()
     serializer = BranchesSerializer(branches, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
+@query_budget(3)
+@api_view(['GET'])
+def get_nearby_branches(request):
+    try:
+        latitude = float(request.query_params['lat'])
+        longitude = float(request.query_params['lng'])
+        radius = request.query_params.get('radius')
+        radius = float(radius) if radius is not None else None
+        limit = int(request.query_params.get('limit', 10))
+        product_id = request.query_params.get('product')
+        product_id = _parse_id(product_id) if product_id is not None else None
+    except (KeyError, ValueError):
+        return Response(
+            {'error': 'lat and lng are required; radius, limit and product must be numbers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return Response({'error': 'Invalid coordinates'}, status=status.HTTP_400_BAD_REQUEST)
+    if radius is not None and radius < 0:
+        return Response({'error': 'Invalid radius'}, status=status.HTTP_400_BAD_REQUEST)
+    limit = max(1, min(limit, 100))
+
+    nearest = branch_index.nearest(latitude, longitude, limit=limit, radius_km=radius)
+    stock = {}
+    if product_id is not None and nearest:
+        stock = dict(
+            Inventory.objects.filter(
+                product_id=product_id,
+                branch_id__in=[branch.branch_id for branch, _ in nearest],
+            ).values('branch_id').annotate(
+                total_qty=Sum('available_qty')
+            ).values_list('branch_id', 'total_qty')
+        )
+
+    data = []
+    for branch, distance in nearest:
+        branch_data = {**BranchesSerializer(branch).data, 'distance_km': round(distance, 3)}
+        if product_id is not None:
+            branch_data['available_qty'] = stock.get(branch.branch_id, 0)
+        data.append(branch_data)
+    return Response(data, status=status.HTTP_200_OK)
+
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+class StandardCursorPagination(CursorPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = 'product_id'
+
+class KeysetCursorPagination(StandardCursorPagination):
+    """
+    Cursor pagination on a ``(timestamp, id)`` ordering such as
+    ``('-created_at', '-order_id')``; both fields sort the same way.
+
+    DRF's cursor holds the first ordering field only and falls back to an
+    offset when a page ties on it, so rows added or removed between pages
+    would be skipped or repeated. The position here holds both columns,
+    which are unique together, and pages are filtered on the pair.
+    """
+    def _get_position_from_instance(self, instance, ordering):
+        moment, pk = (getattr(instance, field.lstrip('-')) for field in ordering)
+        return f'{moment.isoformat()} {pk}'
+
+    def _parse_position(self, position):
+        moment, _, pk = position.rpartition(' ')
+        try:
+            moment = parse_datetime(moment)
+            pk = int(pk)
+        except ValueError:
+            moment = None
+        if moment is None:
+            raise NotFound(self.invalid_cursor_message)
+        return moment, pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # As CursorPagination.paginate_queryset, filtering on both columns.
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor or (0, False, None)
+
+        moment_field, pk_field = (field.lstrip('-') for field in self.ordering)
+        descending = self.ordering[0].startswith('-')
+        if reverse != descending:
+            queryset = queryset.order_by(f'-{moment_field}', f'-{pk_field}')
+        else:
+            queryset = queryset.order_by(moment_field, pk_field)
+        if current_position is not None:
+            moment, pk = self._parse_position(current_position)
+            lookup = 'lt' if reverse != descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{moment_field}__{lookup}': moment})
+                | Q(**{moment_field: moment, f'{pk_field}__{lookup}': pk})
+            )
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+
+        has_current = current_position is not None or offset > 0
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = has_current, following_position is not None
+            self.next_position, self.previous_position = current_position, following_position
+        else:
+            self.has_next, self.has_previous = following_position is not None, has_current
+            self.next_position, self.previous_position = following_position, current_position
+        return self.page
+
+def _use_cursor_pagination(request):
+    # Clients opt in with ?pagination=cursor; follow-up links carry ?cursor=
+    return request.query_params.get('pagination') == 'cursor' or 'cursor' in request.query_params
+
+def _parse_bool(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def _parse_id(value):
+    # Ids beyond the integer column would overflow in the database driver.
+    parsed = int(value)
+    if not -MAX_INTEGER - 1 <= parsed <= MAX_INTEGER:
+        raise ValueError(f'{value} is out of range')
+    return parsed
+
+def catalog_queryset(branch_id=None, in_stock=False):
+    # Stock is summed by a correlated subquery, so a page aggregates only the
+    # products it reads rather than GROUP BY over the whole product x
+    # inventory join; count() leaves the unused annotation out.
+    stock = Inventory.objects.filter(product=OuterRef('pk'))
+    if branch_id is not None:
+        stock = stock.filter(branch_id=branch_id)
+    products = Products.objects.annotate(
+        available_quantity=Coalesce(Subquery(
+            stock.order_by().values('product').annotate(total=Sum('available_qty')).values('total')
+        ), 0)
+    ).order_by('product_id')
+    if in_stock:
+        products = products.filter(Exists(stock.filter(available_qty__gt=0)))
+    return products
+
+@query_budget(3)
 @api_view(['GET'])
+@cache_response(CATALOG)
 def get_products(request):
-    products = Products.objects.all()
-    product_data = []
-    
-    for product in products:
-        total_available = Inventory.objects.filter(
-            product=product
-        ).aggregate(total_qty=Sum('available_qty'))['total_qty'] or 0
-        
-        serializer = ProductsSerializer(product)
-        product_data.append({
-            **serializer.data,
-            'available_quantity': total_available
-        })
-    
-    paginator = StandardResultsSetPagination()
-    paginated_data = paginator.paginate_queryset(product_data, request)
-    return paginator.get_paginated_response(paginated_data)
+    branch_id = request.query_params.get('branch')
+    if branch_id is not None:
+        try:
+            branch_id = _parse_id(branch_id)
+        except ValueError:
+            return Response({'error': 'Invalid branch'}, status=status.HTTP_400_BAD_REQUEST)
+    in_stock = _parse_bool(request.query_params.get('in_stock', False))
 
+    products = catalog_queryset(branch_id=branch_id, in_stock=in_stock)
+    if _use_cursor_pagination(request):
+        paginator = StandardCursorPagination()
+    else:
+        paginator = StandardResultsSetPagination()
+    paginated_products = paginator.paginate_queryset(products, request)
+    serializer = CatalogProductSerializer(paginated_products, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@query_budget(4)
+@api_view(['GET'])
+def product_search(request):
+    query = request.query_params.get('q', '').strip()
+    category = request.query_params.get('category') or None
+    try:
+        limit = max(1, min(int(request.query_params.get('limit', 20)), 100))
+    except ValueError:
+        return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    if not query:
+        return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    matches = search_products(query, category=category, limit=limit)
+    products = Products.objects.in_bulk([product_id for product_id, _ in matches])
+    results = [
+        {**ProductsSerializer(products[product_id]).data, 'score': score}
+        for product_id, score in matches if product_id in products
+    ]
+    # Search logs reference the user's profile and are flushed with everyone
+    # else's events, so users without one (e.g. a createsuperuser admin)
+    # aren't logged. Authentication has already loaded the profile.
+    if request.user.is_authenticated and hasattr(request.user, 'users'):
+        log_search(request.user.id, query, category, f'limit={limit}', len(results))
+    return Response({'count': len(results), 'results': results}, status=status.HTTP_200_OK)
+
+MAX_AVAILABILITY_PRODUCTS = 500
+
+def _parse_id_list(value):
+    return list(dict.fromkeys(_parse_id(part) for part in value.split(',') if part.strip()))
+
+@query_budget(2)
+@api_view(['GET'])
+def get_product_availability(request):
+    """
+    Stock of many products across branches from one grouped query.
+
+    ``?products=1,2,3[&branches=4,5][&encoding=dense|sparse]``. Both formats
+    list product and branch ids once; ``dense`` returns product x branch
+    matrices for ``available_qty`` and ``reserved_qty``, ``sparse`` returns
+    ``[product_index, branch_index, available_qty, reserved_qty]`` rows for
+    stocked pairs only.
+    """
+    try:
+        product_ids = _parse_id_list(request.query_params.get('products', ''))
+        branch_ids = _parse_id_list(request.query_params.get('branches', ''))
+    except ValueError:
+        return Response({'error': 'products and branches must be comma-separated ids'}, status=status.HTTP_400_BAD_REQUEST)
+    if not product_ids:
+        return Response({'error': 'products is required'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(product_ids) > MAX_AVAILABILITY_PRODUCTS:
+        return Response(
+            {'error': f'At most {MAX_AVAILABILITY_PRODUCTS} products per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    encoding = request.query_params.get('encoding', 'dense')
+    if encoding not in ('dense', 'sparse'):
+        return Response({'error': 'encoding must be dense or sparse'}, status=status.HTTP_400_BAD_REQUEST)
+
+    inventory = Inventory.objects.filter(product_id__in=product_ids)
+    if branch_ids:
+        inventory = inventory.filter(branch_id__in=branch_ids)
+    rows = inventory.values('product_id', 'branch_id').annotate(
+        available=Sum('available_qty'),
+        reserved=Sum('reserved_qty'),
+    ).values_list('product_id', 'branch_id', 'available', 'reserved').order_by()
+
+    rows = list(rows)
+    if not branch_ids:
+        branch_ids = sorted({branch_id for _, branch_id, _, _ in rows})
+    product_index = {product_id: i for i, product_id in enumerate(product_ids)}
+    branch_index = {branch_id: i for i, branch_id in enumerate(branch_ids)}
+
+    data = {'products': product_ids, 'branches': branch_ids}
+    if encoding == 'sparse':
+        data['entries'] = [
+            [product_index[product_id], branch_index[branch_id], available, reserved]
+            for product_id, branch_id, available, reserved in rows
+        ]
+    else:
+        available_matrix = [[0] * len(branch_ids) for _ in product_ids]
+        reserved_matrix = [[0] * len(branch_ids) for _ in product_ids]
+        for product_id, branch_id, available, reserved in rows:
+            available_matrix[product_index[product_id]][branch_index[branch_id]] = available
+            reserved_matrix[product_index[product_id]][branch_index[branch_id]] = reserved
+        data['available_qty'] = available_matrix
+        data['reserved_qty'] = reserved_matrix
+    return Response(data, status=status.HTTP_200_OK)
 
+
+@query_budget(10)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_order(request):
     try:
         with transaction.atomic():
@@ -135,76 +395,66 @@ def create_order(request):
             if not order_items_data or not isinstance(order_items_data, list):
                 raise ValueError('Invalid order items data format')
             
-            branch_id = order_data.get('branch')
             try:
-                branch = Branches.objects.get(pk=branch_id)
-            except Branches.DoesNotExist:
+                branch = Branches.objects.get(pk=_parse_id(order_data.get('branch')))
+            except (TypeError, ValueError, Branches.DoesNotExist):
                 raise ValueError('Invalid branch')
             
             try:
-                default_status = StatusDimension.objects.get(
-                    entity_type='order',
-                    status_name='Processing'
-                )
+                default_status_id = status_registry.get_id('order', 'Processing')
             except StatusDimension.DoesNotExist:
                 raise ValueError('Default order status (Processing) not found')
             
-            order_items_to_create = []
-            inventory_updates = []
+            quantities = {}
             for item_data in order_items_data:
                 if not isinstance(item_data, dict) or 'product' not in item_data or 'quantity' not in item_data:
                     raise ValueError('Invalid order item format')
-                
-                product_id = item_data.get('product')
-                quantity = item_data.get('quantity')
-                
                 try:
-                    product = Products.objects.get(pk=product_id)
-                except Products.DoesNotExist:
-                    raise ValueError(f'Product {product_id} not found')
-                
-                inventory = Inventory.objects.filter(
-                    product=product,
-                    branch=branch
-                ).first()
-                
-                if not inventory or inventory.available_qty < quantity:
-                    raise ValueError(f'Insufficient stock for product {product.name} at branch {branch.name}')
-                
-                item_data['price'] = product.unit_price or 0
-                order_items_to_create.append(item_data)
-                inventory_updates.append((inventory, quantity))
+                    product_id = _parse_id(item_data.get('product'))
+                    quantity = int(item_data.get('quantity'))
+                except (TypeError, ValueError):
+                    raise ValueError('Invalid order item format')
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+                # Quantities past the integer column would overflow in the UPDATE.
+                if quantity < 1 or quantities[product_id] > MAX_INTEGER:
+                    raise ValueError('Invalid order item format')
+
+            reserved = reserve_inventory(branch, quantities)
             
             order_data['user'] = request.user.id
-            order_data['status'] = default_status.pk
+            order_data['status'] = default_status_id
             order_data['created_at'] = timezone.now()
             order_serializer = OrdersSerializer(data=order_data)
             if not order_serializer.is_valid():
                 raise ValueError(order_serializer.errors)
             order = order_serializer.save()
             
+            # Items were validated above and their products loaded by the
+            # reservation, so they are inserted directly in one statement.
             order_items_created = []
-            for item_data in order_items_to_create:
-                item_data['order'] = order.pk
-                item_serializer = OrderItemsSerializer(data=item_data)
-                if not item_serializer.is_valid():
-                    raise ValueError(f'Invalid order item data: {item_serializer.errors}')
-                order_item = item_serializer.save()
-                order_items_created.append(order_item)
-            
-            for inventory, quantity in inventory_updates:
-                inventory.available_qty -= quantity
-                inventory.reserved_qty += quantity
-                inventory.save()
+            for item_data in order_items_data:
+                product = reserved[int(item_data['product'])].product
+                order_items_created.append(OrderItems(
+                    order=order,
+                    product=product,
+                    quantity=int(item_data['quantity']),
+                    price=product.unit_price or 0,
+                ))
+            order_items_created = OrderItems.objects.bulk_create(order_items_created)
             
             return Response(
                 {
-                    'order': OrdersSerializer(order).data,
+                    'order': OrdersSerializer(order, context={'order_items': order_items_created}).data,
                     'order_items': OrderItemsSerializer(order_items_created, many=True).data
                 },
                 status=status.HTTP_201_CREATED
             )
     
+    except InsufficientStockError as e:
+        return Response(
+            {'error': str(e), 'shortages': e.shortages},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     except ValueError as e:
         return Response(
             {'error': str(e)},
@@ -216,13 +466,218 @@ def create_order(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
     
+@query_budget(4)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_orders(request):
     user = request.user
-    paginator = StandardResultsSetPagination()
+    if _use_cursor_pagination(request):
+        paginator = KeysetCursorPagination()
+        paginator.ordering = ('-created_at', '-order_id')
+    else:
+        paginator = StandardResultsSetPagination()
     paginator.page_size = 3
-    orders = Orders.objects.filter(user_id=user.id).prefetch_related('orderitems_set')
+    orders = Orders.objects.filter(user_id=user.id).order_by('-created_at', '-order_id')
+    if _parse_bool(request.query_params.get('expand', False)):
+        orders = orders.select_related('branch').prefetch_related(
+            Prefetch('orderitems_set', queryset=OrderItems.objects.select_related('product'))
+        )
+        serializer_class = OrderHistorySerializer
+    else:
+        orders = orders.prefetch_related('orderitems_set')
+        serializer_class = OrdersSerializer
     paginated_orders = paginator.paginate_queryset(orders, request)
-    serializer = OrdersSerializer(paginated_orders, many=True)
+    serializer = serializer_class(paginated_orders, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@query_budget(2)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def ingest_events(request):
+    events = request.data.get('events') if isinstance(request.data, dict) else None
+    if not isinstance(events, list):
+        return Response({'error': 'events must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(events) > MAX_EVENTS_PER_REQUEST:
+        return Response(
+            {'error': f'At most {MAX_EVENTS_PER_REQUEST} events per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    # Buffered rows from many users are flushed together, so a missing
+    # profile must be caught here rather than fail someone else's batch.
+    # Authentication has already loaded the profile.
+    if not hasattr(request.user, 'users'):
+        return Response({'error': 'User profile not found'}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows, rejected = validate_events(request.user.id, events)
+    dropped = event_queue.put(rows)
+    return Response(
+        {'accepted': len(rows) - dropped, 'dropped': dropped, 'rejected': rejected},
+        status=status.HTTP_202_ACCEPTED
+    )
+
+
+@query_budget(1)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_event_stats(request):
+    return Response(event_queue.stats(), status=status.HTTP_200_OK)
+
+
+@query_budget(1)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_request_stats(request):
+    return Response(request_metrics.summary(), status=status.HTTP_200_OK)
+
+
+@query_budget(3)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_points_summary(request):
+    user_id = request.user.id
+    balance = UserPointBalances.objects.filter(user_id=user_id).first()
+    since = timezone.localdate() - timedelta(days=6)
+    days = UserDailyRollups.objects.filter(user_id=user_id, day__gte=since).order_by('day')
+    return Response({
+        'points': balance.points if balance else 0,
+        'time_spent_seconds': balance.time_spent_seconds if balance else 0,
+        'last_7_days': UserDailyRollupsSerializer(days, many=True).data,
+    }, status=status.HTTP_200_OK)
+
+
+@query_budget(3)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_leaderboard(request):
+    try:
+        limit = max(1, min(int(request.query_params.get('limit', 10)), 100))
+    except ValueError:
+        return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    ranked = leaderboard.top(limit)
+    usernames = dict(
+        User.objects.filter(id__in=[user_id for _, user_id, _ in ranked]).values_list('id', 'username')
+    )
+    return Response([
+        {'rank': rank, 'user_id': user_id, 'username': usernames.get(user_id), 'points': points}
+        for rank, user_id, points in ranked
+    ], status=status.HTTP_200_OK)
+
+
+@query_budget(2)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_my_rank(request):
+    rank, points, total = leaderboard.rank(request.user.id)
+    return Response({'rank': rank, 'points': points, 'total': total}, status=status.HTTP_200_OK)
+
+
+class ReviewQueuePagination(KeysetCursorPagination):
+    # Served by prescriptions_queue_idx.
+    ordering = ('submitted_at', 'prescription_id')
+
+
+@query_budget(3)
+@api_view(['GET'])
+@permission_classes([IsPharmacist])
+def get_review_queue(request):
+    paginator = ReviewQueuePagination()
+    prescriptions = paginator.paginate_queryset(review_queue(request.user.id), request)
+    serializer = ReviewQueueSerializer(prescriptions, many=True)
     return paginator.get_paginated_response(serializer.data)
+
+
+@query_budget(7)
+@api_view(['POST'])
+@permission_classes([IsPharmacist])
+@idempotent
+def claim_review_queue(request):
+    if not isinstance(request.data, dict):
+        return Response({'error': 'Request body must be an object'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = max(1, min(int(request.data.get('limit', 10)), 50))
+    except (TypeError, ValueError):
+        return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    claimed = claim_prescriptions(request.user.id, limit)
+    prescriptions = review_queryset().filter(pk__in=claimed).order_by('submitted_at', 'prescription_id') if claimed else []
+    return Response({'claimed': ReviewQueueSerializer(prescriptions, many=True).data}, status=status.HTTP_200_OK)
+
+
+@query_budget(6)
+@api_view(['POST'])
+@permission_classes([IsPharmacist])
+@idempotent
+def decide_prescriptions(request):
+    entries = request.data.get('decisions') if isinstance(request.data, dict) else None
+    if not isinstance(entries, list) or not entries:
+        return Response({'error': 'decisions must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(entries) > MAX_DECISIONS:
+        return Response(
+            {'error': f'At most {MAX_DECISIONS} decisions per request'}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Malformed entries are reported in place; the rest are recorded together.
+    results = [None] * len(entries)
+    valid = []
+    for index, entry in enumerate(entries):
+        serializer = PrescriptionDecisionSerializer(data=entry if isinstance(entry, dict) else {})
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            prescription = entry.get('prescription') if isinstance(entry, dict) else None
+            results[index] = {'prescription': prescription, 'recorded': False, 'error': serializer.errors}
+    try:
+        recorded = record_decisions(request.user.id, [data for _, data in valid])
+    except StaleReviewError as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+    for (index, _), result in zip(valid, recorded):
+        results[index] = result
+
+    return Response({
+        'recorded': sum(result['recorded'] for result in results),
+        'failed': sum(not result['recorded'] for result in results),
+        'results': results,
+    }, status=status.HTTP_200_OK)
+
+
+@query_budget(11)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent
+def create_prescription_order(request, prescription_id):
+    # @idempotent replays retries while their stored response lasts; the key
+    # is also kept on the order so a retry after that still finds it.
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not isinstance(request.data, dict):
+        return Response({'error': 'Request body must be an object'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        branch_id = int(request.data.get('branch'))
+    except (TypeError, ValueError):
+        return Response({'error': 'Invalid branch'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        try:
+            with transaction.atomic():
+                order, order_items, created = order_prescription(request.user.id, prescription_id, branch_id, key)
+        except IntegrityError:
+            if key is None:
+                raise
+            # A concurrent retry with the same key committed its order first.
+            with transaction.atomic():
+                order, order_items, created = order_prescription(request.user.id, prescription_id, branch_id, key)
+    except Prescriptions.DoesNotExist:
+        return Response({'error': 'Prescription not found'}, status=status.HTTP_404_NOT_FOUND)
+    except AlreadyOrderedError as e:
+        return Response({'error': str(e), 'order': e.order_id}, status=status.HTTP_409_CONFLICT)
+    except InsufficientStockError as e:
+        return Response({'error': str(e), 'shortages': e.shortages}, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(
+        {
+            'order': OrdersSerializer(order, context={'order_items': order_items}).data,
+            'order_items': OrderItemsSerializer(order_items, many=True).data,
+        },
+        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+    )
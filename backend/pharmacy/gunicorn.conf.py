@@ -0,0 +1,7 @@
+# Loaded automatically by gunicorn when started from this directory.
+
+
+def worker_exit(server, worker):
+    # Write out analytics events still queued in this worker before it exits.
+    from api.ingest import event_queue
+    event_queue.stop(timeout=10)
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pharmacy.settings')
+# Disables persistent connections by default; see DB_CONN_MAX_AGE in settings.
+os.environ['PHARMACY_ASGI'] = '1'
 
 application = get_asgi_application()
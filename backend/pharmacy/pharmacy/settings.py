@@ -48,6 +48,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'corsheaders',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'rest_framework_simplejwt.token_blacklist',
@@ -56,10 +57,12 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.ProfileJWTAuthentication',
     ),
 }
 
+AUTHENTICATION_BACKENDS = ['api.authentication.ProfileModelBackend']
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
@@ -71,6 +74,7 @@ SIMPLE_JWT = {
 }
 
 MIDDLEWARE = [
+    'api.instrumentation.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,7 +83,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.middleware.AsyncWhiteNoiseMiddleware',
 ]
 
 # CORS_ALLOWED_ORIGINS = [
@@ -126,10 +130,102 @@ load_dotenv('.env')
 # Build the database URL from environment variables
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
-# Configure DATABASES with connection pooling and max age
+def env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes')
+
+# Persistent connections: reuse a connection for DB_CONN_MAX_AGE seconds
+# (0 closes it after every request), checking it is still alive before reuse.
+# Under ASGI each request's sync code runs in its own thread context, so a
+# kept request connection is never reused and just stays open: pharmacy.asgi
+# sets PHARMACY_ASGI and the default drops to 0 (use DB_POOL for reuse).
+# The async views' concurrently() runs on executor threads that persist, so
+# their connections are kept for DB_WORKER_CONN_MAX_AGE seconds regardless.
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 0 if env_bool('PHARMACY_ASGI', False) else 60))
+DB_WORKER_CONN_MAX_AGE = int(os.environ.get('DB_WORKER_CONN_MAX_AGE', 60))
+DB_CONN_HEALTH_CHECKS = env_bool('DB_CONN_HEALTH_CHECKS', True)
+
 DATABASES = {
-    'default': dj_database_url.parse(DATABASE_URL, conn_max_age=0)
+    'default': dj_database_url.parse(
+        DATABASE_URL,
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=DB_CONN_HEALTH_CHECKS,
+    )
 }
+
+# Optional in-process pool (PostgreSQL with psycopg 3 and psycopg[pool] only).
+# Django requires persistent connections to be disabled when pooling.
+if env_bool('DB_POOL', False):
+    if DATABASES['default']['ENGINE'] != 'django.db.backends.postgresql':
+        from django.core.exceptions import ImproperlyConfigured
+        raise ImproperlyConfigured('DB_POOL needs a PostgreSQL DATABASE_URL')
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+        'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    }
+# Cache
+# Local memory by default; set REDIS_URL so every worker shares cached
+# responses and their invalidation versions.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'pharmacy',
+        }
+    }
+
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300))
+PROFILE_CACHE_TIMEOUT = int(os.environ.get('PROFILE_CACHE_TIMEOUT', 3600))
+
+# Product search: 'database' uses PostgreSQL full-text search, 'memory' the
+# in-process index, 'auto' picks 'database' on PostgreSQL with a UTF8 database.
+PRODUCT_SEARCH_BACKEND = os.environ.get('PRODUCT_SEARCH_BACKEND', 'auto')
+
+# Telemetry events are written in bulk by a background thread once this many
+# are pending or the oldest has waited this many seconds. At most
+# EVENT_QUEUE_CAPACITY events are held; when full, 'block' waits up to
+# EVENT_QUEUE_PUT_TIMEOUT seconds for room before dropping, 'drop' drops at once.
+EVENT_BUFFER_MAX_SIZE = int(os.environ.get('EVENT_BUFFER_MAX_SIZE', 500))
+EVENT_BUFFER_MAX_DELAY = float(os.environ.get('EVENT_BUFFER_MAX_DELAY', 5))
+EVENT_QUEUE_CAPACITY = int(os.environ.get('EVENT_QUEUE_CAPACITY', 20000))
+EVENT_QUEUE_POLICY = os.environ.get('EVENT_QUEUE_POLICY', 'block')
+EVENT_QUEUE_PUT_TIMEOUT = float(os.environ.get('EVENT_QUEUE_PUT_TIMEOUT', 0.5))
+# Events keep the timestamp the client sent if it is at most
+# EVENT_MAX_CLOCK_SKEW seconds ahead of the server and EVENT_MAX_AGE seconds old.
+EVENT_MAX_CLOCK_SKEW = int(os.environ.get('EVENT_MAX_CLOCK_SKEW', 300))
+EVENT_MAX_AGE = int(os.environ.get('EVENT_MAX_AGE', 7 * 86400))
+
+# Each worker's in-memory points leaderboard is re-read from
+# user_point_balances this often, to pick up other workers' transactions.
+LEADERBOARD_REFRESH_SECONDS = float(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 300))
+
+# Per-request query counts and timings (Server-Timing header, admin stats at
+# /api/requests/stats) keep the last REQUEST_METRICS_WINDOW requests per
+# endpoint; N_PLUS_ONE_THRESHOLD identical SQL shapes in one request are logged.
+REQUEST_METRICS_WINDOW = int(os.environ.get('REQUEST_METRICS_WINDOW', 1000))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+
+# A pharmacist's claim on a prescription in the review queue lapses after
+# this many seconds without a decision, returning it to the queue.
+PRESCRIPTION_CLAIM_TIMEOUT = int(os.environ.get('PRESCRIPTION_CLAIM_TIMEOUT', 900))
+
+# Responses to POSTs sent with an Idempotency-Key are replayed for
+# IDEMPOTENCY_KEY_TTL seconds. A retry that arrives while the first request
+# is still running waits up to IDEMPOTENCY_WAIT_SECONDS for it; a key left
+# unfinished for IDEMPOTENCY_LOCK_TIMEOUT seconds (a crashed worker) is freed.
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 86400))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 5))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.environ.get('IDEMPOTENCY_LOCK_TIMEOUT', 60))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 